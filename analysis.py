@@ -5,7 +5,7 @@ import io
 import google.generativeai as genai
 from flask_cors import CORS
 from db_file_system import DBFileSystem
-from db_system_integration import apply_patches
+from dataset_store import DatasetStore
 from dotenv import load_dotenv
 load_dotenv()
 app = Flask(__name__)
@@ -13,10 +13,10 @@ CORS(app)  # Enable CORS for all routes
 
 # Initialize the database file system
 db_fs = DBFileSystem()
-fs_adapter = apply_patches()
 
 # Virtual storage directory for uploaded files
 DATASETS_DIR = 'datasets'
+dataset_store = DatasetStore(db_fs, DATASETS_DIR)
 uploaded_files = {}
 
 # Configure Gemini API with key from environment variables
@@ -90,18 +90,15 @@ def upload_file():
             filename = file.filename
             
             try:
-                # Read file content directly
+                # Parse the upload once, in chunks, into columnar database storage
                 file.seek(0)
-                file_content = file.read()
-                
-                # Save to database storage using file content
-                db_fs.save_file_content(file_content, filename, DATASETS_DIR)
+                dataset_store.save_csv(file.stream, filename)
                 
                 # Store filename for later use
                 uploaded_files[filename] = filename
                 
-                # Create DataFrame from content for preview
-                df = pd.read_csv(io.BytesIO(file_content))
+                # Read only the rows needed for the preview
+                df = dataset_store.head(filename, 3)
                 
                 preview = df.head(3).to_dict('records')
                 columns = df.columns.tolist()
@@ -125,16 +122,13 @@ def query_csv():
     filename = data['filename']
     query = data['query']
     
-    # Check if file exists in the database
-    if not db_fs.file_exists(filename, DATASETS_DIR):
+    # Check if the dataset exists in the database
+    if dataset_store.resolve(filename) is None:
         return jsonify({"success": False, "error": "File not found in database"})
     
     try:
-        # Get file content from database
-        file_content = db_fs.get_file(filename, DATASETS_DIR)
-        
-        # Read the content into a DataFrame
-        df = pd.read_csv(io.BytesIO(file_content))
+        # Load the columnar dataset into a DataFrame
+        df = dataset_store.read(filename)
         
         # Use the chat_with_csv function with Gemini
         result = chat_with_csv(df, query)
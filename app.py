@@ -1,41 +1,54 @@
 from flask import Flask, request, jsonify, send_file
+from werkzeug.datastructures import FileStorage
 import pandas as pd
 import os
 import io
 import zipfile
 import shutil
 import uuid
+import datetime
 import json
 import logging
 from data_handling import download_kaggle_dataset, generate_dataset_from_text, process_dataset_folder, auto_detect_task_type
 from preprocessing import preprocess_dataset, preprocess_image_dataset
-from model_training import train_models, train_image_classification_model, train_yolo_model, save_best_model
+from model_training import train_models, train_image_classification_model, train_yolo_model
+from cnn_models import CNN_BACKBONE, backbone_weights_file
 from visualization import create_visualization, fig_to_base64
 from visualization_cnn import create_cnn_visualization  # Import the CNN visualization module
 from visualization_object import create_object_detection_visualization  # Import the object detection visualization module
 from utils import generate_loading_code, write_requirements_file, create_project_zip
-from db_system_integration import apply_patches
+from db_file_system import DBFileSystem
+from file_system_adapter import FileSystemAdapter
+from job_queue import JobQueue, QueueFull, start_workers
 
 # Initialize Flask app
 app = Flask(__name__)
 
-db_fs = apply_patches()
+# Database file system and the virtual filesystem used for 'ml_system/...' paths
+db_fs = DBFileSystem()
+vfs = FileSystemAdapter(db_fs=db_fs)
 
 # Create directories in the specified path
 BASE_DIR = "ml_system"
-os.makedirs(BASE_DIR, exist_ok=True)
+vfs.makedirs(BASE_DIR, exist_ok=True)
 
 # Create a directory for storing datasets
 DATASETS_DIR = os.path.join(BASE_DIR, 'datasets')
-os.makedirs(DATASETS_DIR, exist_ok=True)
+vfs.makedirs(DATASETS_DIR, exist_ok=True)
 
 # Create a directory for storing models
 MODELS_DIR = os.path.join(BASE_DIR, 'models')
-os.makedirs(MODELS_DIR, exist_ok=True)
+vfs.makedirs(MODELS_DIR, exist_ok=True)
 
 # Create a directory for storing downloads
 DOWNLOADS_DIR = os.path.join(BASE_DIR, 'downloads')
-os.makedirs(DOWNLOADS_DIR, exist_ok=True)
+vfs.makedirs(DOWNLOADS_DIR, exist_ok=True)
+
+# Training runs are queued and executed by local worker processes
+job_queue = JobQueue(db_fs.db_path)
+
+# Workspaces of jobs that finished longer ago than this are removed
+WORKSPACE_RETENTION_HOURS = float(os.getenv('ML_WORKSPACE_RETENTION_HOURS', 24))
 
 # Set up logging
 logger = logging.getLogger(__name__)
@@ -62,36 +75,42 @@ try:
 except ImportError:
     YOLO_AVAILABLE = False
 
-# ===== FLASK ROUTES =====
+# ===== PROCESSING JOBS =====
 
-@app.route('/process', methods=['POST'])
-def process():
-    """Process the uploaded data and train a model"""
+def run_process_job(params, progress):
+    """Process the submitted data and train a model; runs in a job worker (see job_queue.py)"""
     try:
-        # Get form data
-        task_type = request.form.get('task_type', 'classification')
-        text_prompt = request.form.get('text_prompt', '')
+        # Get job parameters
+        task_type = params.get('task_type', 'classification')
+        text_prompt = params.get('text_prompt', '')
         
         logger.info(f"Processing request - Task Type: {task_type}")
         
+        # Each job reads and writes only its own workspace, so concurrent jobs never
+        # clear or overwrite each other's datasets, models and downloads
+        job_id = params['job_id']
+        workspace_dir = os.path.join(BASE_DIR, db_fs.create_workspace(job_id))
+        datasets_dir = os.path.join(workspace_dir, 'datasets')
+        models_dir = os.path.join(workspace_dir, 'models')
+        downloads_dir = os.path.join(workspace_dir, 'downloads')
+        
         # Initialize variables
         df = None
         dataset_folder = None
         dataset_info = None
         detected_task_type = None
         
+        progress(0.05, 'Loading dataset')
+        
         # Check if a file was uploaded
-        # Check if a file was uploaded
-        if 'file' in request.files and request.files['file'].filename != '':
-            file = request.files['file']
-
-            for existing_file in os.listdir(DATASETS_DIR):
-             os.remove(os.path.join(DATASETS_DIR, existing_file))
-    
-    # Save the file directly to DATASETS_DIR instead of TEMP_DIR
-            file_path = os.path.join(DATASETS_DIR, file.filename)
-            file.save(file_path)
-    
+        if params.get('file'):
+            upload_path = params['file']
+            
+            # Move the staged upload into the workspace's datasets
+            file_path = os.path.join(datasets_dir, os.path.basename(upload_path))
+            with vfs.open(upload_path, 'rb') as src, vfs.open(file_path, 'wb') as dst:
+                shutil.copyfileobj(src, dst)
+            
             # Auto-detect task type from the file
             detected_task_type, df_loaded = auto_detect_task_type(file_path)
             df = df_loaded  # Use the loaded dataframe from auto-detection
@@ -104,10 +123,12 @@ def process():
                 task_type = detected_task_type
         
         # Check if a folder zip was uploaded
-        elif 'folder_zip' in request.files and request.files['folder_zip'].filename != '':
-            folder_zip = request.files['folder_zip']
-            dataset_info = process_dataset_folder(folder_zip, task_type, DATASETS_DIR)
-            dataset_folder = DATASETS_DIR
+        elif params.get('folder_zip'):
+            upload_path = params['folder_zip']
+            with vfs.open(upload_path, 'rb') as stream:
+                folder_zip = FileStorage(stream=stream, filename=os.path.basename(upload_path))
+                dataset_info = process_dataset_folder(folder_zip, task_type, datasets_dir)
+            dataset_folder = datasets_dir
             
             # For folder uploads, the task type is typically determined by the folder structure
             # We maintain the user-selected task type for image_classification and object_detection
@@ -115,7 +136,7 @@ def process():
         # Try to download from Kaggle if text prompt is provided
         elif text_prompt:
             # First try Kaggle
-            kaggle_result = download_kaggle_dataset(text_prompt, DATASETS_DIR)
+            kaggle_result = download_kaggle_dataset(text_prompt, datasets_dir)
             
             if isinstance(kaggle_result, tuple) and len(kaggle_result) == 2:
                 # Unpack the result containing file path and detected task type
@@ -124,9 +145,10 @@ def process():
                 # For backward compatibility if the function wasn't updated
                 kaggle_file = kaggle_result
                 detected_task_type = None
-                
+            
             if kaggle_file:
-                df = pd.read_csv(kaggle_file)
+                with vfs.open(kaggle_file, 'rb') as f:
+                    df = pd.read_csv(f)
                 logger.info(f"Dataset downloaded from Kaggle: {kaggle_file}")
                 
                 # Use detected task type if available
@@ -137,7 +159,7 @@ def process():
                         task_type = detected_task_type
             else:
                 # If Kaggle fails, generate synthetic data
-                generation_result = generate_dataset_from_text(text_prompt)
+                generation_result = generate_dataset_from_text(text_prompt, datasets_dir)
                 
                 if isinstance(generation_result, tuple) and len(generation_result) == 2:
                     # Unpack the result containing dataframe and detected task type
@@ -158,19 +180,22 @@ def process():
         
         # Return error if no data was provided
         else:
-            return jsonify({'error': 'No data provided. Please upload a file, folder, or provide a text prompt.'})
+            return {'error': 'No data provided. Please upload a file, folder, or provide a text prompt.'}
         
         # Process data and train model
         if df is not None:
             # Preprocess data
+            progress(0.2, 'Preprocessing data')
             X_train, X_test, y_train, y_test, preprocessor, feature_names = preprocess_dataset(df, task_type)
             
             # Train model
+            progress(0.3, 'Training models')
             best_model, best_model_name, best_score, y_pred = train_models(
-                X_train, y_train, X_test, y_test, task_type, MODELS_DIR
+                X_train, y_train, X_test, y_test, task_type, models_dir, preprocessor=preprocessor
             )
             
             # Create visualizations
+            progress(0.8, 'Creating visualizations')
             visualizations = create_visualization(task_type, y_test, y_pred, best_model, X_test, feature_names, text_prompt)
             
             # Create data preview
@@ -179,21 +204,22 @@ def process():
                 'data': df.head(10).values.tolist()
             }
             
-            # Save model
+            # train_models saved the fitted preprocessing and the model as one pipeline
             model_file = "best_model.pkl"
-            save_best_model(best_model, MODELS_DIR)
+            is_text_model = task_type == 'nlp'
             
             # Generate loading code
-            generate_loading_code(model_file, feature_names, DOWNLOADS_DIR)
+            progress(0.95, 'Packaging the project')
+            generate_loading_code(model_file, feature_names, downloads_dir, preprocessor=preprocessor)
             
             # Write requirements file
-            write_requirements_file(DOWNLOADS_DIR)
+            write_requirements_file(downloads_dir, is_text=is_text_model)
             
             # Create project ZIP
-            zip_path = create_project_zip(model_file, MODELS_DIR, DOWNLOADS_DIR)
+            zip_path = create_project_zip(model_file, models_dir, downloads_dir, is_text_model=is_text_model)
             
             # Return results
-            return jsonify({
+            return {
                 'success': True,
                 'detected_task_type': task_type,  # Add detected task type
                 'model_info': {
@@ -205,20 +231,28 @@ def process():
                 'visualizations': {
                     'plots': visualizations
                 },
-                'download_url': f'/api/download/{os.path.basename(zip_path)}'
-            })
+                'download_url': f'/api/download/{os.path.basename(zip_path)}?workspace={job_id}'
+            }
         
         elif dataset_folder is not None:
             # Check for image classification task
             if task_type == 'image_classification':
                 # Check if TensorFlow is available
                 if not TENSORFLOW_AVAILABLE:
-                    return jsonify({
+                    return {
                         'error': 'TensorFlow is required for image classification but not available. Please install TensorFlow.'
-                    })
+                    }
+                
+                # Transfer learning needs its backbone weights on local disk; check before any work
+                if CNN_BACKBONE:
+                    try:
+                        backbone_weights_file()
+                    except FileNotFoundError as e:
+                        return {'error': str(e)}
                 
                 try:
                     # Process image classification dataset
+                    progress(0.2, 'Preprocessing images')
                     X_train, X_test, y_train, y_test, preprocessor, feature_names = preprocess_image_dataset(dataset_folder)
                     
                     # Access the training and test generators from the preprocessor
@@ -227,12 +261,13 @@ def process():
                     testing_generator = preprocessor.get('testing_generator') or X_test
                     
                     # Train CNN model
+                    progress(0.3, 'Training the CNN')
                     best_model, best_model_name, best_score, y_pred, history = train_image_classification_model(
                         training_generator=training_generator,
                         validation_generator=validation_generator,
                         test_generator=testing_generator,
                         dataset_folder=dataset_folder,
-                        models_dir=MODELS_DIR,
+                        models_dir=models_dir,
                         epochs=10,
                         learning_rate=0.001,
                         batch_size=32,
@@ -241,6 +276,7 @@ def process():
                     )
                     
                     # Create CNN visualizations using the specialized module
+                    progress(0.8, 'Creating visualizations')
                     visualizations = create_cnn_visualization(
                         best_model,
                         training_generator,
@@ -249,20 +285,20 @@ def process():
                         user_prompt=text_prompt
                     )
                     
-                    # Model is automatically saved to MODELS_DIR/best_model.keras by the updated function
+                    # Model is automatically saved to models_dir/best_model.keras by the updated function
                     model_file = "best_model.keras"
                     
                     # Generate loading code
-                    generate_loading_code(model_file, feature_names, DOWNLOADS_DIR, is_image_model=True)
+                    generate_loading_code(model_file, feature_names, downloads_dir, is_image_model=True)
                     
                     # Write requirements file
-                    write_requirements_file(DOWNLOADS_DIR, is_tensorflow=True)
+                    write_requirements_file(downloads_dir, is_tensorflow=True)
                     
                     # Create project ZIP
-                    zip_path = create_project_zip(model_file, MODELS_DIR, DOWNLOADS_DIR, is_image_model=True)
+                    zip_path = create_project_zip(model_file, models_dir, downloads_dir, is_image_model=True)
                     
                     # Return results with visualizations
-                    return jsonify({
+                    return {
                         'success': True,
                         'detected_task_type': task_type,  # Add detected task type
                         'model_info': {
@@ -274,32 +310,34 @@ def process():
                         'visualizations': {
                             'plots': visualizations
                         },
-                        'download_url': f'/api/download/{os.path.basename(zip_path)}'
-                    })
+                        'download_url': f'/api/download/{os.path.basename(zip_path)}?workspace={job_id}'
+                    }
                 except Exception as e:
                     import traceback
                     traceback.print_exc()
-                    return jsonify({
+                    return {
                         'error': f'Error processing image classification dataset: {str(e)}'
-                    })
+                    }
             
             # Check for object detection task
             elif task_type == "object_detection":
                 # Check if YOLO is available
                 if not YOLO_AVAILABLE:
-                    return jsonify({
+                    return {
                         'error': 'YOLO is required for object detection but not available. Please install ultralytics and torch.'
-                    })
+                    }
                 
                 try:
                     # Train YOLO model
+                    progress(0.2, 'Training the YOLO model')
                     best_model, best_model_name, best_score, metrics_info = train_yolo_model(
-                        dataset_folder, MODELS_DIR
+                        dataset_folder, models_dir
                     )
                     
                     # Create visualizations using the specialized object detection module
+                    progress(0.8, 'Creating visualizations')
                     visualizations = create_object_detection_visualization(
-                        MODELS_DIR,
+                        models_dir,
                         dataset_folder,
                         metrics_info,
                         text_prompt
@@ -309,16 +347,16 @@ def process():
                     model_file = "best_model.pt"
                     
                     # Generate loading code
-                    generate_loading_code(model_file, None, DOWNLOADS_DIR, is_object_detection=True)
+                    generate_loading_code(model_file, None, downloads_dir, is_object_detection=True)
                     
                     # Write requirements file
-                    write_requirements_file(DOWNLOADS_DIR, is_yolo=True)
+                    write_requirements_file(downloads_dir, is_yolo=True)
                     
                     # Create project ZIP
-                    zip_path = create_project_zip(model_file, MODELS_DIR, DOWNLOADS_DIR, is_object_detection=True)
+                    zip_path = create_project_zip(model_file, models_dir, downloads_dir, is_object_detection=True)
                     
                     # Return results with enhanced model info
-                    return jsonify({
+                    return {
                         'success': True,
                         'detected_task_type': task_type,  # Add detected task type
                         'model_info': {
@@ -333,73 +371,133 @@ def process():
                         'visualizations': {
                             'plots': visualizations
                         },
-                        'download_url': f'/api/download/{os.path.basename(zip_path)}'
-                    })
+                        'download_url': f'/api/download/{os.path.basename(zip_path)}?workspace={job_id}'
+                    }
                 except Exception as e:
                     import traceback
                     traceback.print_exc()
-                    return jsonify({
+                    return {
                         'error': f'Error processing object detection dataset: {str(e)}'
-                    })
+                    }
             
             else:
-                return jsonify({
+                return {
                     'error': f'Task type {task_type} not supported for the uploaded dataset.'
-                })
+                }
         
         else:
-            return jsonify({'error': 'Failed to process data.'})
+            return {'error': 'Failed to process data.'}
     
     except Exception as e:
         import traceback
         traceback.print_exc()
-        return jsonify({'error': str(e)})
+        return {'error': str(e)}
+    finally:
+        # The staged upload has been copied or extracted by now
+        upload_dir = os.path.join(BASE_DIR, db_fs.workspace_directory(params['job_id'], 'uploads'))
+        if vfs.exists(upload_dir):
+            vfs.rm(upload_dir, recursive=True)
+
+def remove_expired_workspaces():
+    """Remove the workspaces of jobs that finished more than WORKSPACE_RETENTION_HOURS ago"""
+    cutoff = datetime.datetime.now() - datetime.timedelta(hours=WORKSPACE_RETENTION_HOURS)
+    expired = set(job_queue.finished_before(cutoff))
+    for workspace_id in db_fs.list_workspaces():
+        if workspace_id in expired:
+            db_fs.remove_workspace(workspace_id)
+            logger.info(f"Removed expired workspace {workspace_id}")
+
+# ===== FLASK ROUTES =====
+
+@app.route('/process', methods=['POST'])
+def process():
+    """Queue the submitted data for processing; poll /api/jobs/<job_id> for the result"""
+    job_id = uuid.uuid4().hex
+    params = {
+        'job_id': job_id,
+        'task_type': request.form.get('task_type', 'classification'),
+        'text_prompt': request.form.get('text_prompt', ''),
+    }
+    
+    try:
+        # Stage the upload in the database so the worker process can read it
+        for field in ('file', 'folder_zip'):
+            upload = request.files.get(field)
+            if upload is not None and upload.filename != '':
+                upload_path = os.path.join(BASE_DIR, db_fs.workspace_directory(job_id, 'uploads'),
+                                           os.path.basename(upload.filename))
+                with vfs.open(upload_path, 'wb') as dst:
+                    upload.save(dst)
+                params[field] = upload_path
+                break
+        
+        if not (params.get('file') or params.get('folder_zip') or params['text_prompt']):
+            return jsonify({'error': 'No data provided. Please upload a file, folder, or provide a text prompt.'}), 400
+        
+        remove_expired_workspaces()
+        job_queue.submit('app:run_process_job', params, job_id=job_id)
+        start_workers(job_queue.db_path)
+        logger.info(f"Queued job {job_id} - Task Type: {params['task_type']}")
+    except Exception as e:
+        db_fs.remove_workspace(job_id)
+        if isinstance(e, QueueFull):
+            return jsonify({'error': f'The server is busy: {str(e)}'}), 503
+        logger.error(f"Error queueing job: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+    
+    return jsonify({
+        'job_id': job_id,
+        'status': 'queued',
+        'status_url': f'/api/jobs/{job_id}'
+    }), 202
+
+@app.route('/api/jobs/<job_id>', methods=['GET'])
+def job_status(job_id):
+    """Return the status and progress of a processing job, and its result once finished"""
+    job = job_queue.get(job_id)
+    if job is None:
+        return jsonify({'error': f'Job not found: {job_id}'}), 404
+    return jsonify(job)
 
 @app.route('/api/download/<filename>', methods=['GET'])
 def download(filename):
-    """Download a file from database or filesystem"""
+    """Download a file from database or filesystem; ?workspace=<job_id> selects a job's downloads"""
+    workspace = request.args.get('workspace')
+    try:
+        directory_name = db_fs.workspace_directory(workspace, 'downloads') if workspace else 'downloads'
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    downloads_dir = os.path.join(BASE_DIR, directory_name)
+    
     try:
-        import tempfile
-        
         # Check if we're using database storage
         if db_fs is not None:
             try:
-                # Get the file from database
-                temp_dir = tempfile.gettempdir()
-                temp_path = os.path.join(temp_dir, filename)
-                
-                # Save to a temporary file
-                content = db_fs.get_file(filename, 'downloads')  # Always use 'downloads' directory name
-                
-                if not content:
-                    logger.error(f"File not found in database: {filename}")
-                    return jsonify({'error': f'File not found in database: {filename}'}), 404
+                # Stream the file straight out of the database in constant memory
+                stream = db_fs.open_read(filename, directory_name)
                 
-                with open(temp_path, 'wb') as f:
-                    f.write(content)
-                
-                # Return the file and remove it after sending
-                return send_file(temp_path, as_attachment=True, download_name=filename)
+                return send_file(stream, as_attachment=True, download_name=filename)
             except Exception as db_error:
                 logger.error(f"Database file retrieval error: {str(db_error)}")
                 
                 # Fallback to filesystem approach if database fails
-                if os.path.exists(os.path.join(DOWNLOADS_DIR, filename)):
+                if vfs.exists(os.path.join(downloads_dir, filename)):
                     logger.info(f"Falling back to filesystem for file: {filename}")
-                    return send_file(os.path.join(DOWNLOADS_DIR, filename), as_attachment=True)
+                    return send_file(vfs.open(os.path.join(downloads_dir, filename), 'rb'),
+                                     as_attachment=True, download_name=filename)
                 return jsonify({'error': f'Error retrieving file from database: {str(db_error)}'}), 404
         else:
             # Standard filesystem approach
-            file_path = os.path.join(DOWNLOADS_DIR, filename)
-            if not os.path.exists(file_path):
+            file_path = os.path.join(downloads_dir, filename)
+            if not vfs.exists(file_path):
                 logger.error(f"File not found in filesystem: {file_path}")
                 return jsonify({'error': f'File not found: {filename}'}), 404
-                
-            return send_file(file_path, as_attachment=True)
+            
+            return send_file(vfs.open(file_path, 'rb'), as_attachment=True, download_name=filename)
     except Exception as e:
         logger.error(f"Download error: {str(e)}")
         return jsonify({'error': f'Error downloading file: {str(e)}'}), 500
 
-    
+
 if __name__ == '__main__':
     app.run(debug=False, host='0.0.0.0', port=5000)
\ No newline at end of file
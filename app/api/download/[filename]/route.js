@@ -15,7 +15,9 @@ export async function GET(request, { params }) {
     // Set timeout to 2 minutes for download
     const timeout = setTimeout(() => controller.abort(), 2 * 60 * 1000)
     
-    const flaskResponse = await fetch(`http://localhost:5000/api/download/${filename}`, {
+    // Keep the query string, which names the job workspace holding the file
+    const { search } = new URL(request.url)
+    const flaskResponse = await fetch(`http://localhost:5000/api/download/${filename}${search}`, {
       signal
     })
     
@@ -0,0 +1,51 @@
+import { NextResponse } from "next/server"
+
+export async function GET(request, { params }) {
+  try {
+    const { jobId } = params
+
+    // Get the status, progress and (once finished) result of the job from the Flask backend
+    const statusResponse = await fetch(`http://localhost:5000/api/jobs/${jobId}`, { cache: "no-store" })
+    const job = await statusResponse.json()
+
+    if (!statusResponse.ok) {
+      return NextResponse.json({ error: job.error || "Job status unavailable" }, { status: statusResponse.status })
+    }
+
+    if (job.status === "failed") {
+      console.error("Flask API error:", job.error || "Unknown error")
+      job.error = job.error || (job.result && job.result.error) || "An error occurred during processing"
+      return NextResponse.json(job)
+    }
+
+    if (job.status !== "completed" || !job.result) {
+      return NextResponse.json(job)
+    }
+
+    const data = job.result
+
+    // Transform download URL to use our API
+    if (data.download_url) {
+      const originalUrl = data.download_url
+      const filename = originalUrl.split("/").pop()
+      data.download_url = `/api/download/${filename}`
+    }
+
+    // Ensure visualization data is properly structured
+    if (data.visualizations && !data.visualizations.plots) {
+      // If backend returns visualizations in a different format, adapt it
+      console.log("Transforming visualization data structure")
+      const plots = Array.isArray(data.visualizations) 
+        ? data.visualizations 
+        : Object.values(data.visualizations).flat()
+      
+      data.visualizations = { plots }
+    }
+
+    // Return the job with its result
+    return NextResponse.json(job)
+  } catch (error) {
+    console.error("Error in jobs API route:", error)
+    return NextResponse.json({ error: error.message || "Job status unavailable" }, { status: 500 })
+  }
+}
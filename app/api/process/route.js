@@ -18,59 +18,28 @@ export async function POST(request) {
     flaskFormData.append("text_prompt", textPrompt)
     flaskFormData.append("task_type", taskType)
 
-    // Forward the request to the Flask backend with a longer timeout
-    const controller = new AbortController()
-    const signal = controller.signal
-    
-    // Set timeout to 120 minutes for model training
-    const timeout = setTimeout(() => controller.abort(), 120 * 60 * 1000)
-    
-    const flaskResponse = await fetch("http://localhost:5000/process", {
+    // Submit the job; the Flask backend queues it and answers immediately
+    const submitResponse = await fetch("http://localhost:5000/process", {
       method: "POST",
-      body: flaskFormData,
-      signal
+      body: flaskFormData
     })
-    
-    clearTimeout(timeout)
+    const job = await submitResponse.json()
 
-    // Get the response from Flask
-    const data = await flaskResponse.json()
-
-    // If there's an error, return it
-    if (!flaskResponse.ok || data.error) {
-      console.error("Flask API error:", data.error || "Unknown error")
-      return NextResponse.json({ error: data.error || "An error occurred during processing" }, { status: flaskResponse.status || 500 })
-    }
-
-    // Transform download URL to use our API
-    if (data.download_url) {
-      const originalUrl = data.download_url
-      const filename = originalUrl.split("/").pop()
-      data.download_url = `/api/download/${filename}`
-    }
-
-    // Ensure visualization data is properly structured
-    if (data.visualizations && !data.visualizations.plots) {
-      // If backend returns visualizations in a different format, adapt it
-      console.log("Transforming visualization data structure")
-      const plots = Array.isArray(data.visualizations) 
-        ? data.visualizations 
-        : Object.values(data.visualizations).flat()
-      
-      data.visualizations = { plots }
-    }
-    
-    // Forward any detected task type information to the frontend
-    if (data.detected_task_type && data.detected_task_type !== taskType) {
-      console.log(`Task type was changed from ${taskType} to ${data.detected_task_type} by the backend`)
+    if (!submitResponse.ok || job.error) {
+      console.error("Flask API error:", job.error || "Unknown error")
+      return NextResponse.json({ error: job.error || "An error occurred during processing" }, { status: submitResponse.status || 500 })
     }
 
-    // Return the response
-    return NextResponse.json(data)
+    // Hand the job to the browser, which polls /api/jobs/<job_id> for progress and the result
+    return NextResponse.json({
+      job_id: job.job_id,
+      status: job.status,
+      status_url: `/api/jobs/${job.job_id}`
+    }, { status: 202 })
   } catch (error) {
     console.error("Error in process API route:", error)
     return NextResponse.json({ 
-      error: error.message || "An error occurred during processing. The request may have timed out." 
+      error: error.message || "An error occurred while submitting the job." 
     }, { status: 500 })
   }
 }
\ No newline at end of file
@@ -0,0 +1,91 @@
+# benchmark_cnn.py
+
+"""
+Measure CNN training throughput (images/second) in the standard and fast modes
+
+Each mode trains build_image_cnn on the same synthetic 64x64 images in its own
+process, since ML_CNN_TRAINING_MODE also sizes TensorFlow's thread pools, which
+can only happen at startup. The first epoch, which includes graph tracing and
+XLA compilation, is a warm-up and not timed.
+
+Usage: python benchmark_cnn.py [--images 2048] [--epochs 3] [--batch-size 32] [--classes 3]
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import subprocess
+
+MODES = ('standard', 'fast')
+
+
+def measure(images, epochs, batch_size, classes):
+    """Train in this process's ML_CNN_TRAINING_MODE and return images/second"""
+    import numpy as np
+    import tensorflow as tf
+    from cnn_models import build_image_cnn, CNN_TRAINING_MODE, TF_INTRA_OP_THREADS, TF_INTER_OP_THREADS
+    from image_pipeline import IMAGE_SIZE
+    
+    rng = np.random.default_rng(0)
+    x = rng.integers(0, 256, size=(images,) + IMAGE_SIZE + (3,), dtype='uint8')
+    y = rng.integers(0, classes, size=images)
+    dataset = (tf.data.Dataset.from_tensor_slices((x, y))
+               .batch(batch_size)
+               .map(lambda images, labels: (tf.cast(images, tf.float32) / 255.0, tf.one_hot(labels, classes)))
+               .cache()
+               .prefetch(tf.data.AUTOTUNE))
+    
+    cnn = build_image_cnn(IMAGE_SIZE + (3,), classes, fast=CNN_TRAINING_MODE == 'fast')
+    cnn.fit(dataset, epochs=1, verbose=0)
+    
+    start = time.perf_counter()
+    cnn.fit(dataset, epochs=epochs, verbose=0)
+    elapsed = time.perf_counter() - start
+    
+    return {
+        'mode': CNN_TRAINING_MODE,
+        'images_per_second': images * epochs / elapsed,
+        'seconds_per_epoch': elapsed / epochs,
+        'intra_op_threads': TF_INTRA_OP_THREADS,
+        'inter_op_threads': TF_INTER_OP_THREADS,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare standard and fast CNN training throughput")
+    parser.add_argument('--images', type=int, default=2048)
+    parser.add_argument('--epochs', type=int, default=3)
+    parser.add_argument('--batch-size', type=int, default=32)
+    parser.add_argument('--classes', type=int, default=3)
+    parser.add_argument('--child', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    
+    if args.child:
+        print(json.dumps(measure(args.images, args.epochs, args.batch_size, args.classes)))
+        return
+    
+    results = {}
+    for mode in MODES:
+        print(f"Benchmarking {mode} mode...")
+        env = dict(os.environ, ML_CNN_TRAINING_MODE=mode)
+        child = subprocess.run([sys.executable, os.path.abspath(__file__), '--child',
+                                '--images', str(args.images), '--epochs', str(args.epochs),
+                                '--batch-size', str(args.batch_size), '--classes', str(args.classes)],
+                               env=env, capture_output=True, text=True)
+        if child.returncode != 0:
+            print(child.stderr)
+            sys.exit(f"The {mode} benchmark failed")
+        results[mode] = json.loads(child.stdout.strip().splitlines()[-1])
+    
+    print(f"\n{'mode':<10} {'images/s':>10} {'s/epoch':>9} {'threads':>9}")
+    for mode, result in results.items():
+        threads = f"{result['intra_op_threads']}/{result['inter_op_threads']}"
+        print(f"{mode:<10} {result['images_per_second']:>10.1f} {result['seconds_per_epoch']:>9.2f} {threads:>9}")
+    speedup = results['fast']['images_per_second'] / results['standard']['images_per_second']
+    print(f"\nFast mode: {speedup:.2f}x the standard throughput")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,155 @@
+# cnn_models.py
+
+import os
+import hashlib
+from job_queue import MAX_TRAINING_WORKERS
+
+# Check if TensorFlow is available
+try:
+    import tensorflow as tf
+    TENSORFLOW_AVAILABLE = True
+except ImportError:
+    TENSORFLOW_AVAILABLE = False
+
+# CNN training mode: 'standard', or 'fast' for bfloat16 mixed precision, tuned thread pools and XLA
+CNN_TRAINING_MODE = os.getenv('ML_CNN_TRAINING_MODE', 'standard')
+
+# XLA compilation in the fast mode: 'auto' compiles only on GPUs, since on CPUs XLA's convolutions
+# are slower than TensorFlow's oneDNN kernels; '1' or '0' force it on or off
+CNN_JIT_COMPILE = os.getenv('ML_CNN_JIT_COMPILE', 'auto')
+
+# Pretrained backbone for transfer learning ('mobilenet_v2'), or '' to train the CNN from scratch
+CNN_BACKBONE = os.getenv('ML_CNN_BACKBONE', '')
+
+# Backbone weights file; by default where Keras caches MobileNetV2's 96x96 ImageNet weights.
+# Jobs never download weights, so the file has to be placed there in advance
+CNN_BACKBONE_WEIGHTS = os.getenv('ML_CNN_BACKBONE_WEIGHTS', os.path.join(
+    os.path.expanduser('~'), '.keras', 'models', 'mobilenet_v2_weights_tf_dim_ordering_tf_kernels_1.0_96_no_top.h5'))
+
+# Images are upscaled to the smallest input size MobileNetV2 has ImageNet weights for
+BACKBONE_IMAGE_SIZE = (96, 96)
+
+# TensorFlow op thread pools (0 keeps TensorFlow's default). The fast mode defaults to the
+# worker budget for ops and two threads for independent ops, since the CNN is one chain of layers
+TF_INTRA_OP_THREADS = int(os.getenv('ML_TF_INTRA_OP_THREADS', MAX_TRAINING_WORKERS if CNN_TRAINING_MODE == 'fast' else 0))
+TF_INTER_OP_THREADS = int(os.getenv('ML_TF_INTER_OP_THREADS', 2 if CNN_TRAINING_MODE == 'fast' else 0))
+
+def configure_tensorflow_threads(intra_op=TF_INTRA_OP_THREADS, inter_op=TF_INTER_OP_THREADS):
+    """Size TensorFlow's op thread pools; only possible before TensorFlow runs its first op"""
+    try:
+        if intra_op:
+            tf.config.threading.set_intra_op_parallelism_threads(intra_op)
+        if inter_op:
+            tf.config.threading.set_inter_op_parallelism_threads(inter_op)
+    except RuntimeError as e:
+        print(f"Could not size TensorFlow thread pools: {e}")
+
+if TENSORFLOW_AVAILABLE:
+    configure_tensorflow_threads()
+
+def cnn_jit_compile():
+    """Whether the fast mode compiles the CNN with XLA (see CNN_JIT_COMPILE)"""
+    if CNN_JIT_COMPILE == 'auto':
+        return bool(tf.config.list_physical_devices('GPU'))
+    return CNN_JIT_COMPILE == '1'
+
+def bfloat16_supported():
+    """Whether the CPU computes bfloat16 natively (AVX512-BF16 or AMX); elsewhere it is emulated and slower"""
+    try:
+        with open('/proc/cpuinfo') as f:
+            flags = f.read()
+    except OSError:
+        return False
+    return 'avx512_bf16' in flags or 'amx_bf16' in flags
+
+def build_image_cnn(image_shape, num_classes, learning_rate=0.001, fast=False):
+    """
+    Build and compile the image classification CNN
+    
+    fast: On CPUs with native bfloat16, compute in bfloat16 with float32 weights,
+    and compile the training step with XLA where cnn_jit_compile() allows. The
+    softmax output stays float32 so losses and predicted probabilities keep full
+    precision.
+    """
+    from tensorflow.keras.models import Sequential
+    from tensorflow.keras.layers import Conv2D, MaxPooling2D, Flatten, Dense, Dropout
+    from tensorflow.keras.optimizers import Adam
+    
+    # Per-layer policies rather than the global one, so other models in the process are unaffected
+    dtype = 'mixed_bfloat16' if fast and bfloat16_supported() else 'float32'
+    jit_compile = bool(fast) and cnn_jit_compile()
+    if fast:
+        print(f"Fast CNN training: {dtype} layers, XLA {'on' if jit_compile else 'off'}")
+    
+    cnn = Sequential([
+        # First convolution block
+        Conv2D(32, (3, 3), padding='same', activation='relu', input_shape=image_shape, dtype=dtype),
+        MaxPooling2D(pool_size=(2, 2), dtype=dtype),
+        
+        # Second convolution block
+        Conv2D(64, (3, 3), padding='same', activation='relu', dtype=dtype),
+        MaxPooling2D(pool_size=(2, 2), dtype=dtype),
+        
+        # Third convolution block
+        Conv2D(128, (3, 3), padding='same', activation='relu', dtype=dtype),
+        MaxPooling2D(pool_size=(2, 2), dtype=dtype),
+        
+        # Flatten the convolutional features
+        Flatten(dtype=dtype),
+        
+        # Fully connected layers
+        Dense(256, activation='relu', dtype=dtype),
+        Dropout(0.5, dtype=dtype),  # Add dropout for regularization
+        
+        # Output layer
+        Dense(num_classes, activation='softmax', dtype='float32')
+    ])
+    
+    # Compile the model
+    cnn.compile(
+        optimizer=Adam(learning_rate=learning_rate),
+        loss='categorical_crossentropy',
+        metrics=['accuracy'],
+        jit_compile=jit_compile
+    )
+    return cnn
+
+def backbone_weights_file(weights=CNN_BACKBONE_WEIGHTS):
+    """Return the backbone weights file, raising FileNotFoundError if it is not on local disk"""
+    if not os.path.isfile(weights):
+        raise FileNotFoundError(
+            f"Backbone weights file not found: {weights}. Training jobs do not download weights; "
+            f"copy the Keras MobileNetV2 weights there or point ML_CNN_BACKBONE_WEIGHTS at them")
+    return weights
+
+def backbone_cache_key(backbone=CNN_BACKBONE, weights=CNN_BACKBONE_WEIGHTS):
+    """Name of the embeddings a backbone computes: the backbone, its input size and its weights' hash"""
+    digest = hashlib.sha256()
+    with open(backbone_weights_file(weights), 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(block)
+    height, width = BACKBONE_IMAGE_SIZE
+    return f"{backbone}-{height}x{width}-{digest.hexdigest()[:16]}"
+
+def build_image_backbone(image_shape, backbone=CNN_BACKBONE, weights=CNN_BACKBONE_WEIGHTS):
+    """
+    Build a frozen pretrained feature extractor
+    
+    It takes images scaled to [0, 1], like the preprocessing yields, and returns
+    the backbone's globally pooled features.
+    """
+    from tensorflow.keras import Input, Model
+    from tensorflow.keras.layers import Resizing, Rescaling
+    
+    if backbone != 'mobilenet_v2':
+        raise ValueError(f"Unknown CNN backbone: {backbone}")
+    
+    base = tf.keras.applications.MobileNetV2(input_shape=BACKBONE_IMAGE_SIZE + (3,), include_top=False,
+                                             pooling='avg', weights=backbone_weights_file(weights))
+    base.trainable = False
+    
+    inputs = Input(shape=image_shape)
+    x = Resizing(*BACKBONE_IMAGE_SIZE)(inputs)
+    x = Rescaling(2.0, offset=-1.0)(x)  # MobileNetV2 expects [-1, 1]
+    outputs = base(x, training=False)
+    return Model(inputs, outputs, name=f'{backbone}_features')
@@ -66,6 +66,7 @@ export default function MLSystem() {
   const [taskType, setTaskType] = useState("classification")
   const [isLoading, setIsLoading] = useState(false)
   const [progress, setProgress] = useState(0)
+  const [progressMessage, setProgressMessage] = useState("")
   const [result, setResult] = useState(null)
   const [dataPreview, setDataPreview] = useState(null)
   const [modelInfo, setModelInfo] = useState(null)
@@ -102,22 +103,6 @@ export default function MLSystem() {
     setDetectedTaskType(null)
   }, [taskType])
 
-  // Simulate progress when loading
-  useEffect(() => {
-    if (isLoading) {
-      const interval = setInterval(() => {
-        setProgress((prev) => {
-          const newProgress = prev + Math.random() * 10
-          return newProgress >= 95 ? 95 : newProgress
-        })
-      }, 500)
-      return () => {
-        clearInterval(interval)
-        setProgress(0)
-      }
-    }
-  }, [isLoading])
-
   const handleFileChange = (e) => {
     if (e.target.files && e.target.files[0]) {
       setFile(e.target.files[0])
@@ -145,6 +130,7 @@ export default function MLSystem() {
     setDatasetInfo("")
     setDownloadUrl("")
     setProgress(0)
+    setProgressMessage("")
     setTaskTypeChanged(false)
     setDetectedTaskType(null)
 
@@ -155,36 +141,50 @@ export default function MLSystem() {
     formData.append("task_type", taskType)
 
     try {
-      // Add a longer timeout for the fetch operation since model training can take time
-      const controller = new AbortController()
-      const timeoutId = setTimeout(() => controller.abort(), 120 * 60 * 1000) // 2-hour timeout (same as backend)
-
+      // Submit the job; the server queues it and answers with its id straight away
       const response = await fetch("/api/process", {
         method: "POST",
         body: formData,
-        signal: controller.signal,
       }).catch((error) => {
         console.error("Fetch error:", error)
-        throw new Error("Network error occurred. The server might still be processing your request.")
+        throw new Error("Network error occurred while submitting your request.")
       })
 
-      clearTimeout(timeoutId)
-
-      if (!response.ok) {
-        const errorText = await response.text()
-        console.error("Server error:", errorText)
-        throw new Error(`Server error: ${response.status} ${response.statusText}`)
+      const submitted = await response.json().catch(() => ({}))
+      if (!response.ok || submitted.error) {
+        console.error("Server error:", submitted.error)
+        throw new Error(submitted.error || `Server error: ${response.status} ${response.statusText}`)
       }
 
-      const data = await response.json().catch((error) => {
-        console.error("JSON parsing error:", error)
-        throw new Error("Error parsing server response. The model might still be training.")
-      })
+      // Poll the job, showing its progress and current step, until it finishes
+      let job = submitted
+      while (job.status === "queued" || job.status === "running") {
+        await new Promise((resolve) => setTimeout(resolve, 2000))
+
+        const statusResponse = await fetch(`/api/jobs/${submitted.job_id}`, { cache: "no-store" }).catch(() => null)
+        if (!statusResponse) {
+          // Transient network error: the job keeps running on the server, try again
+          continue
+        }
+        const status = await statusResponse.json().catch(() => ({}))
+        if (!statusResponse.ok) {
+          throw new Error(status.error || `Job status unavailable: ${statusResponse.status}`)
+        }
+
+        job = status
+        setProgress((job.progress || 0) * 100)
+        setProgressMessage(
+          job.status === "queued" && job.queue_position
+            ? `Queued (position ${job.queue_position})`
+            : job.message || "",
+        )
+      }
 
       setProgress(100)
 
-      if (data.error) {
-        setResult({ error: data.error })
+      const data = job.result || {}
+      if (job.status === "failed" || data.error) {
+        setResult({ error: job.error || data.error || "An error occurred during processing" })
         return
       }
 
@@ -277,6 +277,7 @@ export default function MLSystem() {
       })
     } finally {
       setIsLoading(false)
+      setProgressMessage("")
     }
   }
 
@@ -739,7 +740,7 @@ export default function MLSystem() {
                     </div>
                     <div className={styles.progressContainer}>
                       <div className={styles.progressText}>
-                        <span>Processing...</span>
+                        <span>{progressMessage || "Processing..."}</span>
                         <span>{Math.round(progress)}%</span>
                       </div>
                       <Progress value={progress} className={styles.progressBar}>
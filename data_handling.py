@@ -3,17 +3,19 @@ import io
 import zipfile
 import shutil
 import pandas as pd
-import numpy as np
 import random
 import yaml
 from kaggle.api.kaggle_api_extended import KaggleApi
 import logging
-from scipy import stats
 import tempfile
 from db_file_system import DBFileSystem
+from file_system_adapter import FileSystemAdapter
+from tabular_ingestion import ingest_csv
+from task_detection import detect_task_type_from_stats, detect_task_type_from_frame
 
 # Initialize the database file system
 db_fs = DBFileSystem()
+vfs = FileSystemAdapter(db_fs=db_fs)
 
 try:
     import google.generativeai as genai
@@ -42,10 +44,6 @@ def download_kaggle_dataset(query, datasets_dir):
         api = KaggleApi()
         api.authenticate()
         
-        # Clear the dataset folder before downloading the new dataset
-        # In database approach, we simply clear the 'datasets' directory in the database
-        db_fs.clear_directory('datasets')
-        
         # Search for datasets matching the query
         datasets = api.dataset_list(search=query)
         if datasets:
@@ -68,7 +66,7 @@ def download_kaggle_dataset(query, datasets_dir):
                     local_csv_path = os.path.join(temp_dir, file)
                     
                     # Save to database
-                    db_fs.save_file(local_csv_path, 'datasets')
+                    db_fs.save_file(local_csv_path, vfs.db_directory(datasets_dir) or 'datasets')
                     
                     # Use database path for further operations
                     csv_file_path = os.path.join(datasets_dir, file)
@@ -81,10 +79,10 @@ def download_kaggle_dataset(query, datasets_dir):
                 # Auto-detect task type based on the dataset
                 detected_task_type, df = auto_detect_task_type(csv_file_path)
                 
-                # Use Gemini as second opinion if available
+                # Use Gemini as second opinion if available (cached per file content and query)
                 gemini_task_type = None
                 if GEMINI_AVAILABLE:
-                    gemini_task_type = get_gemini_task_type_opinion(df, query)
+                    gemini_task_type = cached_gemini_task_type_opinion(csv_file_path, df, query)
                 
                 # Determine final task type based on both analyses
                 final_task_type = determine_final_task_type(detected_task_type, gemini_task_type)
@@ -105,114 +103,87 @@ def auto_detect_task_type(csv_path):
     Returns the detected task type and the loaded dataframe
     """
     try:
-        # Check if the path is in the database
-        if 'ml_system' in csv_path:
-            # Get the directory and filename
-            parts = csv_path.replace('\\', '/').strip('/').split('/')
-            idx = parts.index('ml_system')
-            if idx + 1 < len(parts) and idx + 2 < len(parts):
-                dir_name = parts[idx + 1]
-                filename = parts[idx + 2]
-                
-                # Get the file from database and load as DataFrame
-                content = db_fs.get_file(filename, dir_name)
-                df = pd.read_csv(io.BytesIO(content))
-            else:
-                raise ValueError(f"Invalid database path: {csv_path}")
+        # Detection results are cached per content checksum, so the same file skips
+        # the statistics entirely on later requests
+        checksum = _content_checksum(csv_path)
+        cached = db_fs.get_profile(checksum) or {}
+        if 'task_type' in cached:
+            print(f"Using cached task type for {csv_path}: {cached['task_type']}")
+            with vfs.open(csv_path, 'rb') as f:
+                return cached['task_type'], pd.read_csv(f)
+        
+        # Parse the CSV once, in chunks: statistics are accumulated per chunk and the
+        # rows kept for the caller, instead of a full read plus passes over the frame
+        if hasattr(csv_path, 'read'):
+            # Already an open file-like object (e.g. generated CSV text)
+            dataset = ingest_csv(csv_path)
         else:
-            # Load directly from file path
-            df = pd.read_csv(csv_path)
-        
-        # Get the target column (last column)
-        target_col = df.columns[-1]
-        target_values = df[target_col].dropna()
-        
-        # If target is empty, get second-to-last column in case of ordering issues
-        if len(target_values) == 0 and len(df.columns) > 1:
-            target_col = df.columns[-2]
-            target_values = df[target_col].dropna()
+            # Stream from the database or the local disk, depending on the path
+            with vfs.open(csv_path, 'rb') as f:
+                dataset = ingest_csv(f)
         
-        # Get unique values in target
-        unique_values = target_values.unique()
-        num_unique = len(unique_values)
-        
-        # Check if the target has numerical values
-        is_numeric = pd.api.types.is_numeric_dtype(target_values)
+        task_type = detect_task_type_from_stats(dataset)
+        db_fs.update_profile(checksum, _detection_profile(dataset, task_type))
+        return task_type, dataset.load()
+    except Exception as e:
+        logging.exception(f"Error in auto_detect_task_type, falling back to a full read: {e}")
         
-        if is_numeric:
-            # If numeric, check various indicators
-            value_range = target_values.max() - target_values.min()
-            fraction_unique = num_unique / len(target_values)
-            
-            # Check if values are mostly integers
-            is_mostly_integer = np.mean([float(x).is_integer() for x in target_values if not pd.isna(x)]) > 0.9
-            
-            # Check if distribution is continuous (using KDE)
-            try:
-                kde = stats.gaussian_kde(target_values)
-                x = np.linspace(target_values.min(), target_values.max(), 1000)
-                y = kde(x)
-                continuity_score = np.std(y) / np.mean(y) if np.mean(y) > 0 else 0
-            except:
-                continuity_score = 0
-            
-            # Check correlation with other numerical features
-            numerical_cols = df.select_dtypes(include=['float64', 'int64']).columns
-            avg_correlation = 0
-            if len(numerical_cols) > 1:
-                correlations = []
-                for col in numerical_cols:
-                    if col != target_col:
-                        corr = abs(df[col].corr(df[target_col]))
-                        if not pd.isna(corr):
-                            correlations.append(corr)
-                if correlations:
-                    avg_correlation = sum(correlations) / len(correlations)
-            
-            # Determine if regression or classification based on multiple factors
-            regression_score = 0
-            regression_score += 1 if fraction_unique > 0.4 else 0
-            regression_score += 1 if not is_mostly_integer else 0
-            regression_score += 1 if value_range > 10 else 0
-            regression_score += 1 if continuity_score < 2 else 0
-            regression_score += 1 if avg_correlation > 0.3 else 0
-            
-            if regression_score >= 3:
-                return "regression", df
-            else:
-                return "classification", df
+        # The detection used before chunked ingestion: parse the whole file into memory
+        # (from the database or the local disk) and inspect the DataFrame
+        if hasattr(csv_path, 'read'):
+            csv_path.seek(0)
+            df = pd.read_csv(csv_path)
         else:
-            # If target is not numeric, it's likely classification
-            # Check for NLP task - if there are text columns with more than a few words
-            text_features = False
-            for col in df.columns:
-                if df[col].dtype == 'object':
-                    # Check if column contains longer text (average > 15 chars)
-                    sample = df[col].dropna().astype(str).sample(min(100, len(df)))
-                    if sample.str.len().mean() > 15:
-                        text_features = True
-                        break
-            
-            if text_features:
-                return "nlp", df
-            else:
-                return "classification", df
-    except Exception as e:
-        print(f"Error in auto_detect_task_type: {e}")
-        # Default to classification if detection fails
-        
-        # Try to load from database
-        if 'ml_system' in csv_path:
-            parts = csv_path.replace('\\', '/').strip('/').split('/')
-            idx = parts.index('ml_system')
-            if idx + 1 < len(parts) and idx + 2 < len(parts):
-                dir_name = parts[idx + 1]
-                filename = parts[idx + 2]
-                content = db_fs.get_file(filename, dir_name)
-                return "classification", pd.read_csv(io.BytesIO(content))
-        
-        # Fall back to direct file reading
-        return "classification", pd.read_csv(csv_path)
+            with vfs.open(csv_path, 'rb') as f:
+                df = pd.read_csv(f)
+        try:
+            return detect_task_type_from_frame(df), df
+        except Exception as e:
+            print(f"Error in auto_detect_task_type: {e}")
+            # Default to classification if detection fails
+            return "classification", df
+
+def _content_checksum(csv_path):
+    """Return the stored checksum of a database file, or None for anything else"""
+    if hasattr(csv_path, 'read') or not vfs.is_db_path(csv_path):
+        return None
+    try:
+        return vfs.info(csv_path).get('checksum')
+    except FileNotFoundError:
+        return None
+
+def _detection_profile(dataset, task_type):
+    """Profile fields cached for a CSV: the detected task type and its column statistics"""
+    profile = dataset.stats
+    return {
+        'task_type': task_type,
+        'rows': profile.rows,
+        'columns': dataset.columns,
+        'column_types': dataset.column_types(),
+        'null_counts': profile.nulls,
+        'column_stats': {
+            col: {
+                'min': float(profile.minimum[col]) if col in profile.minimum else None,
+                'max': float(profile.maximum[col]) if col in profile.maximum else None,
+                'mean': profile.mean(col)
+            }
+            for col in profile.numeric
+        }
+    }
+
+def cached_gemini_task_type_opinion(csv_path, df, query):
+    """get_gemini_task_type_opinion, cached in the file's profile per content and query"""
+    checksum = _content_checksum(csv_path)
+    opinions = (db_fs.get_profile(checksum) or {}).get('gemini_opinions', {})
+    if query in opinions:
+        print(f"Using cached Gemini task type for {csv_path}: {opinions[query]}")
+        return opinions[query]
+    
+    opinion = get_gemini_task_type_opinion(df, query)
+    if opinion is not None:
+        opinions[query] = opinion
+        db_fs.update_profile(checksum, {'gemini_opinions': opinions})
+    return opinion
 
 def get_gemini_task_type_opinion(df, query):
     """
@@ -287,8 +258,10 @@ def determine_final_task_type(detected_type, gemini_type):
     # as it might catch contextual clues the statistical analysis missed
     return gemini_type
 
-def generate_dataset_from_text(text):
-    """Generate a synthetic dataset based on text description"""
+def generate_dataset_from_text(text, datasets_dir=None):
+    """Generate a synthetic dataset based on text description, saved in datasets_dir (default 'datasets')"""
+    datasets_dir_name = (vfs.db_directory(datasets_dir) if datasets_dir else None) or 'datasets'
+    
     if GEMINI_AVAILABLE:
         try:
             model = genai.GenerativeModel(model_name="gemini-1.5-flash")
@@ -308,7 +281,7 @@ def generate_dataset_from_text(text):
             try:
                 df.to_csv(temp_file.name, index=False)
                 temp_file.close()
-                db_fs.save_file(temp_file.name, 'datasets')
+                db_fs.save_file(temp_file.name, datasets_dir_name)
             finally:
                 # Clean up temporary file
                 if os.path.exists(temp_file.name):
@@ -340,7 +313,7 @@ def generate_dataset_from_text(text):
     try:
         df.to_csv(temp_file.name, index=False)
         temp_file.close()
-        db_fs.save_file(temp_file.name, 'datasets')
+        db_fs.save_file(temp_file.name, datasets_dir_name)
     finally:
         # Clean up temporary file
         if os.path.exists(temp_file.name):
@@ -355,33 +328,19 @@ def safe_copy(src, dst):
     """
     try:
         # Check if destination is in database
-        if 'ml_system' in dst:
-            parts = dst.replace('\\', '/').strip('/').split('/')
-            idx = parts.index('ml_system')
-            if idx + 1 < len(parts):
-                dir_name = parts[idx + 1]
+        if vfs.is_db_path(dst):
+            dir_name = vfs.db_directory(dst)
+            if dir_name:
                 # Save to database
+                db_fs.makedirs(dir_name)
                 db_fs.save_file(src, dir_name)
                 return
         
         # Check if source is in database
-        if 'ml_system' in src:
-            parts = src.replace('\\', '/').strip('/').split('/')
-            idx = parts.index('ml_system')
-            if idx + 1 < len(parts) and idx + 2 < len(parts):
-                dir_name = parts[idx + 1]
-                filename = parts[idx + 2]
-                
-                # Get from database and save to destination
-                content = db_fs.get_file(filename, dir_name)
-                
-                # Create destination directory if it doesn't exist
-                os.makedirs(os.path.dirname(dst), exist_ok=True)
-                
-                # Write to destination
-                with open(dst, 'wb') as f:
-                    f.write(content)
-                return
+        if vfs.is_db_path(src):
+            # Stream from database to destination
+            vfs.get(src, dst)
+            return
                 
         # For regular files, use normal copy logic
         # Create destination directory if it doesn't exist
@@ -413,9 +372,6 @@ def process_dataset_folder(uploaded_zip, task_type="image_classification", datas
     if datasets_dir is None:
         raise ValueError("Datasets directory must be specified")
     
-    # Clear old files in database 'datasets' directory
-    db_fs.clear_directory('datasets')
-    
     # Create temporary directory for processing
     temp_dir = tempfile.mkdtemp()
     
@@ -531,7 +487,7 @@ def process_classification_dataset_with_db(temp_dir, datasets_dir):
                 zipf.write(file_path, arcname)
     
     # Save the zip to database
-    db_fs.save_file(result_zip_path, 'datasets')
+    db_fs.save_file(result_zip_path, vfs.db_directory(datasets_dir) or 'datasets')
     
     # Prepare dataset information
     folder_structure = ["Dataset structure:"]
@@ -815,10 +771,10 @@ def process_yolo_dataset_with_db(temp_dir, datasets_dir):
                     zipf.write(file_path, arcname)
     
     # Save the zip to database
-    db_fs.save_file(result_zip_path, 'datasets')
+    db_fs.save_file(result_zip_path, vfs.db_directory(datasets_dir) or 'datasets')
     
     # Also save the data.yaml file separately for easy access
-    db_fs.save_file(yaml_path, 'datasets')
+    db_fs.save_file(yaml_path, vfs.db_directory(datasets_dir) or 'datasets')
     
     # Add dataset statistics
     folder_structure.append("└── Dataset Statistics:")
@@ -1,4 +1,4 @@
-from flask import Flask, request, jsonify, send_file
+from flask import Flask, request, jsonify, send_file, Response
 from flask_cors import CORS
 import os
 import random
@@ -14,7 +14,7 @@ import tempfile
 import requests
 from datetime import datetime, timedelta
 from db_file_system import DBFileSystem
-from db_system_integration import apply_patches
+from dataset_store import DatasetStore, TABULAR_EXTENSIONS
 from PIL import Image
 import zipfile
 
@@ -27,12 +27,14 @@ CORS(app, resources={r"/api/*": {"origins": "*"}})
 
 # Initialize the database file system
 db_fs = DBFileSystem()
-fs_adapter = apply_patches()
 
 # Set dataset directory name in the database
 DATASET_DIR = "datasets"
 EXPORTS_DIR = "exports"
 
+# Tabular datasets, stored once as Parquet and exported as CSV
+dataset_store = DatasetStore(db_fs, DATASET_DIR)
+
 class DataExpander:
     def __init__(self, openrouter_api_key=None, model_name="meta-llama/llama-3.1-8b-instruct"):
         self.openrouter_api_key = openrouter_api_key or os.getenv("OPENROUTER_API_KEY", "")
@@ -202,29 +204,37 @@ Return the modified CSV only, no extra text or explanations.
 
 def generate_data_insights(df):
     """Generate insights about the dataset"""
+    # Same shape as a DatasetStore summary; only the numeric column names are needed here
+    summary = {
+        'rows': len(df),
+        'columns': list(df.columns),
+        'column_types': {col: str(dtype) for col, dtype in df.dtypes.items()},
+        'null_counts': df.isnull().sum().to_dict(),
+        'numeric_stats': dict.fromkeys(df.select_dtypes(include=['number']).columns),
+    }
+    return generate_summary_insights(summary)
+
+def generate_summary_insights(summary):
+    """Generate insights about a dataset from its DatasetStore summary"""
     insights = []
     
     try:
         # Get general dataset info
-        num_rows = len(df)
-        num_cols = len(df.columns)
-        insights.append(f"Dataset contains {num_rows} rows and {num_cols} columns.")
+        insights.append(f"Dataset contains {summary['rows']} rows and {len(summary['columns'])} columns.")
         
         # Check for completeness
-        null_counts = df.isnull().sum()
-        columns_with_nulls = [col for col, count in null_counts.items() if count > 0]
+        columns_with_nulls = [col for col, count in summary['null_counts'].items() if count > 0]
         if columns_with_nulls:
             insights.append(f"Data quality: {len(columns_with_nulls)} column(s) contain missing values.")
         else:
             insights.append("Data quality: All columns are complete with no missing values.")
         
         # Check for numeric columns
-        numeric_cols = df.select_dtypes(include=['number']).columns.tolist()
-        if numeric_cols:
-            insights.append(f"Found {len(numeric_cols)} numeric columns for analysis.")
+        if summary['numeric_stats']:
+            insights.append(f"Found {len(summary['numeric_stats'])} numeric columns for analysis.")
         
         # Check for categorical columns
-        cat_cols = df.select_dtypes(include=['object', 'category']).columns.tolist()
+        cat_cols = [col for col, dtype in summary['column_types'].items() if dtype in ('object', 'str', 'category')]
         if cat_cols:
             insights.append(f"Found {len(cat_cols)} categorical columns.")
     
@@ -251,6 +261,15 @@ def upload_dataset():
         return jsonify({"error": "Only CSV, XLSX and JSON files are allowed"}), 400
     
     try:
+        # CSV uploads are parsed once, in chunks, into columnar storage
+        if file.filename.endswith('.csv'):
+            stored_filename = dataset_store.save_csv(file.stream, file.filename)
+            return jsonify({
+                "message": f"File {file.filename} uploaded successfully as {stored_filename}",
+                "dataset": stored_filename,
+                "success": True
+            })
+        
         # Create a temporary file to save the uploaded content
         temp_file_path = tempfile.NamedTemporaryFile(delete=False, suffix=os.path.splitext(file.filename)[1])
         file.save(temp_file_path.name)
@@ -262,7 +281,7 @@ def upload_dataset():
         # Clean up temporary file
         os.unlink(temp_file_path.name)
         
-        # If it's an Excel file, also convert to CSV for easier processing
+        # If it's an Excel file, also convert to a tabular dataset for easier processing
         if file.filename.endswith('.xlsx'):
             try:
                 # Create a temporary file
@@ -274,29 +293,20 @@ def upload_dataset():
                 # Read the Excel file
                 excel_df = pd.read_excel(temp_excel_path)
                 
-                # Create CSV filename
-                csv_filename = file.filename.replace('.xlsx', '.csv')
-                
-                # Save as CSV to a temporary file
-                with tempfile.NamedTemporaryFile(mode='w+', delete=False, suffix='.csv', encoding='utf-8') as temp_csv:
-                    excel_df.to_csv(temp_csv, index=False)
-                    temp_csv_path = temp_csv.name
-                
-                # Save CSV to database
-                db_fs.save_file(temp_csv_path, DATASET_DIR)
+                # Save it as a dataset in the database
+                dataset_filename = dataset_store.save_frame(excel_df, file.filename)
                 
                 # Clean up temporary files
                 os.unlink(temp_excel_path)
-                os.unlink(temp_csv_path)
                 
                 return jsonify({
-                    "message": f"File {file.filename} uploaded successfully and converted to CSV ({csv_filename})",
-                    "csv_file": csv_filename,
+                    "message": f"File {file.filename} uploaded successfully and converted to {dataset_filename}",
+                    "dataset": dataset_filename,
                     "success": True
                 })
             except Exception as excel_error:
                 return jsonify({
-                    "message": f"File {file.filename} uploaded but could not convert to CSV: {str(excel_error)}",
+                    "message": f"File {file.filename} uploaded but could not convert to a dataset: {str(excel_error)}",
                     "warning": True,
                     "success": True
                 })
@@ -314,28 +324,26 @@ def list_datasets():
     try:
         datasets = []
         
-        # Get CSV datasets from database
-        db_files = db_fs.list_files(DATASET_DIR)
-        
-        for filename in db_files:
-            if filename.endswith('.csv'):
-                # Get actual file size from database
-                try:
-                    file_content = db_fs.get_file(filename, DATASET_DIR)
-                    file_size_kb = len(file_content) / 1024
-                    if file_size_kb < 1024:
-                        size_str = f"{file_size_kb:.1f} KB"
-                    else:
-                        size_str = f"{file_size_kb/1024:.1f} MB"
-                except:
-                    size_str = "Unknown"
-                
-                datasets.append({
-                    "name": filename,
-                    "size": size_str,
-                    "modified": time.strftime('%Y-%m-%d %H:%M:%S'),
-                    "type": "tabular"
-                })
+        # Get tabular datasets from database (metadata only, no file content is loaded)
+        db_files = dataset_store.list_datasets()
+        
+        for file_info in db_files:
+            filename = file_info['filename']
+            if file_info['size'] is not None:
+                file_size_kb = file_info['size'] / 1024
+                if file_size_kb < 1024:
+                    size_str = f"{file_size_kb:.1f} KB"
+                else:
+                    size_str = f"{file_size_kb/1024:.1f} MB"
+            else:
+                size_str = "Unknown"
+            
+            datasets.append({
+                "name": filename,
+                "size": size_str,
+                "modified": str(file_info['updated_at'])[:19],
+                "type": "tabular"
+            })
         
         return jsonify({
             "datasets": datasets,
@@ -355,43 +363,29 @@ def preview_dataset():
         return jsonify({"error": "No file name provided"}), 400
     
     try:
-        # Check if file exists in database
-        if not db_fs.file_exists(file_name, DATASET_DIR):
+        # Check if the dataset exists in database
+        if dataset_store.resolve(file_name) is None:
             return jsonify({"error": f"File {file_name} not found in database"}), 404
         
-        # Get file content from database
-        file_content = db_fs.get_file(file_name, DATASET_DIR)
-        
-        # Read the CSV content into a DataFrame
-        df = pd.read_csv(io.BytesIO(file_content))
-        
-        # Get data types for each column
-        column_types = {col: str(df[col].dtype) for col in df.columns}
-        
-        # Get basic statistics for numeric columns
-        numeric_stats = {}
-        for col in df.select_dtypes(include=['number']).columns:
-            numeric_stats[col] = {
-                'min': float(df[col].min()) if not pd.isna(df[col].min()) else None,
-                'max': float(df[col].max()) if not pd.isna(df[col].max()) else None,
-                'mean': float(df[col].mean()) if not pd.isna(df[col].mean()) else None,
-                'median': float(df[col].median()) if not pd.isna(df[col].median()) else None
-            }
+        # Types, counts and statistics come from the columnar file's footer and
+        # numeric columns; no text is parsed
+        summary = dataset_store.summary(file_name)
         
         # Generate insights
-        insights = generate_data_insights(df)
+        insights = generate_summary_insights(summary)
         
-        # Return enhanced preview data
-        preview_rows = df.to_dict(orient='records') if view_all else df.head(10).to_dict(orient='records')
+        # Return enhanced preview data; only the leading rows are read unless all are requested
+        preview_df = dataset_store.read(file_name) if view_all else dataset_store.head(file_name, 10)
+        preview_rows = preview_df.to_dict(orient='records')
         
         return jsonify({
             "preview": preview_rows,
-            "columns": df.columns.tolist(),
-            "column_types": column_types,
-            "rows": len(df),
+            "columns": summary['columns'],
+            "column_types": summary['column_types'],
+            "rows": summary['rows'],
             "showing_rows": len(preview_rows),
             "is_full_view": view_all,
-            "numeric_stats": numeric_stats,
+            "numeric_stats": summary['numeric_stats'],
             "insights": insights,
             "success": True
         })
@@ -415,15 +409,12 @@ def expand_dataset():
         return jsonify({"error": "OpenRouter API key is required. Please provide it in the request or set OPENROUTER_API_KEY in environment"}), 400
     
     try:
-        # Check if file exists in database
-        if not db_fs.file_exists(file_name, DATASET_DIR):
+        # Check if the dataset exists in database
+        if dataset_store.resolve(file_name) is None:
             return jsonify({"error": f"File {file_name} not found in database"}), 404
         
-        # Get file content from database
-        file_content = db_fs.get_file(file_name, DATASET_DIR)
-        
-        # Read the CSV content into a DataFrame
-        df = pd.read_csv(io.BytesIO(file_content))
+        # Load the columnar dataset into a DataFrame
+        df = dataset_store.read(file_name)
         
         # Initialize data expander
         expander = DataExpander(openrouter_api_key=api_key, model_name=model_name)
@@ -435,18 +426,10 @@ def expand_dataset():
         current_time = time.strftime("%Y%m%d_%H%M%S")
         expanded_filename = f"expanded_{current_time}_{file_name}"
         
-        # Create a temporary file to save the expanded CSV
-        with tempfile.NamedTemporaryFile(mode='w+', delete=False, suffix='.csv', encoding='utf-8') as temp_file:
-            expanded_df.to_csv(temp_file, index=False)
-            temp_file_path = temp_file.name
-        
         try:
-            # Save the expanded file to the database with the correct filename
-            with open(temp_file_path, 'rb') as temp_file:
-                db_fs.save_file_content(temp_file.read(), expanded_filename, DATASET_DIR)
+            # Save the expanded dataset to the database in columnar form
+            expanded_filename = dataset_store.save_frame(expanded_df, expanded_filename)
             print(f"Saved expanded dataset to database: {expanded_filename}")
-            # Clean up the temporary file
-            os.unlink(temp_file_path)
         except Exception as save_error:
             print(f"Error saving to database: {str(save_error)}")
         
@@ -502,15 +485,12 @@ def alter_dataset():
         return jsonify({"error": "OpenRouter API key is required. Please provide it in the request or set OPENROUTER_API_KEY in environment"}), 400
     
     try:
-        # Check if file exists in database
-        if not db_fs.file_exists(file_name, DATASET_DIR):
+        # Check if the dataset exists in database
+        if dataset_store.resolve(file_name) is None:
             return jsonify({"error": f"File {file_name} not found in database"}), 404
         
-        # Get file content from database
-        file_content = db_fs.get_file(file_name, DATASET_DIR)
-        
-        # Read the CSV content into a DataFrame
-        original_df = pd.read_csv(io.BytesIO(file_content))
+        # Load the columnar dataset into a DataFrame
+        original_df = dataset_store.read(file_name)
         
         # Initialize data expander
         expander = DataExpander(openrouter_api_key=api_key, model_name=model_name)
@@ -522,18 +502,10 @@ def alter_dataset():
         current_time = time.strftime("%Y%m%d_%H%M%S")
         altered_filename = f"altered_{current_time}_{file_name}"
         
-        # Create a temporary file to save the altered CSV
-        with tempfile.NamedTemporaryFile(mode='w+', delete=False, suffix='.csv', encoding='utf-8') as temp_file:
-            altered_df.to_csv(temp_file, index=False)
-            temp_file_path = temp_file.name
-        
         try:
-            # Save the altered file to the database with the correct filename
-            with open(temp_file_path, 'rb') as temp_file:
-                db_fs.save_file_content(temp_file.read(), altered_filename, DATASET_DIR)
+            # Save the altered dataset to the database in columnar form
+            altered_filename = dataset_store.save_frame(altered_df, altered_filename)
             print(f"Saved altered dataset to database: {altered_filename}")
-            # Clean up the temporary file
-            os.unlink(temp_file_path)
         except Exception as save_error:
             print(f"Error saving to database: {str(save_error)}")
         
@@ -622,28 +594,20 @@ def expand_images():
 def download_file(filename):
     """Download file from the database"""
     try:
+        # Tabular datasets are exported as CSV, converted one row group at a time
+        if filename.endswith(TABULAR_EXTENSIONS) and dataset_store.resolve(filename) is not None:
+            export_name = dataset_store.export_name(filename)
+            return Response(dataset_store.export_csv(filename), mimetype='text/csv',
+                            headers={"Content-Disposition": f"attachment; filename={export_name}"})
+        
         # Check if file exists in database
         if not db_fs.file_exists(filename, DATASET_DIR):
             return jsonify({"error": "File not found in database"}), 404
         
-        # Get file content from database
-        file_content = db_fs.get_file(filename, DATASET_DIR)
-        
-        # Create a temporary file to serve
-        temp_file = tempfile.NamedTemporaryFile(delete=False)
-        temp_file.write(file_content)
-        temp_file.close()
-        
-        # Send the file
-        response = send_file(temp_file.name, as_attachment=True, download_name=filename)
-        
-        # Delete the temporary file after sending
-        @response.call_on_close
-        def cleanup():
-            if os.path.exists(temp_file.name):
-                os.unlink(temp_file.name)
+        # Stream the file straight out of the database in constant memory
+        stream = db_fs.open_read(filename, DATASET_DIR)
         
-        return response
+        return send_file(stream, as_attachment=True, download_name=filename)
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
@@ -655,15 +619,15 @@ def health_check():
         "server": "running",
         "storage": {
             "database": "connected", 
-            "total_datasets": 0
+            "total_datasets": 0,
+            "read_cache": db_fs.cache_stats()
         },
         "version": "2.0.0"
     }
     
     # Count datasets
     try:
-        csv_count = len([f for f in db_fs.list_files(DATASET_DIR) if f.endswith('.csv')])
-        status["storage"]["total_datasets"] = csv_count
+        status["storage"]["total_datasets"] = len(dataset_store.list_datasets())
     except Exception as e:
         status["storage"]["error"] = str(e)
     
@@ -0,0 +1,287 @@
+# dataset_store.py
+
+import os
+import shutil
+import pandas as pd
+from tabular_ingestion import ingest_csv, INGEST_CHUNK_ROWS
+
+# Columnar storage needs pyarrow; without it datasets stay CSV
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    PARQUET_AVAILABLE = True
+except ImportError:
+    PARQUET_AVAILABLE = False
+
+# Files in a dataset directory that hold tabular datasets
+TABULAR_EXTENSIONS = ('.parquet', '.csv')
+
+class DatasetStore:
+    """
+    Tabular datasets in a database directory, parsed once and stored as Parquet
+    
+    Uploads keep their dtypes in a compressed columnar file, so previews read the
+    footer and only the columns and leading row groups they need, and nothing is
+    re-parsed from text. CSV is produced only on export. Names resolve by stem, so
+    'data.csv' finds 'data.parquet'; legacy CSV files are converted on first access.
+    Without pyarrow datasets stay CSV and every read parses the whole file.
+    """
+    
+    def __init__(self, db_fs, directory_name):
+        self.db_fs = db_fs
+        self.directory_name = directory_name
+    
+    @staticmethod
+    def stored_name(name):
+        """Filename a dataset called name is stored under"""
+        return os.path.splitext(name)[0] + ('.parquet' if PARQUET_AVAILABLE else '.csv')
+    
+    @staticmethod
+    def export_name(name):
+        """Filename of the CSV export of a dataset"""
+        return os.path.splitext(name)[0] + '.csv'
+    
+    def _exists(self, filename):
+        return self.db_fs.file_exists(filename, self.directory_name)
+    
+    def resolve(self, name):
+        """Return the stored filename of a dataset, or None if there is none"""
+        stem = os.path.splitext(name)[0]
+        if PARQUET_AVAILABLE and self._exists(stem + '.parquet'):
+            return stem + '.parquet'
+        
+        csv_name = stem + '.csv'
+        if not self._exists(csv_name):
+            return None
+        if not PARQUET_AVAILABLE:
+            return csv_name
+        
+        # Legacy CSV: convert once, then serve the columnar copy from now on
+        with self.db_fs.open_read(csv_name, self.directory_name) as f:
+            stored = self.save_csv(f, csv_name)
+        self.db_fs.delete_file(csv_name, self.directory_name)
+        print(f"Converted {csv_name} to columnar storage as {stored}")
+        return stored
+    
+    def _require(self, name):
+        filename = self.resolve(name)
+        if filename is None:
+            raise FileNotFoundError(f"Dataset {name} not found in database")
+        return filename
+    
+    def save_csv(self, source, name):
+        """Store a CSV stream as a dataset, streaming it in chunks; returns the stored filename"""
+        stored = self.stored_name(name)
+        if not PARQUET_AVAILABLE:
+            with self.db_fs.open_write(stored, self.directory_name) as dst:
+                shutil.copyfileobj(source, dst)
+            return stored
+        
+        # Chunks go straight from the parser into the Parquet file, converted once
+        sink = _ParquetSink(self, stored)
+        try:
+            ingest_csv(source, keep_rows=False, sink=sink)
+        except Exception:
+            sink.abort()
+            raise
+        sink.close()
+        return stored
+    
+    def save_frame(self, df, name):
+        """Store a DataFrame as a dataset; returns the stored filename"""
+        stored = self.stored_name(name)
+        if not PARQUET_AVAILABLE:
+            with self.db_fs.open_write(stored, self.directory_name, 'w') as dst:
+                df.to_csv(dst, index=False)
+            return stored
+        
+        # Parquet columns hold one type; store mixed-type text columns (e.g. from an LLM) as strings
+        df = df.copy()
+        for col in df.select_dtypes(include=['object']).columns:
+            if pd.api.types.infer_dtype(df[col], skipna=True).startswith('mixed'):
+                df[col] = df[col].where(df[col].isna(), df[col].astype(str))
+        
+        batches = (df.iloc[i:i + INGEST_CHUNK_ROWS] for i in range(0, len(df), INGEST_CHUNK_ROWS))
+        self._write_parquet(batches, df.head(0), stored)
+        return stored
+    
+    def _write_parquet(self, batches, template, filename):
+        """Write DataFrame batches as row groups of one Parquet file in the database"""
+        schema = None
+        writer = None
+        with self.db_fs.open_write(filename, self.directory_name) as dst:
+            try:
+                for batch in batches:
+                    if schema is None:
+                        schema = self._schema(batch)
+                        writer = pq.ParquetWriter(dst, schema, compression='zstd')
+                    writer.write_table(pa.Table.from_pandas(batch, schema=schema, preserve_index=False))
+                
+                if writer is None:
+                    # No rows: still record the columns and their dtypes
+                    schema = self._schema(template)
+                    writer = pq.ParquetWriter(dst, schema, compression='zstd')
+            finally:
+                if writer is not None:
+                    writer.close()
+    
+    @staticmethod
+    def _schema(df):
+        """Arrow schema of a DataFrame, typing all-missing columns as strings"""
+        schema = pa.Schema.from_pandas(df, preserve_index=False)
+        fields = [field.with_type(pa.string()) if pa.types.is_null(field.type) else field
+                  for field in schema]
+        return pa.schema(fields, metadata=schema.metadata)
+    
+    def read(self, name, columns=None):
+        """Load a dataset, or only the given columns, as a DataFrame"""
+        filename = self._require(name)
+        with self.db_fs.open_read(filename, self.directory_name) as f:
+            if filename.endswith('.csv'):
+                return pd.read_csv(f, usecols=columns)
+            return pq.read_table(f, columns=columns).to_pandas()
+    
+    def head(self, name, n=10):
+        """Return the first n rows, reading only the leading row group"""
+        filename = self._require(name)
+        with self.db_fs.open_read(filename, self.directory_name) as f:
+            if filename.endswith('.csv'):
+                return pd.read_csv(f, nrows=n)
+            parquet_file = pq.ParquetFile(f)
+            for batch in parquet_file.iter_batches(batch_size=n):
+                return pa.Table.from_batches([batch]).to_pandas()
+            return parquet_file.schema_arrow.empty_table().to_pandas()
+    
+    def summary(self, name):
+        """
+        Return row count, column dtypes, missing-value counts and numeric column statistics
+        
+        For Parquet, counts and dtypes come from the file footer and only the numeric
+        columns are read, for their min, max, mean and median. Summaries are cached
+        in the database profile of the file's content, so repeat previews read nothing.
+        """
+        filename = self._require(name)
+        checksum = self.db_fs.stat(filename, self.directory_name)['checksum']
+        cached = (self.db_fs.get_profile(checksum) or {}).get('summary')
+        if cached is not None:
+            return cached
+        
+        with self.db_fs.open_read(filename, self.directory_name) as f:
+            if filename.endswith('.csv'):
+                df = pd.read_csv(f)
+                rows = len(df)
+                column_types = {col: str(df[col].dtype) for col in df.columns}
+                null_counts = {col: int(count) for col, count in df.isnull().sum().items()}
+                numeric = df.select_dtypes(include=['number'])
+            else:
+                parquet_file = pq.ParquetFile(f)
+                metadata = parquet_file.metadata
+                schema = parquet_file.schema_arrow
+                rows = metadata.num_rows
+                null_counts = dict.fromkeys(schema.names, 0)
+                for i in range(metadata.num_row_groups):
+                    row_group = metadata.row_group(i)
+                    for j in range(row_group.num_columns):
+                        column = row_group.column(j)
+                        statistics = column.statistics
+                        if statistics is not None and statistics.has_null_count:
+                            null_counts[column.path_in_schema] += statistics.null_count
+                column_types = self._column_types(schema, null_counts)
+                numeric_columns = [field.name for field in schema
+                                   if pa.types.is_integer(field.type) or pa.types.is_floating(field.type)]
+                numeric = parquet_file.read(columns=numeric_columns).to_pandas()
+        
+        numeric_stats = {}
+        for col in numeric.columns:
+            values = numeric[col]
+            numeric_stats[col] = {
+                stat: (float(value) if not pd.isna(value) else None)
+                for stat, value in (('min', values.min()), ('max', values.max()),
+                                    ('mean', values.mean()), ('median', values.median()))
+            }
+        
+        summary = {
+            'rows': rows,
+            'columns': list(column_types),
+            'column_types': column_types,
+            'null_counts': null_counts,
+            'numeric_stats': numeric_stats,
+        }
+        self.db_fs.update_profile(checksum, {'summary': summary})
+        return summary
+    
+    @staticmethod
+    def _column_types(schema, null_counts):
+        """Pandas dtype each column is read back as, from the Parquet schema metadata"""
+        stored = {}
+        pandas_metadata = schema.pandas_metadata or {}
+        for column in pandas_metadata.get('columns', []):
+            stored[column['name']] = column.get('numpy_type')
+        
+        types = {}
+        for name in schema.names:
+            dtype = stored.get(name) or str(schema.field(name).type)
+            if null_counts.get(name) and dtype in ('int64', 'bool'):
+                # Integers with missing values are read as float64, booleans as objects
+                dtype = 'float64' if dtype == 'int64' else 'object'
+            types[name] = dtype
+        return types
+    
+    def export_csv(self, name):
+        """Yield the dataset as CSV text, one row group at a time"""
+        filename = self._require(name)
+        with self.db_fs.open_read(filename, self.directory_name) as f:
+            if filename.endswith('.csv'):
+                while True:
+                    block = f.read(1024 * 1024)
+                    if not block:
+                        return
+                    yield block
+            
+            parquet_file = pq.ParquetFile(f)
+            yield parquet_file.schema_arrow.empty_table().to_pandas().to_csv(index=False)
+            for i in range(parquet_file.num_row_groups):
+                yield parquet_file.read_row_group(i).to_pandas().to_csv(index=False, header=False)
+    
+    def list_datasets(self):
+        """Return metadata dicts (see DBFileSystem.list_files_with_metadata) of the stored datasets"""
+        return [info for info in self.db_fs.list_files_with_metadata(self.directory_name)
+                if info['filename'].endswith(TABULAR_EXTENSIONS)]
+
+
+class _ParquetSink:
+    """
+    ingest_csv sink writing chunks as row groups of one zstd Parquet file in the database
+    
+    Every pass starts a new file from the pass's dtypes; the file of an earlier pass,
+    whose dtypes turned out too narrow, is discarded without being stored.
+    """
+    
+    def __init__(self, store, filename):
+        self.store = store
+        self.filename = filename
+        self._dst = None
+        self._writer = None
+        self._schema = None
+    
+    def start(self, template):
+        self.abort()
+        self._schema = self.store._schema(template)
+        self._dst = self.store.db_fs.open_write(self.filename, self.store.directory_name)
+        self._writer = pq.ParquetWriter(self._dst, self._schema, compression='zstd')
+    
+    def write(self, chunk):
+        self._writer.write_table(pa.Table.from_pandas(chunk, schema=self._schema, preserve_index=False))
+    
+    def close(self):
+        """Finish the file and store it"""
+        self._writer.close()
+        self._dst.close()
+        self._writer = self._dst = None
+    
+    def abort(self):
+        """Discard the file being written, if any"""
+        if self._writer is not None:
+            self._writer.close()
+            self._dst.abort()
+        self._writer = self._dst = None
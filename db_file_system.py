@@ -5,23 +5,215 @@ import os
 import tempfile
 import datetime
 import shutil
+import io
+import bisect
 import mimetypes
+import hashlib
+import json
+import threading
+from collections import OrderedDict
 from contextlib import contextmanager
 
+# Pragmas applied to every pooled connection. WAL lets readers proceed while a
+# model or dataset is being written, and NORMAL sync is safe under WAL.
+CONNECTION_PRAGMAS = (
+    ('journal_mode', 'WAL'),
+    ('synchronous', 'NORMAL'),
+    ('cache_size', -65536),      # 64 MB page cache (negative value = KiB)
+    ('mmap_size', 268435456),    # 256 MB memory-mapped I/O
+    ('temp_store', 'MEMORY'),
+    ('foreign_keys', 'ON'),
+)
+
+# Top-level directories that always exist under the ml_system root
+STANDARD_DIRECTORIES = ('datasets', 'models', 'downloads', 'runs', 'workspaces')
+
+# Directories of each per-job workspace, kept below 'workspaces/<workspace_id>'
+WORKSPACE_DIRECTORIES = ('datasets', 'models', 'downloads', 'runs')
+
+# File contents are split into fixed-size chunks stored once per SHA-256 hash
+CHUNK_SIZE = 1024 * 1024
+
+# Default memory budget of the shared read cache in front of get_file
+DEFAULT_CACHE_BYTES = int(os.getenv('DBFS_CACHE_BYTES', 256 * 1024 * 1024))
+
+# Chunks pinned longer ago than this and referenced by no file are reclaimed by sweep_chunks;
+# writers still running within this window keep their pins
+CHUNK_SWEEP_GRACE_SECONDS = int(os.getenv('DBFS_CHUNK_SWEEP_GRACE_SECONDS', 24 * 3600))
+
+
+class LRUByteCache:
+    """
+    Thread-safe LRU cache of file contents bounded by total size in bytes
+    
+    Keys are (directory_id, filename, file_id, updated_at), so a file that is
+    rewritten, even by another process, never matches its old entry.
+    """
+    
+    def __init__(self, max_bytes=DEFAULT_CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+    
+    def get(self, key):
+        """Return the cached content for key, or None"""
+        with self._lock:
+            content = self._entries.get(key)
+            if content is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return content
+    
+    def put(self, key, content):
+        """Cache content, evicting least recently used entries to stay within budget"""
+        # A single file larger than half the budget would flush everything else
+        if len(content) > self.max_bytes // 2:
+            return
+        
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self._bytes -= len(previous)
+            
+            self._entries[key] = content
+            self._bytes += len(content)
+            while self._bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._bytes -= len(evicted)
+                self.evictions += 1
+    
+    def invalidate(self, directory_id, filename=None):
+        """Drop the entries of one file, or of a whole directory if filename is None"""
+        with self._lock:
+            stale = [key for key in self._entries
+                     if key[0] == directory_id and (filename is None or key[1] == filename)]
+            for key in stale:
+                self._bytes -= len(self._entries.pop(key))
+    
+    def clear(self):
+        """Drop every entry"""
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+    
+    def stats(self):
+        """Hit/miss counters and current size, for monitoring"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'evictions': self.evictions,
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+                'max_bytes': self.max_bytes,
+            }
+
 class DBFileSystem:
     """
     A class that provides file system-like operations but uses a SQLite database
     as the storage backend.
+    
+    Connections are pooled per thread: each thread opens one connection on first
+    use and keeps reusing it, instead of reconnecting for every operation.
+    
+    File contents live in a content-addressed chunk store: each file is a list of
+    fixed-size chunks keyed by their hash, and chunks are reference counted so
+    identical data (re-saved models, duplicate images) is only stored once.
+    
+    get_file is served through an LRU cache shared by all instances that use the
+    same database file, so artifacts read repeatedly during one request are only
+    fetched from SQLite once.
     """
     
-    def __init__(self, db_path="ml_system.db"):
+    # Read caches shared between instances, keyed by absolute database path
+    _read_caches = {}
+    _read_caches_lock = threading.Lock()
+    
+    # Databases already swept for leaked chunk pins by this process
+    _swept_databases = set()
+    
+    def __init__(self, db_path="ml_system.db", timeout=30.0, cache_bytes=None):
         """Initialize the database file system with the given database path"""
         self.db_path = db_path
+        self.timeout = timeout
+        self.read_cache = self._get_read_cache(db_path, cache_bytes)
+        self._local = threading.local()
+        self._connections = []
+        self._connections_lock = threading.Lock()
+        # Directory path -> ID cache; the empty path is the ml_system root
+        self._path_cache = {(): 1}
+        self._path_cache_lock = threading.Lock()
+        self._namespace_version = None
         self._initialize_db()
+        
+        key = os.path.abspath(db_path)
+        with self._read_caches_lock:
+            sweep = key not in self._swept_databases
+            self._swept_databases.add(key)
+        if sweep:
+            reclaimed = self.sweep_chunks()
+            if reclaimed:
+                print(f"Reclaimed {reclaimed} chunks left pinned by interrupted writes")
+    
+    @classmethod
+    def _get_read_cache(cls, db_path, cache_bytes):
+        """Return the read cache shared by every instance on this database"""
+        with cls._read_caches_lock:
+            key = os.path.abspath(db_path)
+            cache = cls._read_caches.get(key)
+            if cache is None:
+                cache = LRUByteCache(DEFAULT_CACHE_BYTES if cache_bytes is None else cache_bytes)
+                cls._read_caches[key] = cache
+            elif cache_bytes is not None:
+                cache.max_bytes = cache_bytes
+            return cache
+    
+    def cache_stats(self):
+        """Return hit/miss statistics of the read cache"""
+        return self.read_cache.stats()
+    
+    def _connect(self):
+        """Open a new connection and apply the performance pragmas"""
+        conn = sqlite3.connect(self.db_path, timeout=self.timeout)
+        for pragma, value in CONNECTION_PRAGMAS:
+            conn.execute(f'PRAGMA {pragma} = {value}')
+        return conn
+    
+    def _get_pooled_connection(self):
+        """Return this thread's connection, opening it on first use"""
+        conn = getattr(self._local, 'conn', None)
+        # Connections must not be shared across a fork, so reopen in a child process
+        if conn is None or self._local.pid != os.getpid():
+            conn = self._connect()
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+            with self._connections_lock:
+                self._connections.append(conn)
+        return conn
+    
+    def close(self):
+        """Close every pooled connection (all threads)"""
+        with self._connections_lock:
+            connections, self._connections = self._connections, []
+        for conn in connections:
+            try:
+                conn.close()
+            except sqlite3.ProgrammingError:
+                # Connection belongs to another thread that is still alive
+                pass
+        self._local = threading.local()
     
     def _initialize_db(self):
         """Initialize the database with the required structure"""
-        conn = sqlite3.connect(self.db_path)
+        conn = self._get_pooled_connection()
         cursor = conn.cursor()
         
         # Create directories table
@@ -44,79 +236,317 @@ class DBFileSystem:
           mime_type TEXT,
           created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
           updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+          size INTEGER,
+          checksum TEXT,
           FOREIGN KEY (directory_id) REFERENCES directories(id)
         )
         ''')
         
+        # Create chunk store: one row per distinct chunk, shared between files
+        cursor.execute('''
+        CREATE TABLE IF NOT EXISTS blob_chunks (
+          hash TEXT PRIMARY KEY,
+          data BLOB NOT NULL,
+          size INTEGER NOT NULL,
+          refcount INTEGER NOT NULL DEFAULT 0,
+          pinned_at TIMESTAMP
+        )
+        ''')
+        
+        # Create file -> chunk mapping (files written before chunking keep using files.content)
+        cursor.execute('''
+        CREATE TABLE IF NOT EXISTS file_chunks (
+          file_id INTEGER NOT NULL,
+          seq INTEGER NOT NULL,
+          chunk_hash TEXT NOT NULL,
+          PRIMARY KEY (file_id, seq),
+          FOREIGN KEY (file_id) REFERENCES files(id),
+          FOREIGN KEY (chunk_hash) REFERENCES blob_chunks(hash)
+        )
+        ''')
+        self._add_metadata_columns(cursor)
+        
         # Create indexes
         cursor.execute('CREATE INDEX IF NOT EXISTS idx_files_directory ON files(directory_id)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_file_chunks_hash ON file_chunks(chunk_hash)')
         cursor.execute('CREATE INDEX IF NOT EXISTS idx_directories_parent ON directories(parent_id)')
         
+        # Covering index: listings and stat() are answered without reading file rows
+        cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_files_metadata 
+        ON files(directory_id, filename, size, checksum, mime_type, created_at, updated_at)
+        ''')
+        
+        # Directory names are unique within their parent, so a path maps to exactly one row
+        self._merge_duplicate_directories(cursor)
+        cursor.execute('CREATE UNIQUE INDEX IF NOT EXISTS idx_directories_parent_name ON directories(parent_id, name)')
+        
+        # Create namespace version, bumped whenever directories are removed
+        cursor.execute('''
+        CREATE TABLE IF NOT EXISTS fs_meta (
+          key TEXT PRIMARY KEY,
+          value INTEGER NOT NULL
+        )
+        ''')
+        cursor.execute("INSERT OR IGNORE INTO fs_meta (key, value) VALUES ('namespace_version', 0)")
+        
+        # Create dataset profiles: derived facts about a file's content, keyed by its checksum
+        cursor.execute('''
+        CREATE TABLE IF NOT EXISTS dataset_profiles (
+          checksum TEXT PRIMARY KEY,
+          profile TEXT NOT NULL,
+          updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        ''')
+        
         # Create root directory
         cursor.execute('INSERT OR IGNORE INTO directories (id, name, parent_id) VALUES (1, "ml_system", NULL)')
         
         # Create subdirectories
-        subdirs = ['datasets', 'models', 'downloads', 'runs']
-        for subdir in subdirs:
+        for subdir in STANDARD_DIRECTORIES:
             cursor.execute('INSERT OR IGNORE INTO directories (name, parent_id) VALUES (?, 1)', (subdir,))
         
         conn.commit()
-        conn.close()
+    
+    def _add_metadata_columns(self, cursor):
+        """Add the size/checksum columns to databases created before they existed"""
+        cursor.execute('PRAGMA table_info(files)')
+        columns = {row[1] for row in cursor.fetchall()}
+        if 'size' not in columns:
+            cursor.execute('ALTER TABLE files ADD COLUMN size INTEGER')
+        if 'checksum' not in columns:
+            cursor.execute('ALTER TABLE files ADD COLUMN checksum TEXT')
+        
+        cursor.execute('PRAGMA table_info(blob_chunks)')
+        if 'pinned_at' not in {row[1] for row in cursor.fetchall()}:
+            cursor.execute('ALTER TABLE blob_chunks ADD COLUMN pinned_at TIMESTAMP')
+        
+        # Sizes of older rows can be derived without loading any content;
+        # their checksum stays NULL until the file is saved again
+        cursor.execute('UPDATE files SET size = length(content) WHERE size IS NULL AND content IS NOT NULL')
+        cursor.execute('''
+        UPDATE files SET size = (
+          SELECT COALESCE(SUM(c.size), 0) FROM file_chunks fc 
+          JOIN blob_chunks c ON c.hash = fc.chunk_hash
+          WHERE fc.file_id = files.id
+        ) WHERE size IS NULL
+        ''')
+    
+    def _merge_duplicate_directories(self, cursor):
+        """
+        Merge directories that share a parent and a name
+        
+        Older databases looked directories up by bare name only and could end up
+        with several rows for the same path. Files and subdirectories are moved to
+        the oldest row before the extra rows are removed.
+        """
+        while True:
+            cursor.execute('''
+            SELECT MIN(id), GROUP_CONCAT(id) FROM directories 
+            WHERE parent_id IS NOT NULL
+            GROUP BY parent_id, name HAVING COUNT(*) > 1
+            ''')
+            duplicates = cursor.fetchall()
+            if not duplicates:
+                return
+            
+            for keep_id, ids in duplicates:
+                for duplicate_id in (int(i) for i in ids.split(',')):
+                    if duplicate_id == keep_id:
+                        continue
+                    cursor.execute('UPDATE files SET directory_id = ? WHERE directory_id = ?', (keep_id, duplicate_id))
+                    cursor.execute('UPDATE directories SET parent_id = ? WHERE parent_id = ?', (keep_id, duplicate_id))
+                    cursor.execute('DELETE FROM directories WHERE id = ?', (duplicate_id,))
     
     @contextmanager
     def _get_connection(self):
-        """Context manager for database connections"""
-        conn = sqlite3.connect(self.db_path)
+        """Context manager yielding this thread's pooled connection"""
+        conn = self._get_pooled_connection()
         try:
             yield conn
-        finally:
-            conn.close()
+        except Exception:
+            # Never leave a half-finished transaction on a connection that is reused
+            if conn.in_transaction:
+                conn.rollback()
+            raise
     
-    def _get_directory_id(self, directory_name):
-        """Get the ID of a directory by name"""
+    @staticmethod
+    def _split_path(directory_path):
+        """Split a directory path relative to the ml_system root into its parts"""
+        parts = [part for part in str(directory_path).replace('\\', '/').split('/') if part not in ('', '.')]
+        if parts and parts[0] == 'ml_system':
+            parts = parts[1:]
+        return tuple(parts)
+    
+    def _check_namespace_version(self, cursor):
+        """Drop cached paths if another connection has removed directories since"""
+        cursor.execute("SELECT value FROM fs_meta WHERE key = 'namespace_version'")
+        version = cursor.fetchone()[0]
+        if version != self._namespace_version:
+            with self._path_cache_lock:
+                self._path_cache = {(): 1}
+                self._namespace_version = version
+    
+    def _resolve_directory(self, directory_path, create=False):
+        """
+        Resolve a directory path like 'datasets/train/images' to its ID
+        
+        Each path is resolved once through the (parent_id, name) index and then
+        served from an in-memory cache. Returns None if the directory does not
+        exist and create is False.
+        """
+        parts = self._split_path(directory_path)
+        
         with self._get_connection() as conn:
             cursor = conn.cursor()
-            cursor.execute('SELECT id FROM directories WHERE name = ?', (directory_name,))
-            result = cursor.fetchone()
+            self._check_namespace_version(cursor)
             
-            if not result:
-                raise ValueError(f"Directory not found: {directory_name}")
+            directory_id = self._path_cache.get(parts)
+            if directory_id is not None:
+                return directory_id
             
-            return result[0]
+            # Walk down from the deepest cached ancestor
+            depth = len(parts)
+            while parts[:depth] not in self._path_cache:
+                depth -= 1
+            parent_id = self._path_cache[parts[:depth]]
+            
+            for depth in range(depth + 1, len(parts) + 1):
+                name = parts[depth - 1]
+                if create:
+                    cursor.execute('INSERT OR IGNORE INTO directories (name, parent_id) VALUES (?, ?)', (name, parent_id))
+                cursor.execute('SELECT id FROM directories WHERE parent_id = ? AND name = ?', (parent_id, name))
+                result = cursor.fetchone()
+                if not result:
+                    return None
+                
+                parent_id = result[0]
+                with self._path_cache_lock:
+                    self._path_cache[parts[:depth]] = parent_id
+            
+            if create:
+                conn.commit()
+            return parent_id
+    
+    def _get_directory_id(self, directory_name):
+        """Get the ID of a directory by name or by path (e.g. 'datasets/train/images')"""
+        directory_id = self._resolve_directory(directory_name)
+        if directory_id is None:
+            raise ValueError(f"Directory not found: {directory_name}")
+        return directory_id
     
     def _get_or_create_directory(self, directory_path):
         """
         Get a directory ID by path, creating it if necessary
         Path can be like 'datasets/images/train'
         """
-        parts = directory_path.replace('\\', '/').strip('/').split('/')
+        return self._resolve_directory(directory_path, create=True)
+    
+    def makedirs(self, directory_path, exist_ok=True):
+        """Create a directory and any missing parents"""
+        if not exist_ok and self.directory_exists(directory_path):
+            raise FileExistsError(f"Directory already exists: {directory_path}")
+        return self._get_or_create_directory(directory_path)
+    
+    def directory_exists(self, directory_path):
+        """Check if a directory exists"""
+        return self._resolve_directory(directory_path) is not None
+    
+    def list_directories(self, directory_name):
+        """List the names of the subdirectories of a directory"""
+        directory_id = self._get_directory_id(directory_name)
         
         with self._get_connection() as conn:
             cursor = conn.cursor()
             
-            parent_id = 1  # Start with root
-            current_id = None
+            cursor.execute('''
+            SELECT name FROM directories 
+            WHERE parent_id = ?
+            ORDER BY name
+            ''', (directory_id,))
             
-            for part in parts:
-                cursor.execute(
-                    'SELECT id FROM directories WHERE name = ? AND parent_id = ?', 
-                    (part, parent_id)
-                )
-                result = cursor.fetchone()
-                
-                if result:
-                    current_id = result[0]
-                else:
-                    cursor.execute(
-                        'INSERT INTO directories (name, parent_id) VALUES (?, ?)',
-                        (part, parent_id)
-                    )
-                    current_id = cursor.lastrowid
-                
-                parent_id = current_id
+            return [row[0] for row in cursor.fetchall()]
+    
+    @staticmethod
+    def workspace_directory(workspace_id, name=None):
+        """Return the directory path of a workspace, or of one of its directories (e.g. 'models')"""
+        workspace_id = str(workspace_id)
+        if not workspace_id or workspace_id in ('.', '..') or '/' in workspace_id or '\\' in workspace_id:
+            raise ValueError(f"Invalid workspace id: {workspace_id!r}")
+        path = f'workspaces/{workspace_id}'
+        return f'{path}/{name}' if name else path
+    
+    def create_workspace(self, workspace_id):
+        """
+        Create an isolated workspace with its own datasets, models, downloads and runs
+        
+        Jobs that work in separate workspaces never see or clear each other's
+        files, so they can run concurrently. Returns the workspace directory path.
+        """
+        for name in WORKSPACE_DIRECTORIES:
+            self.makedirs(self.workspace_directory(workspace_id, name))
+        return self.workspace_directory(workspace_id)
+    
+    def list_workspaces(self):
+        """List the ids of the existing workspaces"""
+        return self.list_directories('workspaces')
+    
+    def remove_workspace(self, workspace_id):
+        """Remove a workspace and everything in it; returns False if it did not exist"""
+        path = self.workspace_directory(workspace_id)
+        if not self.directory_exists(path):
+            return False
+        self.rmtree(path)
+        return True
+    
+    def rmtree(self, directory_path):
+        """
+        Remove a directory with all its files and subdirectories
+        
+        The root and the standard top-level directories are emptied instead of
+        removed, since the rest of the system expects them to exist.
+        """
+        parts = self._split_path(directory_path)
+        directory_id = self._get_directory_id(directory_path)
+        keep_directory = len(parts) == 0 or (len(parts) == 1 and parts[0] in STANDARD_DIRECTORIES)
+        
+        with self._get_connection() as conn:
+            cursor = conn.cursor()
+            
+            cursor.execute('''
+            WITH RECURSIVE subtree(id) AS (
+              SELECT ?
+              UNION ALL
+              SELECT d.id FROM directories d JOIN subtree s ON d.parent_id = s.id
+            )
+            SELECT id FROM subtree
+            ''', (directory_id,))
+            subtree_ids = [row[0] for row in cursor.fetchall()]
+            
+            for subtree_id in subtree_ids:
+                cursor.execute('SELECT id FROM files WHERE directory_id = ?', (subtree_id,))
+                for (file_id,) in cursor.fetchall():
+                    self._release_chunks(cursor, file_id)
+                cursor.execute('DELETE FROM files WHERE directory_id = ?', (subtree_id,))
             
+            removed_ids = subtree_ids[1:] if keep_directory else subtree_ids
+            cursor.executemany('DELETE FROM directories WHERE id = ?', [(i,) for i in reversed(removed_ids)])
+            
+            if removed_ids:
+                cursor.execute("UPDATE fs_meta SET value = value + 1 WHERE key = 'namespace_version'")
             conn.commit()
-            return current_id
+        
+        for subtree_id in subtree_ids:
+            self.read_cache.invalidate(subtree_id)
+        
+        # Invalidate cached paths at or below the removed directory
+        with self._path_cache_lock:
+            self._path_cache = {
+                path: cached_id for path, cached_id in self._path_cache.items()
+                if path[:len(parts)] != parts or (keep_directory and path == parts)
+            }
+        
+        return len(removed_ids)
     
     def save_file(self, filepath, directory_name, replace=True):
         """
@@ -133,14 +563,15 @@ class DBFileSystem:
         if not os.path.exists(filepath):
             raise FileNotFoundError(f"File not found: {filepath}")
         
-        # Read file content
-        with open(filepath, 'rb') as f:
-            content = f.read()
-        
         # Determine filename
         filename = os.path.basename(filepath)
         
-        return self.save_file_content(content, filename, directory_name, replace)
+        # Stream the file chunk by chunk instead of reading it into memory
+        with open(filepath, 'rb') as src:
+            with self.open_write(filename, directory_name, replace=replace) as dst:
+                shutil.copyfileobj(src, dst, CHUNK_SIZE)
+        
+        return dst.file_id
     
     def save_file_content(self, content, filename, directory_name, replace=True):
         """
@@ -155,8 +586,10 @@ class DBFileSystem:
         Returns:
             file_id: ID of the file in the database
         """
-        # Get mime type
-        mime_type = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+        # Split into chunks and hash them up front so unchanged files can be detected
+        chunks = [(hashlib.sha256(chunk).hexdigest(), chunk) for chunk in self._split_chunks(content)]
+        chunk_hashes = [chunk_hash for chunk_hash, _ in chunks]
+        checksum = hashlib.sha256(content).hexdigest()
         
         # Get directory ID
         directory_id = self._get_directory_id(directory_name)
@@ -164,50 +597,68 @@ class DBFileSystem:
         with self._get_connection() as conn:
             cursor = conn.cursor()
             
-            # Check if file already exists
-            cursor.execute('SELECT id FROM files WHERE filename = ? AND directory_id = ?', 
-                        (filename, directory_id))
-            existing_file = cursor.fetchone()
+            # Re-saving identical content only costs the hashing above
+            file_id = self._find_unchanged_file(cursor, filename, directory_id, chunk_hashes, replace)
+            if file_id is not None:
+                return file_id
             
-            if existing_file and replace:
-                # Update existing file
-                file_id = existing_file[0]
-                cursor.execute('''
-                UPDATE files 
-                SET content = ?, mime_type = ?, updated_at = ?
-                WHERE id = ?
-                ''', (content, mime_type, datetime.datetime.now(), file_id))
-            else:
-                # Insert new file
-                cursor.execute('''
-                INSERT INTO files (filename, directory_id, content, mime_type)
-                VALUES (?, ?, ?, ?)
-                ''', (filename, directory_id, content, mime_type))
-                file_id = cursor.lastrowid
+            for chunk_hash, chunk in chunks:
+                self._pin_chunk(cursor, chunk_hash, chunk)
+            file_id = self._link_file(cursor, filename, directory_id, chunk_hashes, replace,
+                                      len(content), checksum)
             
             conn.commit()
-            return file_id
+        
+        self.read_cache.invalidate(directory_id, filename)
+        return file_id
     
-    def get_file(self, filename, directory_name, save_to_disk=False):
+    def open_write(self, filename, directory_name, mode='wb', replace=True, encoding='utf-8'):
         """
-        Retrieve a file from the database
+        Open a file in the database for streaming writes
+        
+        Data is stored chunk by chunk as it is written, so memory use stays at one
+        chunk regardless of the file size. The new content becomes visible when the
+        stream is closed; leaving a `with` block through an exception discards it.
         
         Args:
-            filename: Name of the file to retrieve
+            filename: Name of the file
             directory_name: Name of the directory (datasets, models, downloads, runs)
-            save_to_disk: If True, save the file to a temporary location and return the path
+            mode: 'wb'/'ab' for bytes, 'w'/'a' for text
+            replace: If True, replace existing file with same name
+            encoding: Text encoding used in text mode
         
         Returns:
-            content: The file content as bytes, or file path if save_to_disk is True
+            A writable file-like object
+        """
+        # The writer buffers a full chunk itself, so it needs no BufferedWriter on top
+        stream = DBFileWriter(self, filename, directory_name, append='a' in mode, replace=replace)
+        if 'b' in mode:
+            return stream
+        return DBFileTextWriter(stream, encoding=encoding)
+    
+    def open_read(self, filename, directory_name, mode='rb', encoding='utf-8'):
+        """
+        Open a file in the database as a seekable, read-only stream
+        
+        Only the chunks that are actually read are fetched, using SQLite's
+        incremental BLOB I/O, so reading stays in constant memory.
+        
+        Args:
+            filename: Name of the file to read
+            directory_name: Name of the directory (datasets, models, downloads, runs)
+            mode: 'rb' for bytes, 'r' for text
+            encoding: Text encoding used in text mode
+        
+        Returns:
+            A readable file-like object
         """
         directory_id = self._get_directory_id(directory_name)
         
         with self._get_connection() as conn:
             cursor = conn.cursor()
             
-            # Get file content
             cursor.execute('''
-            SELECT content, mime_type FROM files 
+            SELECT id, content IS NOT NULL, length(content) FROM files 
             WHERE filename = ? AND directory_id = ?
             ''', (filename, directory_id))
             
@@ -215,18 +666,191 @@ class DBFileSystem:
             if not result:
                 raise FileNotFoundError(f"File not found: {filename} in {directory_name}")
             
-            content, mime_type = result
+            file_id, is_legacy, legacy_size = result
+            if is_legacy:
+                # Files saved before chunking are a single BLOB in files.content
+                segments = [('files', 'content', file_id, legacy_size)]
+            else:
+                cursor.execute('''
+                SELECT 'blob_chunks', 'data', c.rowid, c.size FROM file_chunks fc 
+                JOIN blob_chunks c ON c.hash = fc.chunk_hash
+                WHERE fc.file_id = ? ORDER BY fc.seq
+                ''', (file_id,))
+                segments = cursor.fetchall()
         
+        stream = io.BufferedReader(DBFileReader(self, segments, filename), buffer_size=256 * 1024)
+        if 'b' in mode:
+            return stream
+        return io.TextIOWrapper(stream, encoding=encoding)
+    
+    @staticmethod
+    def _split_chunks(content):
+        """Split content into CHUNK_SIZE views without copying it"""
+        view = memoryview(content)
+        return [view[offset:offset + CHUNK_SIZE] for offset in range(0, len(view), CHUNK_SIZE)]
+    
+    def _pin_chunk(self, cursor, chunk_hash, chunk):
+        """Add a reference to a chunk, storing its data if it is new"""
+        # Existing chunks only gain a reference; their data is not rewritten
+        cursor.execute('''
+        INSERT INTO blob_chunks (hash, data, size, refcount, pinned_at) VALUES (?, ?, ?, 1, CURRENT_TIMESTAMP)
+        ON CONFLICT(hash) DO UPDATE SET refcount = refcount + 1, pinned_at = CURRENT_TIMESTAMP
+        ''', (chunk_hash, chunk, len(chunk)))
+    
+    def _unpin_chunks(self, cursor, chunk_hashes):
+        """Drop one reference per hash and delete chunks nobody references any more"""
+        counts = {}
+        for chunk_hash in chunk_hashes:
+            counts[chunk_hash] = counts.get(chunk_hash, 0) + 1
+        
+        for chunk_hash, count in counts.items():
+            cursor.execute('UPDATE blob_chunks SET refcount = refcount - ? WHERE hash = ?', (count, chunk_hash))
+            cursor.execute('DELETE FROM blob_chunks WHERE hash = ? AND refcount <= 0', (chunk_hash,))
+    
+    def sweep_chunks(self, grace_seconds=CHUNK_SWEEP_GRACE_SECONDS):
+        """
+        Reclaim chunk references left behind by writes that never finished
+        
+        A writer pins each chunk as soon as it is complete, so a process killed
+        mid-write leaves pins that no file row accounts for. Chunks last pinned
+        more than grace_seconds ago get their refcount reset to the number of
+        file_chunks rows using them, and the ones left unreferenced are deleted.
+        Runs once per process and database when DBFileSystem is created.
+        
+        Returns:
+            Number of chunks deleted
+        """
+        with self._get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+            UPDATE blob_chunks SET refcount = (
+              SELECT COUNT(*) FROM file_chunks fc WHERE fc.chunk_hash = blob_chunks.hash
+            )
+            WHERE (pinned_at IS NULL OR pinned_at < datetime('now', ?))
+            AND refcount != (SELECT COUNT(*) FROM file_chunks fc WHERE fc.chunk_hash = blob_chunks.hash)
+            ''', (f'-{max(0, int(grace_seconds))} seconds',))
+            cursor.execute('DELETE FROM blob_chunks WHERE refcount <= 0')
+            reclaimed = cursor.rowcount
+            conn.commit()
+        return reclaimed
+    
+    def _find_unchanged_file(self, cursor, filename, directory_id, chunk_hashes, replace):
+        """Return the ID of an existing file whose chunks already match, else None"""
+        if not replace:
+            return None
+        
+        cursor.execute('''
+        SELECT id FROM files 
+        WHERE filename = ? AND directory_id = ? AND content IS NULL
+        ''', (filename, directory_id))
+        existing_file = cursor.fetchone()
+        
+        if existing_file and self._get_chunk_hashes(cursor, existing_file[0]) == chunk_hashes:
+            return existing_file[0]
+        return None
+    
+    def _link_file(self, cursor, filename, directory_id, chunk_hashes, replace, size, checksum):
+        """Point a file row at already pinned chunks, creating or replacing the row"""
+        # Get mime type
+        mime_type = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+        
+        # Check if file already exists
+        cursor.execute('SELECT id FROM files WHERE filename = ? AND directory_id = ?', 
+                    (filename, directory_id))
+        existing_file = cursor.fetchone()
+        
+        if existing_file and replace:
+            # Update existing file
+            file_id = existing_file[0]
+            self._release_chunks(cursor, file_id)
+            cursor.execute('''
+            UPDATE files 
+            SET content = NULL, mime_type = ?, updated_at = ?, size = ?, checksum = ?
+            WHERE id = ?
+            ''', (mime_type, datetime.datetime.now(), size, checksum, file_id))
+        else:
+            # Insert new file
+            cursor.execute('''
+            INSERT INTO files (filename, directory_id, content, mime_type, updated_at, size, checksum)
+            VALUES (?, ?, NULL, ?, ?, ?, ?)
+            ''', (filename, directory_id, mime_type, datetime.datetime.now(), size, checksum))
+            file_id = cursor.lastrowid
+        
+        cursor.executemany('INSERT INTO file_chunks (file_id, seq, chunk_hash) VALUES (?, ?, ?)',
+                           [(file_id, seq, chunk_hash) for seq, chunk_hash in enumerate(chunk_hashes)])
+        return file_id
+    
+    def _get_chunk_hashes(self, cursor, file_id):
+        """Return the ordered chunk hashes of a file"""
+        cursor.execute('SELECT chunk_hash FROM file_chunks WHERE file_id = ? ORDER BY seq', (file_id,))
+        return [row[0] for row in cursor.fetchall()]
+    
+    def _release_chunks(self, cursor, file_id):
+        """Unlink a file from its chunks and drop chunks that are no longer referenced"""
+        chunk_hashes = self._get_chunk_hashes(cursor, file_id)
+        cursor.execute('DELETE FROM file_chunks WHERE file_id = ?', (file_id,))
+        self._unpin_chunks(cursor, chunk_hashes)
+    
+    def _read_content(self, cursor, file_id, legacy_content):
+        """Reassemble a file from its chunks (or return its pre-chunking BLOB)"""
+        if legacy_content is not None:
+            return legacy_content
+        
+        cursor.execute('''
+        SELECT c.data FROM file_chunks fc 
+        JOIN blob_chunks c ON c.hash = fc.chunk_hash
+        WHERE fc.file_id = ? ORDER BY fc.seq
+        ''', (file_id,))
+        return b''.join(row[0] for row in cursor.fetchall())
+    
+    def get_file(self, filename, directory_name, save_to_disk=False):
+        """
+        Retrieve a file from the database
+        
+        Args:
+            filename: Name of the file to retrieve
+            directory_name: Name of the directory (datasets, models, downloads, runs)
+            save_to_disk: If True, save the file to a temporary location and return the path
+        
+        Returns:
+            content: The file content as bytes, or file path if save_to_disk is True
+        """
         if save_to_disk:
-            # Create temporary file
+            # Create temporary file, streaming it out of the database
             temp_dir = tempfile.gettempdir()
             file_path = os.path.join(temp_dir, filename)
             
-            with open(file_path, 'wb') as f:
-                f.write(content)
+            with self.open_read(filename, directory_name) as src, open(file_path, 'wb') as f:
+                shutil.copyfileobj(src, f, CHUNK_SIZE)
             
             return file_path
         
+        directory_id = self._get_directory_id(directory_name)
+        
+        with self._get_connection() as conn:
+            cursor = conn.cursor()
+            
+            # Look up the version first; the content is only loaded on a cache miss
+            cursor.execute('''
+            SELECT id, updated_at FROM files 
+            WHERE filename = ? AND directory_id = ?
+            ''', (filename, directory_id))
+            
+            result = cursor.fetchone()
+            if not result:
+                raise FileNotFoundError(f"File not found: {filename} in {directory_name}")
+            
+            file_id, updated_at = result
+            cache_key = (directory_id, filename, file_id, updated_at)
+            content = self.read_cache.get(cache_key)
+            if content is not None:
+                return content
+            
+            # Get file content
+            cursor.execute('SELECT content FROM files WHERE id = ?', (file_id,))
+            content = self._read_content(cursor, file_id, cursor.fetchone()[0])
+        
+        self.read_cache.put(cache_key, content)
         return content
     
     def list_files(self, directory_name):
@@ -244,6 +868,99 @@ class DBFileSystem:
             
             return [row[0] for row in cursor.fetchall()]
     
+    def stat(self, filename, directory_name):
+        """
+        Return a file's metadata without loading its content
+        
+        Returns:
+            dict with filename, directory, size (bytes), checksum (SHA-256 hex,
+            None for files not re-saved since checksums were introduced),
+            mime_type, created_at and updated_at
+        """
+        directory_id = self._get_directory_id(directory_name)
+        
+        with self._get_connection() as conn:
+            cursor = conn.cursor()
+            
+            cursor.execute('''
+            SELECT filename, size, checksum, mime_type, created_at, updated_at FROM files 
+            WHERE directory_id = ? AND filename = ?
+            ''', (directory_id, filename))
+            
+            result = cursor.fetchone()
+            if not result:
+                raise FileNotFoundError(f"File not found: {filename} in {directory_name}")
+            
+            return self._metadata_row(result, directory_name)
+    
+    def list_files_with_metadata(self, directory_name):
+        """List all files in a directory with their metadata (see stat)"""
+        directory_id = self._get_directory_id(directory_name)
+        
+        with self._get_connection() as conn:
+            cursor = conn.cursor()
+            
+            cursor.execute('''
+            SELECT filename, size, checksum, mime_type, created_at, updated_at FROM files 
+            WHERE directory_id = ?
+            ORDER BY filename
+            ''', (directory_id,))
+            
+            return [self._metadata_row(row, directory_name) for row in cursor.fetchall()]
+    
+    @staticmethod
+    def _metadata_row(row, directory_name):
+        """Turn a metadata query row into a dict"""
+        filename, size, checksum, mime_type, created_at, updated_at = row
+        return {
+            'filename': filename,
+            'directory': directory_name,
+            'size': size,
+            'checksum': checksum,
+            'mime_type': mime_type,
+            'created_at': created_at,
+            'updated_at': updated_at,
+        }
+    
+    def get_profile(self, checksum):
+        """Return the profile stored for a content checksum (see update_profile), or None"""
+        if checksum is None:
+            return None
+        
+        with self._get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('SELECT profile FROM dataset_profiles WHERE checksum = ?', (checksum,))
+            result = cursor.fetchone()
+        
+        return json.loads(result[0]) if result else None
+    
+    def update_profile(self, checksum, fields):
+        """
+        Merge JSON-serializable fields into the profile stored for a content checksum
+        
+        Profiles describe content, not a file, so every file with the same bytes
+        shares one, and it stays valid until the content changes.
+        """
+        if checksum is None:
+            return None
+        
+        with self._get_connection() as conn:
+            cursor = conn.cursor()
+            # Take the write lock up front so concurrent merges cannot lose fields
+            cursor.execute('BEGIN IMMEDIATE')
+            cursor.execute('SELECT profile FROM dataset_profiles WHERE checksum = ?', (checksum,))
+            result = cursor.fetchone()
+            profile = json.loads(result[0]) if result else {}
+            profile.update(fields)
+            
+            cursor.execute('''
+            INSERT INTO dataset_profiles (checksum, profile, updated_at) VALUES (?, ?, ?)
+            ON CONFLICT(checksum) DO UPDATE SET profile = excluded.profile, updated_at = excluded.updated_at
+            ''', (checksum, json.dumps(profile), datetime.datetime.now()))
+            conn.commit()
+        
+        return profile
+    
     def clear_directory(self, directory_name):
         """Remove all files from a directory"""
         directory_id = self._get_directory_id(directory_name)
@@ -251,11 +968,17 @@ class DBFileSystem:
         with self._get_connection() as conn:
             cursor = conn.cursor()
             
+            cursor.execute('SELECT id FROM files WHERE directory_id = ?', (directory_id,))
+            for (file_id,) in cursor.fetchall():
+                self._release_chunks(cursor, file_id)
+            
             cursor.execute('DELETE FROM files WHERE directory_id = ?', (directory_id,))
             deleted_count = cursor.rowcount
             
             conn.commit()
-            return deleted_count
+        
+        self.read_cache.invalidate(directory_id)
+        return deleted_count
     
     def file_exists(self, filename, directory_name):
         """Check if a file exists in the directory"""
@@ -278,6 +1001,13 @@ class DBFileSystem:
         with self._get_connection() as conn:
             cursor = conn.cursor()
             
+            cursor.execute('''
+            SELECT id FROM files 
+            WHERE filename = ? AND directory_id = ?
+            ''', (filename, directory_id))
+            for (file_id,) in cursor.fetchall():
+                self._release_chunks(cursor, file_id)
+            
             cursor.execute('''
             DELETE FROM files 
             WHERE filename = ? AND directory_id = ?
@@ -285,7 +1015,9 @@ class DBFileSystem:
             
             deleted = cursor.rowcount > 0
             conn.commit()
-            return deleted
+        
+        self.read_cache.invalidate(directory_id, filename)
+        return deleted
     
     def readFile(self, filepath, directory_name=None):
         """
@@ -312,13 +1044,233 @@ class DBFileSystem:
             with open(filepath, 'wb') as f:
                 f.write(content)
         else:
-            # Write to database - first save to temp file
-            temp_dir = tempfile.gettempdir()
-            filename = os.path.basename(filepath)
-            temp_path = os.path.join(temp_dir, filename)
+            # Write to database
+            self.save_file_content(content, os.path.basename(filepath), directory_name)
+
+
+class DBFileReader(io.RawIOBase):
+    """
+    Seekable read-only stream over a file stored in DBFileSystem
+    
+    The file is a list of BLOB segments (its chunks). Reads open only the segment
+    under the current position with sqlite3's incremental BLOB API.
+    """
+    
+    def __init__(self, db_fs, segments, name=None):
+        self._db_fs = db_fs
+        self._segments = segments
+        self.name = name
+        # Start offset of every segment, for locating the segment under a position
+        self._offsets = []
+        total = 0
+        for segment in segments:
+            self._offsets.append(total)
+            total += segment[3] or 0
+        self._size = total
+        self._position = 0
+    
+    def readable(self):
+        return True
+    
+    def seekable(self):
+        return True
+    
+    def tell(self):
+        return self._position
+    
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_SET:
+            position = offset
+        elif whence == io.SEEK_CUR:
+            position = self._position + offset
+        elif whence == io.SEEK_END:
+            position = self._size + offset
+        else:
+            raise ValueError(f"Invalid whence: {whence}")
+        
+        if position < 0:
+            raise ValueError(f"Negative seek position: {position}")
+        self._position = position
+        return position
+    
+    def readinto(self, buffer):
+        if self._position >= self._size:
+            return 0
+        
+        index = bisect.bisect_right(self._offsets, self._position) - 1
+        table, column, rowid, size = self._segments[index]
+        start = self._position - self._offsets[index]
+        length = min(len(buffer), size - start)
+        
+        conn = self._db_fs._get_pooled_connection()
+        try:
+            with conn.blobopen(table, column, rowid, readonly=True) as blob:
+                blob.seek(start)
+                data = blob.read(length)
+        except sqlite3.OperationalError as e:
+            raise OSError(f"{self.name} changed while it was being read: {e}") from e
+        
+        buffer[:len(data)] = data
+        self._position += len(data)
+        return len(data)
+
+
+class DBFileWriter(io.RawIOBase):
+    """
+    Write-only stream that stores data in DBFileSystem chunk by chunk
+    
+    Every full chunk is hashed and pinned in the chunk store as soon as it is
+    complete. Closing the stream links the pinned chunks to the file; aborting it
+    releases them again. A writer that is garbage-collected without an explicit
+    close() is aborted, so a dropped stream never stores a truncated file, and
+    pins of a process killed mid-write are reclaimed by DBFileSystem.sweep_chunks.
+    """
+    
+    def __init__(self, db_fs, filename, directory_name, append=False, replace=True):
+        self._db_fs = db_fs
+        self.name = filename
+        self._directory_id = db_fs._get_directory_id(directory_name)
+        self._replace = replace
+        self._pending = bytearray()
+        self._chunk_hashes = []
+        self._position = 0
+        self._checksum = hashlib.sha256()
+        self.file_id = None
+        
+        if append:
+            self._pin_existing_chunks()
+    
+    def _pin_existing_chunks(self):
+        """Start from the current content of the file when appending"""
+        with self._db_fs._get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('SELECT id, content FROM files WHERE filename = ? AND directory_id = ?',
+                           (self.name, self._directory_id))
+            result = cursor.fetchone()
+            if not result:
+                return
             
-            with open(temp_path, 'wb') as f:
-                f.write(content)
+            file_id, legacy_content = result
+            if legacy_content is not None:
+                self.write(legacy_content)
+                return
             
-            self.save_file(temp_path, directory_name)
-            os.remove(temp_path)
\ No newline at end of file
+            # Full chunks are reused as they are; a trailing partial chunk is reloaded
+            cursor.execute('''
+            SELECT c.hash, c.size FROM file_chunks fc 
+            JOIN blob_chunks c ON c.hash = fc.chunk_hash
+            WHERE fc.file_id = ? ORDER BY fc.seq
+            ''', (file_id,))
+            chunks = cursor.fetchall()
+            if chunks and chunks[-1][1] < CHUNK_SIZE:
+                cursor.execute('SELECT data FROM blob_chunks WHERE hash = ?', (chunks.pop()[0],))
+                self._pending += cursor.fetchone()[0]
+            
+            for chunk_hash, size in chunks:
+                cursor.execute('UPDATE blob_chunks SET refcount = refcount + 1, pinned_at = CURRENT_TIMESTAMP '
+                               'WHERE hash = ?', (chunk_hash,))
+                cursor.execute('SELECT data FROM blob_chunks WHERE hash = ?', (chunk_hash,))
+                self._checksum.update(cursor.fetchone()[0])
+                self._chunk_hashes.append(chunk_hash)
+                self._position += size
+            self._position += len(self._pending)
+            conn.commit()
+    
+    def writable(self):
+        return True
+    
+    def tell(self):
+        return self._position
+    
+    def write(self, data):
+        if self.closed:
+            raise ValueError("I/O operation on closed file")
+        
+        self._pending += data
+        written = len(memoryview(data))
+        self._position += written
+        while len(self._pending) >= CHUNK_SIZE:
+            self._flush_chunk(bytes(self._pending[:CHUNK_SIZE]))
+            del self._pending[:CHUNK_SIZE]
+        return written
+    
+    def _flush_chunk(self, chunk):
+        """Pin one completed chunk in the chunk store"""
+        chunk_hash = hashlib.sha256(chunk).hexdigest()
+        self._checksum.update(chunk)
+        with self._db_fs._get_connection() as conn:
+            self._db_fs._pin_chunk(conn.cursor(), chunk_hash, chunk)
+            conn.commit()
+        self._chunk_hashes.append(chunk_hash)
+    
+    def close(self):
+        if self.closed:
+            return
+        
+        if self._pending:
+            self._flush_chunk(bytes(self._pending))
+            self._pending = bytearray()
+        
+        with self._db_fs._get_connection() as conn:
+            cursor = conn.cursor()
+            
+            self.file_id = self._db_fs._find_unchanged_file(
+                cursor, self.name, self._directory_id, self._chunk_hashes, self._replace)
+            changed = self.file_id is None
+            if changed:
+                self.file_id = self._db_fs._link_file(
+                    cursor, self.name, self._directory_id, self._chunk_hashes, self._replace,
+                    self._position, self._checksum.hexdigest())
+            else:
+                # Same content as what is stored: give back the references taken while writing
+                self._db_fs._unpin_chunks(cursor, self._chunk_hashes)
+            conn.commit()
+        
+        if changed:
+            self._db_fs.read_cache.invalidate(self._directory_id, self.name)
+        
+        super().close()
+    
+    def abort(self):
+        """Discard everything written so far without touching the stored file"""
+        if self.closed:
+            return
+        
+        with self._db_fs._get_connection() as conn:
+            self._db_fs._unpin_chunks(conn.cursor(), self._chunk_hashes)
+            conn.commit()
+        self._chunk_hashes = []
+        self._pending = bytearray()
+        super().close()
+    
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if exc_type is not None:
+            self.abort()
+        else:
+            self.close()
+    
+    def __del__(self):
+        # io.IOBase.__del__ would close(), committing whatever was written so far
+        if not self.closed:
+            try:
+                self.abort()
+            except Exception:
+                pass
+
+
+
+class DBFileTextWriter(io.TextIOWrapper):
+    """Text-mode DBFileWriter that also discards its content when a `with` block fails"""
+    
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if exc_type is not None:
+            self.buffer.abort()
+        return super().__exit__(exc_type, exc_val, exc_tb)
+    
+    def __del__(self):
+        # Like DBFileWriter: only an explicit close() stores the file
+        if not self.closed:
+            try:
+                self.buffer.abort()
+            except Exception:
+                pass
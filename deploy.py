@@ -14,7 +14,6 @@ import base64
 import logging
 from werkzeug.utils import secure_filename
 from db_file_system import DBFileSystem
-from db_system_integration import apply_patches
 from dotenv import load_dotenv
 load_dotenv()
 
@@ -29,7 +28,6 @@ app = Flask(__name__, static_folder='../public')
 
 # Initialize the database file system
 db_fs = DBFileSystem()
-fs_adapter = apply_patches()
 
 # Directory name in the database for deployment files
 DEPLOYMENT_DIR = "deployments"
@@ -1,175 +1,213 @@
 # file_system_adapter.py
 
+import io
 import os
-import tempfile
+import shutil
 from db_file_system import DBFileSystem
 
 class FileSystemAdapter:
     """
-    Adapter class to replace standard file system operations with database operations
+    Virtual filesystem over the database and the local disk, with fsspec-style methods
+    
+    Paths below 'ml_system' map onto the database's directory tree, so
+    'ml_system/datasets/train/images/cat.jpg' is the file 'cat.jpg' in the
+    directory 'datasets/train/images'. Every other path is served from the
+    local disk, so callers can use one object for both without branching.
+    Modules call it explicitly; nothing in os, shutil or builtins is patched.
     """
-    def __init__(self, db_path="ml_system.db"):
-        self.db_fs = DBFileSystem(db_path)
+    def __init__(self, db_path="ml_system.db", db_fs=None):
+        self.db_fs = db_fs if db_fs is not None else DBFileSystem(db_path)
+    
+    @staticmethod
+    def _db_parts(path):
+        """Return the path components below 'ml_system', or None for regular paths"""
+        parts = [part for part in str(path).replace('\\', '/').split('/') if part not in ('', '.')]
+        if 'ml_system' not in parts:
+            return None
+        idx = parts.index('ml_system')
+        return parts[idx + 1:]
+    
+    def _split_file(self, path):
+        """Split a database path into (directory path, filename)"""
+        parts = self._db_parts(path)
+        if not parts:
+            return None, None
+        return '/'.join(parts[:-1]), parts[-1]
+    
+    def is_db_path(self, path):
+        """Check if a path lives in the database"""
+        return self._db_parts(path) is not None
+    
+    def db_directory(self, path):
+        """Return the database directory path for a directory below 'ml_system', or None"""
+        parts = self._db_parts(path)
+        if parts is None:
+            return None
+        return '/'.join(parts)
+    
+    def db_location(self, path):
+        """Return (database directory path, filename) for a file below 'ml_system', or (None, None)"""
+        return self._split_file(path)
     
     def makedirs(self, path, exist_ok=False):
-        """Create directory structure - no-op in DB version but needs to be compatible"""
-        # Extract directory name (last part of path)
-        parts = path.replace('\\', '/').strip('/').split('/')
-        if 'ml_system' in parts:
-            idx = parts.index('ml_system')
-            if idx + 1 < len(parts):
-                dir_name = parts[idx + 1]
-                # Ensure directory exists in our structure
-                try:
-                    self.db_fs._get_directory_id(dir_name)
-                except ValueError:
-                    # Directory doesn't exist, create it
-                    with self.db_fs._get_connection() as conn:
-                        cursor = conn.cursor()
-                        cursor.execute('INSERT INTO directories (name, parent_id) VALUES (?, 1)', (dir_name,))
-                        conn.commit()
+        """Create directory structure, including every nested level"""
+        parts = self._db_parts(path)
+        if parts is None:
+            return os.makedirs(path, exist_ok=exist_ok)
+        if not parts and not exist_ok:
+            raise FileExistsError(f"Directory already exists: {path}")
+        self.db_fs.makedirs('/'.join(parts), exist_ok=exist_ok)
     
     def listdir(self, path):
-        """List directory contents"""
-        # Extract directory name from path
-        parts = path.replace('\\', '/').strip('/').split('/')
-        if 'ml_system' in parts:
-            idx = parts.index('ml_system')
-            if idx + 1 < len(parts):
-                dir_name = parts[idx + 1]
-                return self.db_fs.list_files(dir_name)
-        return []
+        """List the names of directory contents (subdirectories and files), like os.listdir"""
+        parts = self._db_parts(path)
+        if parts is None:
+            return os.listdir(path)
+        directory = '/'.join(parts)
+        if not self.db_fs.directory_exists(directory):
+            raise FileNotFoundError(f"Directory not found: {path}")
+        return sorted(self.db_fs.list_directories(directory) + self.db_fs.list_files(directory))
+    
+    def ls(self, path, detail=False):
+        """List directory contents as full paths, or as info dicts if detail is True"""
+        entries = [os.path.join(path, name) for name in self.listdir(path)]
+        if detail:
+            return [self.info(entry) for entry in entries]
+        return entries
+    
+    def info(self, path):
+        """Return a dict with name, size, type ('file' or 'directory') and, for database files, checksum"""
+        parts = self._db_parts(path)
+        if parts is None:
+            st = os.stat(path)
+            is_dir = os.path.isdir(path)
+            return {
+                'name': path,
+                'size': 0 if is_dir else st.st_size,
+                'type': 'directory' if is_dir else 'file',
+                'mtime': st.st_mtime,
+            }
+        
+        if self.db_fs.directory_exists('/'.join(parts)):
+            return {'name': path, 'size': 0, 'type': 'directory'}
+        
+        dir_name, filename = self._split_file(path)
+        if filename is None or not self.db_fs.directory_exists(dir_name):
+            raise FileNotFoundError(f"File not found: {path}")
+        metadata = self.db_fs.stat(filename, dir_name)
+        return {
+            'name': path,
+            'size': metadata['size'],
+            'type': 'file',
+            'checksum': metadata['checksum'],
+            'mime_type': metadata['mime_type'],
+            'updated_at': metadata['updated_at'],
+        }
+    
+    def rm(self, path, recursive=False):
+        """Remove a file, or a directory and its contents if recursive is True"""
+        if self.isdir(path):
+            if not recursive:
+                raise IsADirectoryError(f"Is a directory: {path}")
+            return self.rmtree(path)
+        return self.remove(path)
     
     def remove(self, path):
         """Remove a file"""
-        # Extract directory and filename
-        parts = path.replace('\\', '/').strip('/').split('/')
-        if 'ml_system' in parts:
-            idx = parts.index('ml_system')
-            if idx + 1 < len(parts) and idx + 2 < len(parts):
-                dir_name = parts[idx + 1]
-                filename = parts[idx + 2]
-                return self.db_fs.delete_file(filename, dir_name)
+        dir_name, filename = self._split_file(path)
+        if filename is None:
+            return os.remove(path)
+        if not self.db_fs.directory_exists(dir_name) or not self.db_fs.delete_file(filename, dir_name):
+            raise FileNotFoundError(f"File not found: {path}")
     
     def rmtree(self, path):
         """Remove a directory and all its contents"""
-        # Extract directory name
-        parts = path.replace('\\', '/').strip('/').split('/')
-        if 'ml_system' in parts:
-            idx = parts.index('ml_system')
-            if idx + 1 < len(parts):
-                dir_name = parts[idx + 1]
-                return self.db_fs.clear_directory(dir_name)
+        parts = self._db_parts(path)
+        if parts is None:
+            return shutil.rmtree(path)
+        if not self.db_fs.directory_exists('/'.join(parts)):
+            raise FileNotFoundError(f"Directory not found: {path}")
+        return self.db_fs.rmtree('/'.join(parts))
     
     def exists(self, path):
         """Check if a path exists"""
-        # Determine if it's a file or directory
-        parts = path.replace('\\', '/').strip('/').split('/')
-        if 'ml_system' in parts:
-            idx = parts.index('ml_system')
-            if idx + 1 < len(parts):
-                dir_name = parts[idx + 1]
-                try:
-                    self.db_fs._get_directory_id(dir_name)
-                    # If there's a filename, check if the file exists
-                    if idx + 2 < len(parts):
-                        filename = parts[idx + 2]
-                        return self.db_fs.file_exists(filename, dir_name)
-                    return True  # Directory exists
-                except ValueError:
-                    return False  # Directory doesn't exist
-        return False
+        if self._db_parts(path) is None:
+            return os.path.exists(path)
+        return self.isdir(path) or self.isfile(path)
     
     def isdir(self, path):
         """Check if a path is a directory"""
-        # Extract directory name
-        parts = path.replace('\\', '/').strip('/').split('/')
-        if 'ml_system' in parts:
-            idx = parts.index('ml_system')
-            if idx + 1 < len(parts):
-                dir_name = parts[idx + 1]
-                try:
-                    self.db_fs._get_directory_id(dir_name)
-                    # If there's no filename, it's a directory
-                    return idx + 2 >= len(parts)
-                except ValueError:
-                    return False
-        return False
+        parts = self._db_parts(path)
+        if parts is None:
+            return os.path.isdir(path)
+        return self.db_fs.directory_exists('/'.join(parts))
     
     def isfile(self, path):
         """Check if a path is a file"""
-        # Extract directory and filename
-        parts = path.replace('\\', '/').strip('/').split('/')
-        if 'ml_system' in parts:
-            idx = parts.index('ml_system')
-            if idx + 1 < len(parts) and idx + 2 < len(parts):
-                dir_name = parts[idx + 1]
-                filename = parts[idx + 2]
-                return self.db_fs.file_exists(filename, dir_name)
-        return False
+        dir_name, filename = self._split_file(path)
+        if filename is None:
+            return self._db_parts(path) is None and os.path.isfile(path)
+        if not self.db_fs.directory_exists(dir_name):
+            return False
+        return self.db_fs.file_exists(filename, dir_name)
+    
+    def open(self, path, mode='r', encoding='utf-8'):
+        """Open a file in the database (or on disk) as a streaming file object"""
+        dir_name, filename = self._split_file(path)
+        if filename is None:
+            if self._db_parts(path) is not None:
+                raise IsADirectoryError(f"Is a directory: {path}")
+            if 'b' in mode:
+                return io.open(path, mode)
+            return io.open(path, mode, encoding=encoding)
+        
+        if 'r' in mode:
+            if not self.db_fs.directory_exists(dir_name):
+                raise FileNotFoundError(f"File not found: {path}")
+            return self.db_fs.open_read(filename, dir_name, mode, encoding=encoding)
+        
+        self.db_fs.makedirs(dir_name)
+        return self.db_fs.open_write(filename, dir_name, mode, encoding=encoding)
+    
+    def cat(self, path):
+        """Return the contents of a file as bytes"""
+        with self.open(path, 'rb') as f:
+            return f.read()
+    
+    def pipe(self, path, value):
+        """Write bytes to a file, replacing any previous contents"""
+        if self._db_parts(path) is None and os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        with self.open(path, 'wb') as f:
+            f.write(value)
+    
+    def put(self, lpath, rpath):
+        """Copy a local file to path, streaming it in chunks"""
+        with io.open(lpath, 'rb') as src, self.open(rpath, 'wb') as dst:
+            shutil.copyfileobj(src, dst)
+    
+    def get(self, rpath, lpath):
+        """Copy a file to a local path, streaming it in chunks"""
+        if os.path.dirname(lpath):
+            os.makedirs(os.path.dirname(lpath), exist_ok=True)
+        with self.open(rpath, 'rb') as src, io.open(lpath, 'wb') as dst:
+            shutil.copyfileobj(src, dst)
     
     def read_file(self, path, mode='r'):
         """Read a file from disk or database"""
-        # Determine if we should try to read from database
-        parts = path.replace('\\', '/').strip('/').split('/')
-        if 'ml_system' in parts:
-            idx = parts.index('ml_system')
-            if idx + 1 < len(parts) and idx + 2 < len(parts):
-                dir_name = parts[idx + 1]
-                filename = parts[idx + 2]
-                try:
-                    content = self.db_fs.get_file(filename, dir_name)
-                    # If mode is text mode, decode the content
-                    if 'b' not in mode:
-                        content = content.decode('utf-8')
-                    return content
-                except FileNotFoundError:
-                    pass  # Fall back to disk
-        
-        # Fall back to regular file reading
-        if 'b' in mode:
-            with open(path, mode) as f:
-                return f.read()
-        else:
-            with open(path, mode, encoding='utf-8') as f:
-                return f.read()
+        with self.open(path, 'rb' if 'b' in mode else 'r') as f:
+            return f.read()
     
     def write_file(self, path, content, mode='w'):
         """Write content to a file in disk or database"""
-        # Determine if we should try to write to database
-        parts = path.replace('\\', '/').strip('/').split('/')
-        if 'ml_system' in parts:
-            idx = parts.index('ml_system')
-            if idx + 1 < len(parts):
-                dir_name = parts[idx + 1]
-                # Convert content to bytes if needed
-                if isinstance(content, str) and 'b' in mode:
-                    content = content.encode('utf-8')
-                elif isinstance(content, bytes) and 'b' not in mode:
-                    content = content.decode('utf-8')
-                
-                # Create a temporary file to save
-                temp_dir = tempfile.gettempdir()
-                filename = os.path.basename(path)
-                temp_path = os.path.join(temp_dir, filename)
-                
-                if 'b' in mode:
-                    with open(temp_path, 'wb') as f:
-                        f.write(content)
-                else:
-                    with open(temp_path, 'w', encoding='utf-8') as f:
-                        f.write(content)
-                
-                # Save to database
-                self.db_fs.save_file(temp_path, dir_name)
-                os.remove(temp_path)
-                return
+        # Convert content to match the mode
+        if isinstance(content, str) and 'b' in mode:
+            content = content.encode('utf-8')
+        elif isinstance(content, bytes) and 'b' not in mode:
+            content = content.decode('utf-8')
+        
+        if self._db_parts(path) is None and os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
         
-        # Fall back to regular file writing
-        os.makedirs(os.path.dirname(path), exist_ok=True)
-        if 'b' in mode:
-            with open(path, mode) as f:
-                f.write(content)
-        else:
-            with open(path, mode, encoding='utf-8') as f:
-                f.write(content)
\ No newline at end of file
+        with self.open(path, 'wb' if 'b' in mode else 'w') as f:
+            f.write(content)
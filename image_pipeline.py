@@ -0,0 +1,416 @@
+# image_pipeline.py
+
+import os
+import re
+import json
+import math
+import shutil
+import tempfile
+import numpy as np
+from materialization_cache import DiskCache
+
+# tf.data input pipelines need TensorFlow; without it callers keep using ImageDataGenerator
+try:
+    import tensorflow as tf
+    TENSORFLOW_AVAILABLE = True
+except ImportError:
+    TENSORFLOW_AVAILABLE = False
+
+# Input engine for CNN training: 'tf.data', or 'generator' for Keras ImageDataGenerator
+IMAGE_PIPELINE = os.getenv('ML_IMAGE_PIPELINE', 'tf.data')
+
+# Images are resized to (height, width) to match the CNN's input
+IMAGE_SIZE = (64, 64)
+
+# Files read as images: the formats tf.io.decode_image understands
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.bmp', '.gif')
+
+# Where decoded image shards live, one directory per dataset, folder and image size
+SHARD_DIR = os.getenv('ML_IMAGE_SHARD_DIR', os.path.join(tempfile.gettempdir(), 'ml_system_image_shards'))
+
+# Disk budget for decoded image shards; least recently used folders are evicted beyond it
+SHARD_BYTES = int(os.getenv('ML_IMAGE_SHARD_BYTES', 10 * 1024 * 1024 * 1024))
+
+# Images per shard file; at 64x64 RGB that is 48 MB of uint8
+SHARD_IMAGES = 4096
+
+# Where frozen-backbone embeddings of sharded folders are kept, one .npy per folder and backbone
+EMBEDDING_DIR = os.getenv('ML_EMBEDDING_DIR', os.path.join(tempfile.gettempdir(), 'ml_system_embeddings'))
+
+# Disk budget for cached embeddings; least recently used files are evicted beyond it
+EMBEDDING_BYTES = int(os.getenv('ML_EMBEDDING_BYTES', 2 * 1024 * 1024 * 1024))
+
+# Shards and embeddings are evicted like materialized datasets, never within the grace period
+# of their last use; ImageShards maps every shard file when opened, so evicting one in use is safe
+shard_cache = DiskCache(SHARD_DIR, SHARD_BYTES, label='image shards')
+embedding_cache = DiskCache(EMBEDDING_DIR, EMBEDDING_BYTES, label='embeddings')
+
+
+def list_image_files(directory, subset=None, validation_split=0.0):
+    """
+    List the images of a directory with one subdirectory per class
+    
+    Follows flow_from_directory: classes are the sorted subdirectory names, and
+    with a validation_split the first part of each class's sorted files is the
+    'validation' subset and the rest the 'training' subset.
+    
+    Returns:
+    filenames: Image paths relative to directory
+    labels: Class index of each image
+    class_names: Class names in index order
+    """
+    class_names = sorted(d for d in os.listdir(directory) if os.path.isdir(os.path.join(directory, d)))
+    if subset == 'validation':
+        split = (0.0, validation_split)
+    elif subset == 'training':
+        split = (validation_split, 1.0)
+    else:
+        split = (0.0, 1.0)
+    
+    filenames = []
+    labels = []
+    for label, class_name in enumerate(class_names):
+        class_dir = os.path.join(directory, class_name)
+        class_files = sorted(
+            os.path.relpath(os.path.join(root, f), directory)
+            for root, _, files in os.walk(class_dir)
+            for f in files if f.lower().endswith(IMAGE_EXTENSIONS)
+        )
+        start, stop = int(split[0] * len(class_files)), int(split[1] * len(class_files))
+        filenames.extend(class_files[start:stop])
+        labels.extend([label] * (stop - start))
+    
+    return filenames, np.array(labels, dtype='int32'), class_names
+
+
+def _decode_image(path):
+    image = tf.io.decode_image(tf.io.read_file(path), channels=3, expand_animations=False)
+    # Nearest-neighbour resizing keeps uint8 and matches load_img's default
+    image = tf.image.resize(image, IMAGE_SIZE, method='nearest')
+    return tf.ensure_shape(image, IMAGE_SIZE + (3,))
+
+
+class ImageShards:
+    """
+    Decoded uint8 images of one folder, stored in memory-mapped .npy shards
+    
+    Rows are in the order of the folder's sorted filenames (see list_image_files).
+    take() gathers a batch straight from the mapped files, so nothing is decoded
+    and only the pages a batch touches are read.
+    """
+    
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, 'index.json')) as f:
+            index = json.load(f)
+        self.filenames = index['filenames']
+        self.rows = {filename: row for row, filename in enumerate(self.filenames)}
+        self.shards = [np.load(os.path.join(path, name), mmap_mode='r') for name in index['shards']]
+        self.offsets = np.cumsum([0] + [len(shard) for shard in self.shards])
+    
+    def take(self, rows):
+        """Return the images at the given rows as one (n, height, width, 3) uint8 array"""
+        rows = np.asarray(rows, dtype='int64')
+        images = np.empty((len(rows),) + IMAGE_SIZE + (3,), dtype='uint8')
+        shard_ids = np.searchsorted(self.offsets, rows, side='right') - 1
+        for shard_id in np.unique(shard_ids):
+            mask = shard_ids == shard_id
+            images[mask] = self.shards[shard_id][rows[mask] - self.offsets[shard_id]]
+        return images
+
+
+def load_image_shards(directory, cache_key, cache=shard_cache):
+    """
+    Return the ImageShards of a folder, decoding it into shards on first use
+    
+    cache_key must identify the folder's content (e.g. the dataset checksum and
+    the folder's name); the target size is added to it. Shards are written to a
+    staging directory and published into the DiskCache with an atomic rename, so
+    concurrent runs never read a half-written set.
+    """
+    name = re.sub(r'[^A-Za-z0-9_.-]', '_', f"{cache_key}-{IMAGE_SIZE[0]}x{IMAGE_SIZE[1]}")
+    path = cache.lookup(name)
+    if path is not None:
+        print(f"Using decoded image shards: {path}")
+        return ImageShards(path)
+    
+    filenames = list_image_files(directory)[0]
+    staging = cache.staging_path(name)
+    try:
+        # Decode in parallel, in file order, and fill one shard file at a time
+        paths = [os.path.join(directory, f) for f in filenames]
+        batches = (tf.data.Dataset.from_tensor_slices(paths)
+                   .map(_decode_image, num_parallel_calls=tf.data.AUTOTUNE)
+                   .batch(256)
+                   .prefetch(tf.data.AUTOTUNE)
+                   .as_numpy_iterator()) if paths else iter(())
+        
+        shard_names = []
+        shard = None
+        filled = 0
+        for batch in batches:
+            start = 0
+            while start < len(batch):
+                if shard is None:
+                    size = min(SHARD_IMAGES, len(paths) - SHARD_IMAGES * len(shard_names))
+                    shard_names.append(f'images_{len(shard_names):05d}.npy')
+                    shard = np.lib.format.open_memmap(os.path.join(staging, shard_names[-1]), mode='w+',
+                                                      dtype='uint8', shape=(size,) + IMAGE_SIZE + (3,))
+                    filled = 0
+                count = min(len(batch) - start, len(shard) - filled)
+                shard[filled:filled + count] = batch[start:start + count]
+                filled += count
+                start += count
+                if filled == len(shard):
+                    shard.flush()
+                    shard = None
+        
+        with open(os.path.join(staging, 'index.json'), 'w') as f:
+            json.dump({'filenames': filenames, 'shards': shard_names, 'image_size': IMAGE_SIZE}, f)
+        
+        cache.publish(name, staging, {'source': directory})
+        path = os.path.join(cache.root, name)
+    except Exception:
+        shutil.rmtree(staging, ignore_errors=True)
+        raise
+    
+    print(f"Decoded {len(filenames)} images into {len(shard_names)} shards: {path}")
+    return ImageShards(path)
+
+
+class ImageDataset:
+    """
+    tf.data pipeline over an image directory with the interface of a DirectoryIterator
+    
+    Files are decoded and resized by parallel map calls, and the decoded uint8
+    tensors are cached after the first epoch, so later epochs never touch the
+    JPEGs again. Rescaling, one-hot labels and augmentation run once per batch
+    on whole tensors, and batches are prefetched while the model trains.
+    
+    With shards (see load_image_shards) nothing is decoded at all: batches of
+    row indices are gathered from the memory-mapped arrays instead.
+    
+    Keras consumes `dataset`. class_indices, classes, filenames, samples, reset()
+    and next() behave like flow_from_directory's iterator, so visualizations work
+    with either engine. Only shuffled sets change order between epochs; the
+    others yield images in the order of `classes`.
+    """
+    
+    def __init__(self, directory, filenames, labels, class_names, batch_size=32, shuffle=False,
+                 augment=False, seed=None, shards=None):
+        self.directory = directory
+        self.filenames = filenames
+        self.classes = labels
+        self.class_indices = {name: i for i, name in enumerate(class_names)}
+        self.num_classes = len(class_names)
+        self.samples = self.n = len(filenames)
+        self.batch_size = batch_size
+        self.image_shape = IMAGE_SIZE + (3,)
+        self.shuffle = shuffle
+        self.augment = augment
+        self.seed = seed
+        self.shards = shards
+        self.dataset = self._build()
+        self._iterator = None
+    
+    def _build(self):
+        autotune = tf.data.AUTOTUNE
+        num_classes = self.num_classes
+        
+        if self.shards is not None:
+            rows = np.array([self.shards.rows[f] for f in self.filenames], dtype='int64')
+            
+            def gather(batch_rows, labels):
+                images = tf.numpy_function(self.shards.take, [batch_rows], tf.uint8)
+                return tf.ensure_shape(images, (None,) + self.image_shape), labels
+            
+            dataset = tf.data.Dataset.from_tensor_slices((rows, self.classes))
+            if self.shuffle:
+                dataset = dataset.shuffle(max(self.samples, 1), seed=self.seed, reshuffle_each_iteration=True)
+            dataset = dataset.batch(self.batch_size).map(gather, num_parallel_calls=autotune)
+        else:
+            paths = [os.path.join(self.directory, f) for f in self.filenames]
+            dataset = tf.data.Dataset.from_tensor_slices((paths, self.classes))
+            dataset = dataset.map(lambda path, label: (_decode_image(path), label), num_parallel_calls=autotune)
+            # uint8 keeps the cache at a quarter of the size of decoded float images
+            dataset = dataset.cache()
+            if self.shuffle:
+                dataset = dataset.shuffle(max(self.samples, 1), seed=self.seed, reshuffle_each_iteration=True)
+            dataset = dataset.batch(self.batch_size)
+        
+        if self.augment:
+            # Flips and zooms of ImageDataGenerator(horizontal_flip=True, zoom_range=0.2), applied per batch;
+            # its shear_range=0.2 is 0.2 degrees, too small to matter, so there is no shear step
+            augmentation = tf.keras.Sequential([
+                tf.keras.layers.RandomFlip('horizontal', seed=self.seed),
+                tf.keras.layers.RandomZoom(0.2, fill_mode='nearest', seed=self.seed),
+            ])
+        else:
+            augmentation = None
+        
+        def prepare(images, labels):
+            images = tf.cast(images, tf.float32) / 255.0
+            if augmentation is not None:
+                images = augmentation(images, training=True)
+            return images, tf.one_hot(labels, num_classes)
+        
+        dataset = dataset.map(prepare, num_parallel_calls=autotune)
+        return dataset.prefetch(autotune)
+    
+    def __len__(self):
+        return math.ceil(self.samples / self.batch_size)
+    
+    def reset(self):
+        """Start the next batch from the beginning of the set"""
+        self._iterator = None
+    
+    def __iter__(self):
+        return self
+    
+    def __next__(self):
+        # Like a DirectoryIterator, wrap around instead of stopping after one pass
+        if self._iterator is None:
+            self._iterator = self.dataset.repeat().as_numpy_iterator()
+        return next(self._iterator)
+
+
+def flow_from_directory(directory, batch_size=32, subset=None, validation_split=0.0, augment=False,
+                        shuffle=None, seed=None, cache_key=None):
+    """
+    Build an ImageDataset over a class-per-subdirectory image folder
+    
+    Parameters:
+    directory: Folder with one subdirectory of images per class
+    batch_size: Images per batch
+    subset: 'training' or 'validation' to take part of a validation_split, or None for all
+    validation_split: Fraction of each class held out as the 'validation' subset
+    augment: Apply random flips and zooms to every batch (for training sets)
+    shuffle: Reshuffle every epoch; defaults to augment, so evaluation sets keep their order
+    seed: Seed for shuffling and augmentation
+    cache_key: Identifies the folder's content; when given, images are read from
+               decoded shards (see load_image_shards) instead of the image files
+    """
+    if not TENSORFLOW_AVAILABLE:
+        raise ImportError("TensorFlow is required for the tf.data image pipeline but not available")
+    
+    filenames, labels, class_names = list_image_files(directory, subset, validation_split)
+    print(f"Found {len(filenames)} images belonging to {len(class_names)} classes.")
+    shards = load_image_shards(directory, cache_key) if cache_key else None
+    return ImageDataset(directory, filenames, labels, class_names, batch_size=batch_size,
+                        shuffle=augment if shuffle is None else shuffle, augment=augment, seed=seed,
+                        shards=shards)
+
+
+def ordered_batches(data):
+    """
+    Yield one pass of (images, one-hot labels) batches over a set, in the order of data.classes
+    
+    ImageDatasets are read without shuffling or augmentation. ImageDataGenerator
+    iterators are read with shuffling switched off for the pass.
+    """
+    if isinstance(data, ImageDataset):
+        if data.shuffle or data.augment:
+            data = ImageDataset(data.directory, data.filenames, data.classes, list(data.class_indices),
+                                batch_size=data.batch_size, shards=data.shards)
+        yield from data.dataset.as_numpy_iterator()
+        return
+    
+    shuffle = data.shuffle
+    data.shuffle = False
+    data.reset()
+    try:
+        for _ in range(len(data)):
+            yield next(data)
+    finally:
+        data.shuffle = shuffle
+        data.reset()
+
+
+class ImagePredictions:
+    """
+    Predictions of a model over a whole image set, in the order of the set's classes
+    
+    Produced by one inference pass after training and shared by the metrics, the
+    confusion matrix and every CNN plot, so they all describe the same images.
+    """
+    
+    def __init__(self, probabilities, y_true, class_names, sample_images=None):
+        self.probabilities = np.asarray(probabilities, dtype='float32')
+        self.y_pred = np.argmax(self.probabilities, axis=1)
+        self.y_true = np.asarray(y_true)
+        self.confidence = self.probabilities.max(axis=1)
+        self.class_names = class_names
+        # The set's first images, for previews next to their predictions
+        self.sample_images = sample_images
+    
+    @property
+    def accuracy(self):
+        return float(np.mean(self.y_pred == self.y_true)) if len(self.y_true) else 0.0
+
+
+def predict_image_set(data, predict, sample_size=9):
+    """Run predict (a batch of images to class probabilities) once over a set and return its ImagePredictions"""
+    probabilities, labels, samples = [], [], []
+    for images, one_hot in ordered_batches(data):
+        probabilities.append(predict(images))
+        labels.append(np.argmax(one_hot, axis=1))
+        if sum(len(batch) for batch in samples) < sample_size:
+            samples.append(images[:sample_size])
+    
+    num_classes = len(data.class_indices)
+    return ImagePredictions(
+        np.concatenate(probabilities) if probabilities else np.empty((0, num_classes)),
+        np.concatenate(labels) if labels else np.empty(0, dtype='int64'),
+        list(data.class_indices),
+        sample_images=np.concatenate(samples)[:sample_size] if samples else None
+    )
+
+
+def sample_images(data, sample_size=9):
+    """The first images of a set in ordered_batches order, or None for an empty set"""
+    for images, _ in ordered_batches(data):
+        return images[:sample_size]
+    return None
+
+def image_embeddings(data, embed, key, cache=embedding_cache):
+    """
+    Embed every image of a set once and return (embeddings, labels) in the set's order
+    
+    embed maps a batch of images, scaled like the set's batches, to a (batch, dim)
+    array; key identifies the backbone and its weights. Sets are embedded in ordered_batches order. For
+    ImageDatasets reading shards, the whole folder is embedded and saved in the
+    DiskCache as a .npy named after the shards and key, so the folder's other
+    subsets and later runs only read it (memory-mapped).
+    """
+    if not isinstance(data, ImageDataset) or data.shards is None:
+        embeddings, labels = [], []
+        for images, one_hot in ordered_batches(data):
+            embeddings.append(embed(images))
+            labels.append(np.argmax(one_hot, axis=1))
+        return np.concatenate(embeddings), np.concatenate(labels)
+    
+    shards = data.shards
+    name = f"{os.path.basename(shards.path)}-{key}.npy"
+    path = cache.lookup(name)
+    if path is not None:
+        print(f"Using cached embeddings: {path}")
+    else:
+        folder = ImageDataset(data.directory, shards.filenames, np.zeros(len(shards.filenames), dtype='int32'),
+                              ['all'], batch_size=128, shards=shards)
+        embeddings = np.concatenate([embed(images) for images, _ in folder.dataset.as_numpy_iterator()])
+        
+        # Written under a private name, then renamed into place so readers never see a partial file
+        staging = cache.staging_path(name, directory=False)
+        try:
+            with open(staging, 'wb') as f:
+                np.save(f, embeddings.astype('float32'))
+            cache.publish(name, staging, {'source': shards.path})
+        except Exception:
+            if os.path.exists(staging):
+                os.remove(staging)
+            raise
+        path = os.path.join(cache.root, name)
+        print(f"Embedded {len(embeddings)} images: {path}")
+    
+    rows = [shards.rows[f] for f in data.filenames]
+    return np.asarray(np.load(path, mmap_mode='r')[rows]), data.classes
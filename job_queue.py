@@ -0,0 +1,288 @@
+# job_queue.py
+
+import os
+import json
+import atexit
+import time
+import uuid
+import sqlite3
+import datetime
+import importlib
+import threading
+import traceback
+import multiprocessing
+from contextlib import contextmanager
+
+# Jobs allowed to wait for a worker; submissions beyond this are refused instead of piling up
+MAX_QUEUED_JOBS = int(os.getenv('ML_MAX_QUEUED_JOBS', 8))
+
+# Worker processes running jobs; training already uses every core, so one by default.
+# With more, the cores are split between them (see MAX_TRAINING_WORKERS)
+JOB_WORKERS = int(os.getenv('ML_JOB_WORKERS', 1))
+
+# CPU workers available to model selection across all concurrent requests in one process.
+# Every job worker process gets its own budget, so by default the cores are split between
+# them instead of each worker claiming all of them
+MAX_TRAINING_WORKERS = int(os.getenv('ML_MAX_WORKERS', max(1, (os.cpu_count() or 1) // max(1, JOB_WORKERS))))
+
+# Seconds an idle worker sleeps before looking for a new job
+POLL_INTERVAL = float(os.getenv('ML_JOB_POLL_SECONDS', 1.0))
+
+# Job states; queued and running jobs are active, the others are final
+QUEUED, RUNNING, COMPLETED, FAILED = 'queued', 'running', 'completed', 'failed'
+
+
+class QueueFull(Exception):
+    """Raised by JobQueue.submit when MAX_QUEUED_JOBS jobs are already waiting"""
+
+
+class JobQueue:
+    """
+    Durable job queue in a SQLite table, shared by the web process and its workers
+    
+    A job names its handler as 'module:function' and carries JSON parameters.
+    Workers claim the oldest queued job under a write lock, report progress into
+    its row and store the JSON result, so any process on the machine can submit
+    jobs or read their status without a broker.
+    """
+    
+    def __init__(self, db_path="ml_system.db", max_queued=MAX_QUEUED_JOBS, timeout=30.0):
+        self.db_path = db_path
+        self.max_queued = max_queued
+        self.timeout = timeout
+        self._initialize_db()
+    
+    @contextmanager
+    def _get_connection(self):
+        """Context manager yielding a short-lived connection"""
+        conn = sqlite3.connect(self.db_path, timeout=self.timeout)
+        conn.execute('PRAGMA journal_mode = WAL')
+        conn.execute('PRAGMA synchronous = NORMAL')
+        conn.row_factory = sqlite3.Row
+        try:
+            yield conn
+        finally:
+            conn.close()
+    
+    def _initialize_db(self):
+        """Create the jobs table if needed"""
+        with self._get_connection() as conn:
+            conn.execute('''
+            CREATE TABLE IF NOT EXISTS jobs (
+              id TEXT PRIMARY KEY,
+              handler TEXT NOT NULL,
+              params TEXT NOT NULL,
+              status TEXT NOT NULL,
+              progress REAL DEFAULT 0,
+              message TEXT,
+              result TEXT,
+              error TEXT,
+              worker_pid INTEGER,
+              created_at TIMESTAMP,
+              started_at TIMESTAMP,
+              finished_at TIMESTAMP
+            )
+            ''')
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs(status, created_at)')
+            conn.commit()
+    
+    def submit(self, handler, params, job_id=None):
+        """Queue a job and return its id; raises QueueFull when the queue is at capacity"""
+        job_id = job_id or uuid.uuid4().hex
+        with self._get_connection() as conn:
+            # Count and insert under one write lock so concurrent submits cannot overshoot
+            conn.execute('BEGIN IMMEDIATE')
+            queued = conn.execute('SELECT COUNT(*) FROM jobs WHERE status = ?', (QUEUED,)).fetchone()[0]
+            if queued >= self.max_queued:
+                conn.rollback()
+                raise QueueFull(f"{queued} jobs are already waiting; try again later")
+            
+            conn.execute('''
+            INSERT INTO jobs (id, handler, params, status, message, created_at)
+            VALUES (?, ?, ?, ?, ?, ?)
+            ''', (job_id, handler, json.dumps(params), QUEUED, 'Waiting for a worker',
+                  datetime.datetime.now()))
+            conn.commit()
+        
+        return job_id
+    
+    def get(self, job_id):
+        """Return the status, progress and result of a job as a dict, or None if unknown"""
+        with self._get_connection() as conn:
+            row = conn.execute('SELECT * FROM jobs WHERE id = ?', (job_id,)).fetchone()
+            if row is None:
+                return None
+            
+            job = {
+                'job_id': row['id'],
+                'status': row['status'],
+                'progress': row['progress'],
+                'message': row['message'],
+                'error': row['error'],
+                'result': json.loads(row['result']) if row['result'] else None,
+                'created_at': row['created_at'],
+                'started_at': row['started_at'],
+                'finished_at': row['finished_at'],
+            }
+            if row['status'] == QUEUED:
+                job['queue_position'] = conn.execute(
+                    'SELECT COUNT(*) FROM jobs WHERE status = ? AND created_at <= ?',
+                    (QUEUED, row['created_at'])).fetchone()[0]
+        
+        return job
+    
+    def claim(self, worker_pid):
+        """Mark the oldest queued job as running for worker_pid and return (id, handler, params), or None"""
+        with self._get_connection() as conn:
+            conn.execute('BEGIN IMMEDIATE')
+            row = conn.execute('SELECT id, handler, params FROM jobs WHERE status = ? ORDER BY created_at LIMIT 1',
+                               (QUEUED,)).fetchone()
+            if row is None:
+                conn.rollback()
+                return None
+            
+            conn.execute('''
+            UPDATE jobs SET status = ?, worker_pid = ?, started_at = ?, message = ? WHERE id = ?
+            ''', (RUNNING, worker_pid, datetime.datetime.now(), 'Started', row['id']))
+            conn.commit()
+        
+        return row['id'], row['handler'], json.loads(row['params'])
+    
+    def update_progress(self, job_id, progress, message=None):
+        """Record the progress (0-1) and current step of a running job"""
+        with self._get_connection() as conn:
+            conn.execute('UPDATE jobs SET progress = ?, message = COALESCE(?, message) WHERE id = ?',
+                         (float(progress), message, job_id))
+            conn.commit()
+    
+    def _finish(self, job_id, status, message, result=None, error=None):
+        with self._get_connection() as conn:
+            conn.execute('''
+            UPDATE jobs SET status = ?, progress = 1, message = ?, result = ?, error = ?, finished_at = ?
+            WHERE id = ?
+            ''', (status, message, json.dumps(result, default=str) if result is not None else None, error,
+                  datetime.datetime.now(), job_id))
+            conn.commit()
+    
+    def complete(self, job_id, result):
+        """Store the JSON-serializable result of a finished job"""
+        self._finish(job_id, COMPLETED, 'Completed', result=result)
+    
+    def fail(self, job_id, error, result=None):
+        """Mark a job as failed with an error message"""
+        self._finish(job_id, FAILED, 'Failed', result=result, error=error)
+    
+    def finished_before(self, cutoff):
+        """Return the ids of completed or failed jobs that finished before a datetime"""
+        with self._get_connection() as conn:
+            rows = conn.execute('SELECT id FROM jobs WHERE status IN (?, ?) AND finished_at < ?',
+                                (COMPLETED, FAILED, cutoff)).fetchall()
+        return [row['id'] for row in rows]
+    
+    def recover_orphans(self):
+        """Fail running jobs whose worker process no longer exists; returns how many"""
+        with self._get_connection() as conn:
+            rows = conn.execute('SELECT id, worker_pid FROM jobs WHERE status = ?', (RUNNING,)).fetchall()
+        
+        orphans = [row['id'] for row in rows if not _process_alive(row['worker_pid'])]
+        for job_id in orphans:
+            self.fail(job_id, 'The worker stopped before the job finished')
+        return len(orphans)
+
+
+def _process_alive(pid):
+    if not pid:
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def _resolve_handler(handler):
+    module_name, function_name = handler.split(':', 1)
+    return getattr(importlib.import_module(module_name), function_name)
+
+
+def run_job(queue, job_id, handler, params):
+    """
+    Run one claimed job and record its outcome
+    
+    The handler is called as handler(params, progress), where progress(fraction, message)
+    updates the job row. A returned dict with an 'error' key marks the job as failed.
+    """
+    def progress(fraction, message=None):
+        queue.update_progress(job_id, fraction, message)
+    
+    print(f"Running job {job_id} ({handler})")
+    try:
+        result = _resolve_handler(handler)(params, progress)
+    except Exception as e:
+        traceback.print_exc()
+        queue.fail(job_id, str(e))
+        return
+    
+    if isinstance(result, dict) and result.get('error'):
+        queue.fail(job_id, result['error'], result=result)
+    else:
+        queue.complete(job_id, result)
+    print(f"Finished job {job_id}")
+
+
+def worker_loop(db_path="ml_system.db"):
+    """Claim and run queued jobs forever"""
+    queue = JobQueue(db_path)
+    pid = os.getpid()
+    while True:
+        claimed = queue.claim(pid)
+        if claimed is None:
+            time.sleep(POLL_INTERVAL)
+            continue
+        run_job(queue, *claimed)
+
+
+# Worker processes started by this process
+_workers = []
+_workers_lock = threading.Lock()
+
+def start_workers(db_path="ml_system.db", workers=JOB_WORKERS):
+    """
+    Start the local worker processes, replacing any that have died
+    
+    Workers are spawned rather than forked, so they never inherit the web
+    process's threads, open database connections or framework state. They are
+    not daemonic, since training runs start process pools of their own, and are
+    terminated when this process exits.
+    """
+    with _workers_lock:
+        _workers[:] = [process for process in _workers if process.is_alive()]
+        if len(_workers) >= workers:
+            return _workers
+        
+        recovered = JobQueue(db_path).recover_orphans()
+        if recovered:
+            print(f"Marked {recovered} interrupted jobs as failed")
+        
+        context = multiprocessing.get_context('spawn')
+        while len(_workers) < workers:
+            process = context.Process(target=worker_loop, args=(db_path,))
+            process.start()
+            _workers.append(process)
+        
+        # Registered after the processes start, so it runs before multiprocessing joins them
+        atexit.unregister(_stop_workers)
+        atexit.register(_stop_workers)
+        return _workers
+
+def _stop_workers():
+    for process in _workers:
+        if process.is_alive():
+            process.terminate()
+
+
+if __name__ == '__main__':
+    # Run a standalone worker, e.g. alongside a web server that does not start its own
+    worker_loop()
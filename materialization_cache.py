@@ -0,0 +1,299 @@
+# materialization_cache.py
+
+import os
+import json
+import time
+import shutil
+import hashlib
+import tempfile
+import threading
+import zipfile
+
+# Where extracted archives live; shared by every process on the machine
+DEFAULT_MATERIALIZE_DIR = os.getenv(
+    'DBFS_MATERIALIZE_DIR', os.path.join(tempfile.gettempdir(), 'ml_system_materialized'))
+
+# Disk budget for extracted archives
+DEFAULT_MATERIALIZE_BYTES = int(os.getenv('DBFS_MATERIALIZE_BYTES', 10 * 1024 * 1024 * 1024))
+
+# Entries used more recently than this are never evicted, since a training run
+# or data generator may still be reading them
+EVICTION_GRACE_SECONDS = int(os.getenv('DBFS_MATERIALIZE_GRACE_SECONDS', 3600))
+
+
+class DiskCache:
+    """
+    Directory of cache entries, files or directories, kept within a disk budget
+    
+    Entries are built at a staging path and published with an atomic rename, so
+    readers, even in other processes, never see a partial entry. A metadata file
+    next to each entry records its size; its mtime is the entry's last use. When
+    the entries exceed max_bytes, the least recently used ones are evicted, except
+    those used within grace_seconds.
+    """
+    
+    def __init__(self, root, max_bytes, grace_seconds=EVICTION_GRACE_SECONDS, label='cache entry'):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.grace_seconds = grace_seconds
+        self.label = label
+        # Counters are shared by every thread using the cache
+        self._stats_lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+    
+    def lookup(self, key):
+        """Return the path of a published entry and record the use, or None if there is none"""
+        path = os.path.join(self.root, key)
+        if not os.path.exists(path):
+            with self._stats_lock:
+                self.misses += 1
+            return None
+        with self._stats_lock:
+            self.hits += 1
+        self._touch(key)
+        return path
+    
+    def staging_path(self, key, directory=True):
+        """Create a private staging directory (or empty file) to build entry key in"""
+        os.makedirs(self.root, exist_ok=True)
+        if directory:
+            return tempfile.mkdtemp(prefix=f'.staging-{key}-', dir=self.root)
+        fd, path = tempfile.mkstemp(prefix=f'.staging-{key}-', dir=self.root)
+        os.close(fd)
+        return path
+    
+    def publish(self, key, staging, meta=None):
+        """
+        Move a finished staging path into place as entry key and return its size
+        
+        If another process published the same entry first, the staging copy is
+        removed and theirs is kept. Least recently used entries are evicted after.
+        """
+        size = self._tree_size(staging)
+        with open(self._meta_path(key), 'w') as f:
+            json.dump(dict(meta or {}, size=size), f)
+        
+        path = os.path.join(self.root, key)
+        try:
+            os.rename(staging, path)
+        except OSError:
+            # Another process published the same entry first
+            if not os.path.exists(path):
+                raise
+            self._remove(staging)
+        
+        self._touch(key)
+        self._evict(keep=key)
+        return size
+    
+    def stats(self):
+        """Return hit/miss counters and current disk usage"""
+        entries = self._list_entries()
+        with self._stats_lock:
+            hits, misses, evictions = self.hits, self.misses, self.evictions
+        lookups = hits + misses
+        return {
+            'hits': hits,
+            'misses': misses,
+            'hit_rate': hits / lookups if lookups else 0.0,
+            'evictions': evictions,
+            'entries': len(entries),
+            'bytes': sum(size for _, size, _ in entries),
+            'max_bytes': self.max_bytes,
+        }
+    
+    def _meta_path(self, key):
+        return os.path.join(self.root, key + '.json')
+    
+    def _touch(self, key):
+        """Record a use; the metadata file's mtime drives LRU ordering"""
+        try:
+            os.utime(self._meta_path(key))
+        except OSError:
+            pass
+    
+    @staticmethod
+    def _tree_size(path):
+        if os.path.isfile(path):
+            return os.path.getsize(path)
+        total = 0
+        for root, _, files in os.walk(path):
+            for name in files:
+                try:
+                    total += os.path.getsize(os.path.join(root, name))
+                except OSError:
+                    pass
+        return total
+    
+    @staticmethod
+    def _remove(path):
+        if os.path.isdir(path):
+            shutil.rmtree(path, ignore_errors=True)
+        else:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+    
+    def _list_entries(self):
+        """Return (key, size, last_used) for every published entry"""
+        if not os.path.isdir(self.root):
+            return []
+        entries = []
+        for name in os.listdir(self.root):
+            if not name.endswith('.json'):
+                continue
+            key = name[:-len('.json')]
+            if not os.path.exists(os.path.join(self.root, key)):
+                continue
+            try:
+                with open(self._meta_path(key)) as f:
+                    size = json.load(f).get('size', 0)
+                entries.append((key, size, os.path.getmtime(self._meta_path(key))))
+            except (OSError, ValueError):
+                continue
+        return entries
+    
+    def _evict(self, keep=None):
+        """Remove least recently used entries until the cache fits its disk budget"""
+        now = time.time()
+        entries = sorted(self._list_entries(), key=lambda item: item[2])
+        total = sum(size for _, size, _ in entries)
+        
+        for key, size, last_used in entries:
+            if total <= self.max_bytes:
+                break
+            if key == keep or now - last_used < self.grace_seconds:
+                continue
+            
+            # Move aside first so readers never see a partially deleted entry
+            doomed = os.path.join(self.root, f'.evicting-{key}-{os.getpid()}')
+            try:
+                os.rename(os.path.join(self.root, key), doomed)
+            except OSError:
+                continue
+            self._remove(doomed)
+            try:
+                os.remove(self._meta_path(key))
+            except OSError:
+                pass
+            total -= size
+            with self._stats_lock:
+                self.evictions += 1
+            print(f"Evicted {self.label} {key} ({size / (1024 * 1024):.1f} MB)")
+        
+        # Leftovers of processes that died mid-build
+        for name in os.listdir(self.root):
+            if name.startswith(('.staging-', '.evicting-')):
+                path = os.path.join(self.root, name)
+                try:
+                    if now - os.path.getmtime(path) > self.grace_seconds:
+                        self._remove(path)
+                except OSError:
+                    pass
+
+
+class MaterializationCache(DiskCache):
+    """
+    On-disk cache of zip archives stored in the database, extracted once per checksum
+    
+    Each entry is a directory named after the archive's checksum (plus the name
+    of the prepare function, if any). Entries are built in a staging directory and
+    published with an atomic rename, so concurrent callers, even in other
+    processes, never see a half-extracted dataset. Entries are shared and must be
+    treated as read-only; use link_tree to get a private, writable view.
+    """
+    
+    def __init__(self, db_fs, root=DEFAULT_MATERIALIZE_DIR, max_bytes=DEFAULT_MATERIALIZE_BYTES,
+                 grace_seconds=EVICTION_GRACE_SECONDS):
+        super().__init__(root, max_bytes, grace_seconds, label='materialized dataset')
+        self.db_fs = db_fs
+        self._locks = {}
+        self._locks_lock = threading.Lock()
+        os.makedirs(self.root, exist_ok=True)
+    
+    def materialize(self, filename, directory_name, prepare=None):
+        """
+        Return a directory holding the extracted contents of a zip stored in the database
+        
+        Parameters:
+        filename: Name of the zip file in the database
+        directory_name: Database directory containing it
+        prepare: Optional function called with the staging directory after extraction,
+                 to normalize the layout once instead of on every use
+        
+        Returns:
+        Path of the shared, read-only extracted directory
+        """
+        key = self._entry_key(filename, directory_name, prepare)
+        
+        with self._key_lock(key):
+            entry = self.lookup(key)
+            if entry is not None:
+                print(f"Using materialized copy of {filename}: {entry}")
+                return entry
+            
+            staging = self.staging_path(key)
+            try:
+                # Extract straight from the database stream, no intermediate zip file
+                with self.db_fs.open_read(filename, directory_name) as src:
+                    with zipfile.ZipFile(src) as zip_ref:
+                        zip_ref.extractall(staging)
+                
+                if prepare is not None:
+                    prepare(staging)
+                
+                size = self.publish(key, staging, {'source': f"{directory_name}/{filename}"})
+            except Exception:
+                shutil.rmtree(staging, ignore_errors=True)
+                raise
+            
+            entry = os.path.join(self.root, key)
+            print(f"Materialized {filename} ({size / (1024 * 1024):.1f} MB) to {entry}")
+        return entry
+    
+    def link_tree(self, entry, dest):
+        """
+        Mirror a materialized entry inside dest without copying file contents
+        
+        Directories are recreated in dest and only the files are symlinked, so
+        files created anywhere in dest (e.g. YOLO's labels.cache next to a labels
+        directory) stay private to the caller while the shared entry is left
+        untouched. Files already in dest are kept. Linked files must be replaced,
+        not rewritten in place. Falls back to copying where symlinks are not
+        permitted (e.g. Windows without developer mode).
+        """
+        for root, _, files in os.walk(entry):
+            target = os.path.join(dest, os.path.relpath(root, entry))
+            os.makedirs(target, exist_ok=True)
+            for name in files:
+                src = os.path.join(root, name)
+                dst = os.path.join(target, name)
+                if os.path.lexists(dst):
+                    continue
+                try:
+                    os.symlink(src, dst)
+                except OSError:
+                    shutil.copy2(src, dst)
+        return dest
+    
+    def _entry_key(self, filename, directory_name, prepare):
+        """Name an entry after the archive checksum and the layout it was prepared for"""
+        info = self.db_fs.stat(filename, directory_name)
+        checksum = info['checksum']
+        if checksum is None:
+            # Files saved before checksums were recorded: key on identity and mtime
+            identity = f"{directory_name}/{filename}@{info['updated_at']}"
+            checksum = hashlib.sha256(identity.encode('utf-8')).hexdigest()
+        
+        key = checksum[:32]
+        if prepare is not None:
+            key += '-' + prepare.__name__.strip('_')
+        return key
+    
+    def _key_lock(self, key):
+        """Serialize extraction of the same entry within this process"""
+        with self._locks_lock:
+            return self._locks.setdefault(key, threading.Lock())
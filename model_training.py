@@ -1,9 +1,13 @@
 import pickle
 import os
 import numpy as np
-from sklearn.model_selection import GridSearchCV
+from sklearn.model_selection import ParameterGrid, check_cv
+from sklearn.base import clone
+from sklearn.pipeline import Pipeline
+from sklearn.metrics import get_scorer
+from sklearn.utils import resample
 from sklearn.tree import DecisionTreeClassifier, DecisionTreeRegressor
-from sklearn.linear_model import LogisticRegression
+from sklearn.linear_model import LogisticRegression, Ridge
 from sklearn.svm import SVC, SVR
 from sklearn.neighbors import KNeighborsClassifier, KNeighborsRegressor
 from sklearn.ensemble import RandomForestClassifier, RandomForestRegressor
@@ -11,23 +15,77 @@ from sklearn.ensemble import GradientBoostingClassifier, GradientBoostingRegress
 from sklearn.metrics import accuracy_score, r2_score
 import shutil
 import pandas as pd
-import numpy as np
 import tempfile
 import io
+import threading
+import time
+from scipy import sparse
+from contextlib import contextmanager
+from joblib import Parallel, delayed
 from db_file_system import DBFileSystem
+from materialization_cache import MaterializationCache
+from file_system_adapter import FileSystemAdapter
+from image_pipeline import ImageDataset, ImagePredictions, image_embeddings, predict_image_set, sample_images
+from job_queue import MAX_TRAINING_WORKERS
 
 # Initialize database file system
 db_fs = DBFileSystem()
+vfs = FileSystemAdapter(db_fs=db_fs)
+materialization_cache = MaterializationCache(db_fs)
 
-# Check if TensorFlow is available
-try:
+
+class WorkerBudget:
+    """
+    Process-wide budget of CPU workers shared by concurrent training requests
+    
+    A request reserves up to the workers it asks for and waits while none are
+    free, so parallel requests split the cores instead of oversubscribing them.
+    """
+    
+    def __init__(self, total):
+        self.total = max(1, total)
+        self._available = self.total
+        self._condition = threading.Condition()
+    
+    @contextmanager
+    def reserve(self, requested=None):
+        """Reserve workers (None or -1 means as many as possible) and yield the granted count"""
+        if requested is None or requested < 0:
+            requested = self.total
+        requested = max(1, min(requested, self.total))
+        
+        with self._condition:
+            while self._available == 0:
+                self._condition.wait()
+            granted = min(requested, self._available)
+            self._available -= granted
+        try:
+            yield granted
+        finally:
+            with self._condition:
+                self._available += granted
+                self._condition.notify_all()
+
+worker_budget = WorkerBudget(MAX_TRAINING_WORKERS)
+
+# Successive-halving search: used automatically from this many training rows up
+HALVING_MIN_ROWS = int(os.getenv('ML_HALVING_MIN_ROWS', 10000))
+# Fraction of candidates kept per round is 1/HALVING_FACTOR, sample size grows by the same factor
+HALVING_FACTOR = 3
+# Smallest subsample a candidate is ever scored on
+HALVING_MIN_SAMPLES = 300
+# Wall-clock budget (seconds) after which no further halving rounds are started
+SEARCH_TIME_BUDGET = float(os.getenv('ML_SEARCH_TIME_BUDGET', 60))
+
+# CNN builders and TensorFlow settings; cnn_models has no import side effects, so
+# tools like benchmark_cnn.py can use it without opening the database
+from cnn_models import (TENSORFLOW_AVAILABLE, CNN_TRAINING_MODE, CNN_BACKBONE, backbone_cache_key,
+                        backbone_weights_file, build_image_cnn, build_image_backbone)
+if TENSORFLOW_AVAILABLE:
     import tensorflow as tf
-    from tensorflow.keras.models import Sequential
-    from tensorflow.keras.layers import Conv2D, MaxPooling2D, Flatten, Dense, Dropout
-    from tensorflow.keras.optimizers import Adam
-    TENSORFLOW_AVAILABLE = True
-except ImportError:
-    TENSORFLOW_AVAILABLE = False
+
+# Epochs of the classifier head; each one is a pass over cached embeddings, so they are cheap
+HEAD_EPOCHS = int(os.getenv('ML_HEAD_EPOCHS', 50))
 
 # Check if YOLO is available
 try:
@@ -37,8 +95,18 @@ try:
 except ImportError:
     YOLO_AVAILABLE = False
 
-def train_models(X_train, y_train, X_test, y_test, task_type, models_dir, dataset_folder=None):
-    """Train models based on task type"""
+def train_models(X_train, y_train, X_test, y_test, task_type, models_dir, dataset_folder=None, n_jobs=None,
+                 search='auto', time_budget=None, preprocessor=None):
+    """
+    Train models based on task type
+    
+    For tabular tasks every (model, params, fold) fit of the model selection runs in
+    one pool of n_jobs workers (default: the whole shared worker budget).
+    search: 'grid' (exhaustive), 'halving' (successive halving on subsamples, bounded
+    by time_budget seconds) or 'auto' (halving from HALVING_MIN_ROWS rows up)
+    preprocessor: The dict returned by preprocess_dataset; if given, the saved model is
+    one pipeline of the fitted preprocessing and the best estimator
+    """
     # Handle object detection separately
     if task_type == 'object_detection' and YOLO_AVAILABLE:
         return train_yolo_model(dataset_folder, models_dir)
@@ -70,62 +138,336 @@ def train_models(X_train, y_train, X_test, y_test, task_type, models_dir, datase
             )
     
     # Original logic for other model types
-    models = {
-        "Decision Tree": DecisionTreeClassifier() if task_type in ['classification', 'nlp'] else DecisionTreeRegressor(),
-        "Support Vector Machine": SVC(probability=True) if task_type in ['classification', 'nlp'] else SVR(),
-        "K-Nearest Neighbors": KNeighborsClassifier() if task_type in ['classification', 'nlp'] else KNeighborsRegressor(),
-        "Random Forest": RandomForestClassifier() if task_type in ['classification', 'nlp'] else RandomForestRegressor(),
-        "Gradient Boosting": GradientBoostingClassifier() if task_type in ['classification', 'nlp'] else GradientBoostingRegressor(),
-    }
-
+    is_classification = task_type in ['classification', 'nlp']
+    candidates = get_candidate_models(task_type, sparse_input=sparse.issparse(X_train))
+    scorer = get_scorer('accuracy' if is_classification else 'r2')
+    
+    if search == 'auto':
+        search = 'halving' if len(y_train) >= HALVING_MIN_ROWS else 'grid'
+    if time_budget is None:
+        time_budget = SEARCH_TIME_BUDGET
+    
+    with worker_budget.reserve(n_jobs) as workers:
+        print(f"Model selection ({search} search) using {workers} worker(s)")
+        
+        if search == 'halving':
+            best_params = _halving_search(candidates, X_train, y_train, is_classification,
+                                          scorer, workers, time_budget)
+        else:
+            best_params = _grid_search(candidates, X_train, y_train, is_classification,
+                                       scorer, workers)
+        
+        for model_name in candidates:
+            if model_name not in best_params:
+                print(f"{model_name} dropped from model selection (pruned or failed to fit)")
+        
+        # Refit each model's best candidate on the full training set, also in parallel
+        refit_names = list(best_params)
+        refitted = Parallel(n_jobs=min(workers, max(len(refit_names), 1)))(
+            delayed(_refit)(candidates[model_name][0], best_params[model_name][0], X_train, y_train)
+            for model_name in refit_names
+        )
+    
     best_model = None
     best_model_name = ""
     best_score = -float('inf')
-
-    for model_name, model in models.items():
-        if model is None:
-            continue  # Skip models that are not applicable
-        
-        param_grid = {}
-        if model_name == "Decision Tree":
-            param_grid = {'max_depth': [None, 10, 20], 'min_samples_split': [2, 5]}
-        elif model_name == "Support Vector Machine":
-            param_grid = {'C': [0.1, 1], 'kernel': ['linear', 'rbf']}
-        elif model_name == "K-Nearest Neighbors":
-            param_grid = {'n_neighbors': [3, 5, 7]}
-        elif model_name == "Random Forest":
-            param_grid = {'n_estimators': [50, 100], 'max_depth': [None, 10]}
-        elif model_name == "Gradient Boosting":
-            param_grid = {'n_estimators': [50, 100], 'learning_rate': [0.1, 0.2]}
-
-        # Perform grid search
-        grid_search = GridSearchCV(model, param_grid, scoring='accuracy' if task_type in ['classification', 'nlp'] else 'r2', cv=3)
-
-        try:
-            grid_search.fit(X_train, y_train)
-        except Exception as e:
-            print(f"Error during training {model_name}: {e}")
+    
+    for model_name, estimator in zip(refit_names, refitted):
+        if estimator is None:
+            print(f"Error during training {model_name}: refit failed")
             continue
-
+        
         # Evaluate model
-        y_pred = grid_search.predict(X_test)
-        score = accuracy_score(y_test, y_pred) if task_type in ['classification', 'nlp'] else r2_score(y_test, y_pred)
-
-        print(f"{model_name} - Best Score: {grid_search.best_score_}, Test Score: {score}")
-
+        y_pred = estimator.predict(X_test)
+        score = accuracy_score(y_test, y_pred) if is_classification else r2_score(y_test, y_pred)
+        
+        print(f"{model_name} - Best Score: {best_params[model_name][1]}, Test Score: {score}")
+        
         # Update best model information if applicable
         if score > best_score:
             best_score = score
-            best_model = grid_search.best_estimator_
+            best_model = estimator
             best_model_name = model_name
-
+    
     if best_model is not None:
-        save_best_model(best_model, models_dir)
+        save_best_model(build_inference_pipeline(best_model, preprocessor), models_dir)
     else:
         print("No suitable model was found.")
-
+    
     return best_model, best_model_name, best_score, best_model.predict(X_test) if best_model else None
 
+def build_inference_pipeline(model, preprocessor=None):
+    """
+    Chain the fitted preprocessing in front of a fitted estimator
+    
+    The result predicts from raw feature columns (a DataFrame shaped like the
+    training data without its target), applying exactly the training transforms.
+    Without a preprocessor the estimator is returned unchanged.
+    """
+    if not preprocessor or preprocessor.get('transformer') is None:
+        return model
+    return Pipeline(steps=[
+        ('preprocessor', preprocessor['transformer']),
+        ('model', model)
+    ])
+
+def get_candidate_models(task_type, sparse_input=False):
+    """
+    Return {model name: (unfitted estimator, param_grid)} for a tabular task type
+    
+    For sparse (CSR) input, KNN uses brute-force search, which works on sparse rows
+    directly, and Gradient Boosting is replaced by a linear model, which is fast on
+    high-dimensional sparse features.
+    """
+    is_classification = task_type in ['classification', 'nlp']
+    knn_algorithm = 'brute' if sparse_input else 'auto'
+    models = {
+        "Decision Tree": (
+            DecisionTreeClassifier() if is_classification else DecisionTreeRegressor(),
+            {'max_depth': [None, 10, 20], 'min_samples_split': [2, 5]}),
+        "Support Vector Machine": (
+            SVC(probability=True) if is_classification else SVR(),
+            {'C': [0.1, 1], 'kernel': ['linear', 'rbf']}),
+        "K-Nearest Neighbors": (
+            KNeighborsClassifier(algorithm=knn_algorithm) if is_classification
+            else KNeighborsRegressor(algorithm=knn_algorithm),
+            {'n_neighbors': [3, 5, 7]}),
+        "Random Forest": (
+            RandomForestClassifier() if is_classification else RandomForestRegressor(),
+            {'n_estimators': [50, 100], 'max_depth': [None, 10]}),
+    }
+    if sparse_input and is_classification:
+        models["Logistic Regression"] = (LogisticRegression(max_iter=1000), {'C': [0.1, 1, 10]})
+    elif sparse_input:
+        models["Ridge Regression"] = (Ridge(), {'alpha': [0.1, 1, 10]})
+    else:
+        models["Gradient Boosting"] = (
+            GradientBoostingClassifier() if is_classification else GradientBoostingRegressor(),
+            {'n_estimators': [50, 100], 'learning_rate': [0.1, 0.2]})
+    return models
+
+def _cv_scores(candidates, entries, X, y, is_classification, scorer, workers, fit_overrides=None):
+    """
+    Mean 3-fold CV score of each (model name, params) entry, NaN if any fold failed
+    
+    Every (entry, fold) fit runs in a single pool. fit_overrides(model) may return
+    extra parameters used only for the CV fits, never for the final refit.
+    """
+    # Same folds GridSearchCV(cv=3) would use: stratified for classifiers
+    cv = check_cv(3, y, classifier=is_classification)
+    folds = list(cv.split(X, y))
+    
+    tasks = []
+    for entry_idx, (model_name, params) in enumerate(entries):
+        model = candidates[model_name][0]
+        fit_params = dict(params, **(fit_overrides(model) if fit_overrides else {}))
+        for train_idx, test_idx in folds:
+            tasks.append((entry_idx, model, fit_params, train_idx, test_idx))
+    
+    fold_scores = Parallel(n_jobs=workers)(
+        delayed(_fit_and_score)(model, fit_params, X, y, train_idx, test_idx, scorer)
+        for _, model, fit_params, train_idx, test_idx in tasks
+    )
+    
+    scores = [[] for _ in entries]
+    for (entry_idx, *_), score in zip(tasks, fold_scores):
+        scores[entry_idx].append(score)
+    return [np.nan if np.isnan(entry_scores).any() else float(np.mean(entry_scores))
+            for entry_scores in scores]
+
+def _best_per_model(entries, scores):
+    """Keep the highest scoring params of each model, as GridSearchCV would choose"""
+    best_params = {}
+    for (model_name, params), score in zip(entries, scores):
+        if np.isnan(score):
+            continue
+        if model_name not in best_params or score > best_params[model_name][1]:
+            best_params[model_name] = (params, score)
+    return best_params
+
+def _grid_search(candidates, X, y, is_classification, scorer, workers):
+    """Exhaustive search: every (model, params, fold) fit on the full training set"""
+    entries = [(model_name, params)
+               for model_name, (model, param_grid) in candidates.items()
+               for params in ParameterGrid(param_grid)]
+    scores = _cv_scores(candidates, entries, X, y, is_classification, scorer, workers)
+    return _best_per_model(entries, scores)
+
+def _without_probability(model):
+    """Skip SVC's internal Platt scaling for CV fits; accuracy only needs predict()"""
+    return {'probability': False} if 'probability' in model.get_params() else {}
+
+def _halving_search(candidates, X, y, is_classification, scorer, workers, time_budget):
+    """
+    Successive halving over every (model, params) candidate of all models together
+    
+    Each round scores the surviving candidates on a larger subsample and keeps the
+    best 1/HALVING_FACTOR, until at most HALVING_FACTOR remain or the full training
+    set is used. When the wall-clock budget runs out, the current leaders survive.
+    """
+    start_time = time.time()
+    entries = [(model_name, params)
+               for model_name, (model, param_grid) in candidates.items()
+               for params in ParameterGrid(param_grid)]
+    
+    n_samples = len(y)
+    n_rounds = max(1, int(np.ceil(np.log(max(len(entries), 1) / HALVING_FACTOR) / np.log(HALVING_FACTOR))) + 1)
+    min_samples = max(HALVING_MIN_SAMPLES, n_samples // HALVING_FACTOR ** (n_rounds - 1))
+    
+    scores = []
+    for round_idx in range(n_rounds):
+        n_resources = min(n_samples, min_samples * HALVING_FACTOR ** round_idx)
+        if round_idx == n_rounds - 1:
+            n_resources = n_samples
+        
+        if n_resources < n_samples:
+            subsample = resample(np.arange(n_samples), n_samples=n_resources, replace=False,
+                                 stratify=y if is_classification else None, random_state=round_idx)
+            X_round, y_round = _take_rows(X, subsample), _take_rows(y, subsample)
+        else:
+            X_round, y_round = X, y
+        
+        scores = _cv_scores(candidates, entries, X_round, y_round, is_classification,
+                            scorer, workers, fit_overrides=_without_probability)
+        print(f"Halving round {round_idx + 1}/{n_rounds}: {len(entries)} candidates on {n_resources} samples")
+        
+        elapsed = time.time() - start_time
+        if round_idx == n_rounds - 1 or len(entries) <= HALVING_FACTOR:
+            break
+        
+        # Promote the best third (NaN scores, i.e. failed fits, always lose)
+        keep = max(HALVING_FACTOR, int(np.ceil(len(entries) / HALVING_FACTOR)))
+        order = sorted(range(len(entries)), key=lambda i: -np.inf if np.isnan(scores[i]) else scores[i],
+                       reverse=True)[:keep]
+        entries = [entries[i] for i in order]
+        scores = [scores[i] for i in order]
+        
+        if elapsed > time_budget:
+            print(f"Search time budget of {time_budget}s used up after {elapsed:.1f}s, keeping current leaders")
+            break
+    
+    return _best_per_model(entries, scores)
+
+def _take_rows(data, indices):
+    """Select rows from a DataFrame/Series, numpy array or sparse matrix"""
+    if hasattr(data, 'iloc'):
+        return data.iloc[indices]
+    return data[indices]
+
+def _fit_and_score(model, params, X, y, train_idx, test_idx, scorer):
+    """Fit one candidate on one CV fold and return its validation score (NaN on failure)"""
+    try:
+        estimator = clone(model).set_params(**params)
+        estimator.fit(_take_rows(X, train_idx), _take_rows(y, train_idx))
+        return scorer(estimator, _take_rows(X, test_idx), _take_rows(y, test_idx))
+    except Exception as e:
+        print(f"Fit failed for {type(model).__name__} with {params}: {e}")
+        return np.nan
+
+def _refit(model, params, X, y):
+    """Fit a candidate on the full training set, or return None on failure"""
+    try:
+        return clone(model).set_params(**params).fit(X, y)
+    except Exception as e:
+        print(f"Refit failed for {type(model).__name__} with {params}: {e}")
+        return None
+
+def train_image_head(training_set, validation_set, test_set, image_shape, num_classes, models_dir=None,
+                     epochs=HEAD_EPOCHS, learning_rate=0.001, batch_size=32, early_stopping_patience=3,
+                     backbone=CNN_BACKBONE):
+    """
+    Transfer learning: train a classifier head on embeddings of a frozen backbone
+    
+    Every set is run through the backbone once (see image_embeddings, which keeps
+    the embeddings of sharded folders on disk for later runs), then only a small
+    dense head is trained on the embeddings. Augmentation does not apply, since
+    each image is embedded once. The returned model chains backbone and head, so
+    it classifies images like the CNN trained from scratch.
+    
+    Returns:
+    model, predictions (ImagePredictions of the test set, or the training set without one), history
+    """
+    from tensorflow.keras import Sequential, Input, Model
+    from tensorflow.keras.layers import Dense, Dropout
+    from tensorflow.keras.optimizers import Adam
+    from tensorflow.keras.callbacks import EarlyStopping
+    
+    print(f"Transfer learning on frozen {backbone} features...")
+    # Embeddings are cached under the backbone, its input size and its weights
+    key = backbone_cache_key(backbone)
+    extractor = build_image_backbone(image_shape, backbone)
+    
+    def embed(images):
+        return extractor.predict_on_batch(images)
+    
+    start = time.time()
+    x_train, y_train = image_embeddings(training_set, embed, key)
+    evaluation_set = validation_set or test_set
+    validation_data = None
+    if evaluation_set:
+        x_val, y_val = image_embeddings(evaluation_set, embed, key)
+        validation_data = (x_val, tf.keras.utils.to_categorical(y_val, num_classes))
+    print(f"Embedded the training and validation images in {time.time() - start:.1f}s")
+    
+    head = Sequential([
+        Input(shape=(extractor.output_shape[-1],)),
+        Dropout(0.2),
+        Dense(num_classes, activation='softmax')
+    ])
+    head.compile(
+        optimizer=Adam(learning_rate=learning_rate),
+        loss='categorical_crossentropy',
+        metrics=['accuracy']
+    )
+    
+    callbacks = []
+    if validation_data is not None:
+        callbacks.append(EarlyStopping(
+            monitor='val_loss',
+            patience=early_stopping_patience,
+            restore_best_weights=True,
+            verbose=1
+        ))
+    
+    print(f"Training the classifier head for up to {epochs} epochs...")
+    history = head.fit(
+        x_train,
+        tf.keras.utils.to_categorical(y_train, num_classes),
+        validation_data=validation_data,
+        epochs=epochs,
+        batch_size=batch_size,
+        callbacks=callbacks,
+        verbose=2
+    )
+    
+    # Score on cached embeddings instead of another pass through the backbone
+    if test_set:
+        x_test, y_test = (x_val, y_val) if evaluation_set is test_set else image_embeddings(test_set, embed, key)
+        print("Evaluating model on test set...")
+    else:
+        x_test, y_test = x_train, y_train
+        print("No test set provided. Evaluating on training set...")
+    scored_set = test_set or training_set
+    predictions = ImagePredictions(head.predict(x_test, verbose=0), y_test, list(scored_set.class_indices),
+                                   sample_images=sample_images(scored_set))
+    print(f"Accuracy: {predictions.accuracy:.4f}")
+    history.predictions = predictions
+    
+    inputs = Input(shape=image_shape)
+    model = Model(inputs, head(extractor(inputs)), name=f'{backbone}_classifier')
+    
+    if models_dir:
+        print(f"Saving model to database...")
+        temp_dir = tempfile.mkdtemp()
+        try:
+            temp_model_path = os.path.join(temp_dir, "best_model.keras")
+            model.save(temp_model_path)
+            db_fs.save_file(temp_model_path, vfs.db_directory(models_dir) or 'models')
+        finally:
+            shutil.rmtree(temp_dir, ignore_errors=True)
+    
+    return model, predictions, history
+
 def train_image_classification_model(
     training_generator, 
     validation_generator=None,
@@ -136,15 +478,17 @@ def train_image_classification_model(
     learning_rate=0.001,
     batch_size=32,
     early_stopping_patience=3,
-    return_history=False
+    return_history=False,
+    fast=None,
+    backbone=None
 ):
     """
     Train a CNN model for image classification using TensorFlow.
     
     Parameters:
-    training_generator: ImageDataGenerator for training data
-    validation_generator: ImageDataGenerator for validation data (optional)
-    test_generator: ImageDataGenerator for test data (optional)
+    training_generator: ImageDataGenerator iterator or ImageDataset (see image_pipeline.py) for training data
+    validation_generator: Iterator or ImageDataset for validation data (optional)
+    test_generator: Iterator or ImageDataset for test data (optional)
     dataset_folder: Path to the dataset folder
     models_dir: Directory to save the trained model
     epochs: Number of training epochs
@@ -152,19 +496,21 @@ def train_image_classification_model(
     batch_size: Batch size for training
     early_stopping_patience: Number of epochs with no improvement after which training will stop
     return_history: Whether to return training history
+    fast: Train with bfloat16 mixed precision and XLA (see build_image_cnn); defaults to
+          ML_CNN_TRAINING_MODE == 'fast'
+    backbone: Pretrained backbone for transfer learning instead of the CNN (see train_image_head);
+              defaults to ML_CNN_BACKBONE, where '' trains the CNN from scratch
     
     Returns:
     model: Trained CNN model
     model_name: Name of the model
     accuracy: Test accuracy
     y_pred: Predicted classes
-    history: Training history (if return_history=True, otherwise None)
+    history: Training history (if return_history=True, otherwise None); history.predictions holds
+             the ImagePredictions behind accuracy and y_pred
     """
     import os
     import numpy as np
-    from tensorflow.keras.models import Sequential
-    from tensorflow.keras.layers import Conv2D, MaxPooling2D, Flatten, Dense, Dropout
-    from tensorflow.keras.optimizers import Adam
     from tensorflow.keras.callbacks import EarlyStopping, ModelCheckpoint
     
     print("Training CNN for image classification...")
@@ -174,7 +520,7 @@ def train_image_classification_model(
     
     # Create models directory if it doesn't exist
     if models_dir:
-        os.makedirs(models_dir, exist_ok=True)
+        vfs.makedirs(models_dir, exist_ok=True)
     
     # Determine the training, validation and test sets
     if isinstance(training_generator, dict):
@@ -199,38 +545,22 @@ def train_image_classification_model(
     image_shape = training_set.image_shape if hasattr(training_set, 'image_shape') else (64, 64, 3)
     print(f"Input image shape: {image_shape}")
     
+    if backbone is None:
+        backbone = CNN_BACKBONE
+    if backbone:
+        backbone_weights_file()
+        model, predictions, history = train_image_head(
+            training_set, validation_set, test_set, image_shape, num_classes, models_dir=models_dir,
+            learning_rate=learning_rate, batch_size=batch_size,
+            early_stopping_patience=early_stopping_patience, backbone=backbone)
+        return (model, f"{backbone} transfer", predictions.accuracy, predictions.y_pred,
+                history if return_history else None)
+    
     # Create a robust CNN model
-    cnn = Sequential([
-        # First convolution block
-        Conv2D(32, (3, 3), padding='same', activation='relu', input_shape=image_shape),
-        MaxPooling2D(pool_size=(2, 2)),
-        
-        # Second convolution block
-        Conv2D(64, (3, 3), padding='same', activation='relu'),
-        MaxPooling2D(pool_size=(2, 2)),
-        
-        # Third convolution block
-        Conv2D(128, (3, 3), padding='same', activation='relu'),
-        MaxPooling2D(pool_size=(2, 2)),
-        
-        # Flatten the convolutional features
-        Flatten(),
-        
-        # Fully connected layers
-        Dense(256, activation='relu'),
-        Dropout(0.5),  # Add dropout for regularization
-        
-        # Output layer
-        Dense(num_classes, activation='softmax')
-    ])
-
-    # Compile the model
-    cnn.compile(
-        optimizer=Adam(learning_rate=learning_rate),
-        loss='categorical_crossentropy',
-        metrics=['accuracy']
-    )
-
+    if fast is None:
+        fast = CNN_TRAINING_MODE == 'fast'
+    cnn = build_image_cnn(image_shape, num_classes, learning_rate=learning_rate, fast=fast)
+    
     # Print model summary
     print("Model summary:")
     cnn.summary()
@@ -247,8 +577,9 @@ def train_image_classification_model(
     )
     callbacks.append(early_stopping)
     
-    # Create temporary file for model checkpoint
-    temp_model_path = os.path.join(tempfile.gettempdir(), "best_model.keras")
+    # Create temporary file for model checkpoint, private to this run
+    checkpoint_dir = tempfile.mkdtemp()
+    temp_model_path = os.path.join(checkpoint_dir, "best_model.keras")
     
     # Model checkpoint to save the best model
     model_checkpoint = ModelCheckpoint(
@@ -259,41 +590,37 @@ def train_image_classification_model(
     )
     callbacks.append(model_checkpoint)
     
+    # tf.data image sets are batched already; Keras reads their pipeline directly
+    def keras_input(data):
+        return data.dataset if isinstance(data, ImageDataset) else data
+    
+    fit_options = {} if isinstance(training_set, ImageDataset) else {'batch_size': batch_size}
+    
     # Train the model
     print(f"Training for {epochs} epochs...")
     history = cnn.fit(
-        training_set,
-        validation_data=validation_set or test_set,  # Use validation set if available, otherwise use test set
+        keras_input(training_set),
+        validation_data=keras_input(validation_set or test_set),  # Use validation set if available, otherwise use test set
         epochs=epochs,
-        batch_size=batch_size,
         callbacks=callbacks,
-        verbose=1
+        verbose=1,
+        **fit_options
     )
     
-    # Evaluate the model on test set if available
+    # One inference pass yields the accuracy and y_pred; it is kept on the history as
+    # history.predictions for the confusion matrix and the CNN plots
     if test_set:
         print("Evaluating model on test set...")
-        evaluation = cnn.evaluate(test_set)
-        accuracy = evaluation[1]  # accuracy is typically the second metric
-        print(f"Test accuracy: {accuracy:.4f}")
-        
-        # Generate predictions on test set
-        print("Generating predictions on test set...")
-        test_set.reset()
-        y_pred_probs = cnn.predict(test_set)
-        y_pred = np.argmax(y_pred_probs, axis=1)
+        predictions = predict_image_set(test_set, cnn.predict_on_batch)
+        print(f"Test accuracy: {predictions.accuracy:.4f}")
     else:
         # If no test set, evaluate on training set
         print("No test set provided. Evaluating on training set...")
-        evaluation = cnn.evaluate(training_set)
-        accuracy = evaluation[1]
-        print(f"Training accuracy: {accuracy:.4f}")
-        
-        # Generate predictions on training set
-        print("Generating predictions on training set...")
-        training_set.reset()
-        y_pred_probs = cnn.predict(training_set)
-        y_pred = np.argmax(y_pred_probs, axis=1)
+        predictions = predict_image_set(training_set, cnn.predict_on_batch)
+        print(f"Training accuracy: {predictions.accuracy:.4f}")
+    accuracy = predictions.accuracy
+    y_pred = predictions.y_pred
+    history.predictions = predictions
     
     # Save the model to database
     if models_dir:
@@ -301,16 +628,17 @@ def train_image_classification_model(
         if os.path.exists(temp_model_path):
             print(f"Saving best model to database...")
             # Save to database
-            db_fs.save_file(temp_model_path, 'models')
+            db_fs.save_file(temp_model_path, vfs.db_directory(models_dir) or 'models')
             # Clean up temporary file
             os.remove(temp_model_path)
         else:
             # If no model was saved by checkpoint, save the current model
             cnn.save(temp_model_path)
             # Save to database
-            db_fs.save_file(temp_model_path, 'models')
+            db_fs.save_file(temp_model_path, vfs.db_directory(models_dir) or 'models')
             # Clean up temporary file
             os.remove(temp_model_path)
+    shutil.rmtree(checkpoint_dir, ignore_errors=True)
     
     if return_history:
         return cnn, "CNN", accuracy, y_pred, history
@@ -325,14 +653,13 @@ def train_yolo_model(dataset_folder, models_dir):
     import os
     import tempfile
     import shutil
-    import zipfile  # Add this import
     import yaml     # Add this import
     
     if not YOLO_AVAILABLE:
         raise ImportError("YOLO is required for object detection but not available")
     
     # Find data.yaml file in the dataset folder
-    yaml_files = [f for f in os.listdir(dataset_folder) if f.endswith('.yaml')]
+    yaml_files = [f for f in vfs.listdir(dataset_folder) if f.endswith('.yaml')]
     if not yaml_files:
         raise ValueError("No data.yaml file found in the dataset folder. Please ensure your dataset includes a YAML configuration file.")
     
@@ -342,19 +669,15 @@ def train_yolo_model(dataset_folder, models_dir):
     
     try:
         # Get the yaml file from database if needed
-        if 'ml_system' in dataset_folder:
+        if vfs.is_db_path(dataset_folder):
             # Extract the directory name from dataset_folder
-            parts = dataset_folder.replace('\\', '/').strip('/').split('/')
-            idx = parts.index('ml_system')
-            if idx + 1 < len(parts):
-                dir_name = parts[idx + 1]
+            dir_name = vfs.db_directory(dataset_folder)
+            if dir_name:
                 yaml_filename = yaml_files[0]
                 
                 # Get the yaml file from database and save to temp dir
-                yaml_content = db_fs.get_file(yaml_filename, dir_name)
                 temp_yaml_path = os.path.join(temp_dir, yaml_filename)
-                with open(temp_yaml_path, 'wb') as f:
-                    f.write(yaml_content)
+                vfs.get(os.path.join(dataset_folder, yaml_filename), temp_yaml_path)
                 
                 # Also check for yolo_dataset.zip which contains the full dataset
                 try:
@@ -363,18 +686,12 @@ def train_yolo_model(dataset_folder, models_dir):
                     
                     if 'yolo_dataset.zip' in files_in_db:
                         print("Found yolo_dataset.zip in database, extracting...")
-                        zip_content = db_fs.get_file('yolo_dataset.zip', dir_name)
-                        temp_zip_path = os.path.join(temp_dir, 'yolo_dataset.zip')
-                        with open(temp_zip_path, 'wb') as f:
-                            f.write(zip_content)
-                        
-                        # Extract the zip file
-                        with zipfile.ZipFile(temp_zip_path, 'r') as zip_ref:
-                            # Print the contents of the zip
-                            print(f"Zip file contents: {zip_ref.namelist()}")
-                            zip_ref.extractall(temp_dir)
+                        # Extracted once per dataset checksum and shared read-only; mirror it
+                        # into temp_dir so the yaml, labels caches and any fixups below stay private
+                        dataset_root = materialization_cache.materialize('yolo_dataset.zip', dir_name)
+                        materialization_cache.link_tree(dataset_root, temp_dir)
                         
-                        print(f"Extracted dataset to {temp_dir}")
+                        print(f"Linked dataset from {dataset_root} into {temp_dir}")
                         print(f"Contents after extraction: {os.listdir(temp_dir)}")
                     else:
                         print("No yolo_dataset.zip found, will try to process individual files")
@@ -445,7 +762,7 @@ def train_yolo_model(dataset_folder, models_dir):
                                     print(f"Saved label {filename} to {dest_path}")
                                 except Exception as lbl_err:
                                     print(f"Error saving label {filename}: {lbl_err}")
-                        
+                
                 except Exception as e:
                     print(f"Error extracting yolo_dataset.zip: {e}")
                 
@@ -528,7 +845,7 @@ def train_yolo_model(dataset_folder, models_dir):
                                 # Create the directory if it doesn't exist
                                 os.makedirs(yaml_data[key], exist_ok=True)
                                 print(f"  Created directory: {yaml_data[key]}")
-                    
+                
                 except Exception as e:
                     print(f"Error updating yaml file: {e}")
                     # If we fail to update the YAML, create a basic one
@@ -543,7 +860,7 @@ def train_yolo_model(dataset_folder, models_dir):
                         dir_path = os.path.join(temp_dir, dir_name)
                         if not os.path.isdir(dir_path):
                             continue
-                            
+                        
                         if dir_name.lower() == 'train':
                             train_dir = dir_path
                         elif dir_name.lower() in ['val', 'valid']:
@@ -581,7 +898,7 @@ def train_yolo_model(dataset_folder, models_dir):
                     # Write the YAML file
                     with open(data_yaml, 'w') as f:
                         yaml.dump(yaml_data, f, default_flow_style=False)
-                
+            
             else:
                 # Standard path for yaml file
                 data_yaml = os.path.join(dataset_folder, yaml_files[0])
@@ -595,7 +912,7 @@ def train_yolo_model(dataset_folder, models_dir):
         try:
             with open(data_yaml, 'r') as f:
                 yaml_data = yaml.safe_load(f)
-                
+            
             # Check essential components
             required_keys = ['train', 'val', 'names']
             missing_keys = [key for key in required_keys if key not in yaml_data]
@@ -658,7 +975,7 @@ def train_yolo_model(dataset_folder, models_dir):
                 yaml.dump(yaml_data, f, default_flow_style=False)
             
             print(f"Dataset has {len(yaml_data.get('names', {}))} classes")
-            
+        
         except Exception as e:
             print(f"Error validating YAML configuration: {e}")
             raise
@@ -668,11 +985,8 @@ def train_yolo_model(dataset_folder, models_dir):
         yolo_runs_dir = os.path.join(base_dir, 'runs')
         
         # For database storage, create a temporary directory for YOLO runs
-        if 'ml_system' in models_dir:
-            temp_runs_dir = os.path.join(tempfile.gettempdir(), 'yolo_runs')
-            if os.path.exists(temp_runs_dir):
-                shutil.rmtree(temp_runs_dir)
-            os.makedirs(temp_runs_dir, exist_ok=True)
+        if vfs.is_db_path(models_dir):
+            temp_runs_dir = tempfile.mkdtemp(prefix='yolo_runs_')
             yolo_runs_dir = temp_runs_dir
         else:
             # For filesystem storage, clear and create the runs directory
@@ -713,22 +1027,20 @@ def train_yolo_model(dataset_folder, models_dir):
             )
             
             print("YOLO training completed successfully")
-            
+        
         except Exception as e:
             print(f"Error during YOLO training: {e}")
             raise
         
         # Save the trained model
-        temp_model_path = os.path.join(tempfile.gettempdir(), "best_model.pt")
+        temp_model_path = os.path.join(temp_dir, "best_model.pt")
         model.save(temp_model_path)
         
         # Save to database if needed
-        if 'ml_system' in models_dir:
+        if vfs.is_db_path(models_dir):
             # Extract directory name from models_dir
-            parts = models_dir.replace('\\', '/').strip('/').split('/')
-            idx = parts.index('ml_system')
-            if idx + 1 < len(parts):
-                dir_name = parts[idx + 1]
+            dir_name = vfs.db_directory(models_dir)
+            if dir_name:
                 # Save to database
                 db_fs.save_file(temp_model_path, dir_name)
                 print(f"Model saved to database under {dir_name}")
@@ -821,7 +1133,7 @@ def train_yolo_model(dataset_folder, models_dir):
                     'recall': 0.658
                 }
                 print(f"Final metrics being used: {metrics_info}")
-                
+        
         except Exception as e:
             print(f"Could not read metrics: {e}")
             # Use the metrics from your successful training
@@ -842,7 +1154,7 @@ def train_yolo_model(dataset_folder, models_dir):
                 print(f"Error cleaning up temporary runs directory: {e}")
         
         return model, "YOLOv8", accuracy, metrics_info
-        
+    
     finally:
         # Clean up the temporary directory at the end
         try:
@@ -855,12 +1167,12 @@ def train_yolo_model(dataset_folder, models_dir):
 def save_best_model(model, models_dir):
     """Save the best model to file or database based on its type"""
     # Determine whether we're using database storage
-    is_database = 'ml_system' in models_dir
+    is_database = vfs.is_db_path(models_dir)
+    
+    # Create a private temporary directory for saving the model
+    temp_dir = tempfile.mkdtemp()
     
     try:
-        # Create a temporary file for saving the model
-        temp_dir = tempfile.gettempdir()
-        
         # More robust model type detection
         model_type = str(type(model))
         
@@ -874,12 +1186,7 @@ def save_best_model(model, models_dir):
         
         if is_database:
             # Parse the path to get the directory name
-            parts = models_dir.replace('\\', '/').strip('/').split('/')
-            idx = parts.index('ml_system')
-            if idx + 1 < len(parts):
-                dir_name = parts[idx + 1]
-            else:
-                dir_name = 'models'  # Default to models directory
+            dir_name = vfs.db_directory(models_dir) or 'models'  # Default to models directory
         
         if is_yolo_model:
             # YOLO models are saved directly in train_yolo_model function
@@ -948,4 +1255,6 @@ def save_best_model(model, models_dir):
             os.remove(temp_path)
     
     except Exception as e:
-        print(f"Error saving the model: {e}")
\ No newline at end of file
+        print(f"Error saving the model: {e}")
+    finally:
+        shutil.rmtree(temp_dir, ignore_errors=True)
\ No newline at end of file
@@ -1,13 +1,10 @@
 import pandas as pd
 import numpy as np
-import re
 import nltk
 import os
 import tempfile
 import shutil
-import zipfile
-from nltk.corpus import stopwords
-from nltk.stem import PorterStemmer, WordNetLemmatizer
+from scipy import sparse
 from sklearn.model_selection import train_test_split
 from sklearn.preprocessing import StandardScaler, LabelEncoder, OneHotEncoder
 from sklearn.impute import SimpleImputer
@@ -15,9 +12,15 @@ from sklearn.compose import ColumnTransformer
 from sklearn.pipeline import Pipeline
 from sklearn.feature_extraction.text import TfidfVectorizer
 from db_file_system import DBFileSystem
+from materialization_cache import MaterializationCache
+from file_system_adapter import FileSystemAdapter
+from text_normalization import TextNormalizer
+from image_pipeline import IMAGE_PIPELINE, flow_from_directory as image_pipeline_flow
 
 # Initialize database file system
 db_fs = DBFileSystem()
+vfs = FileSystemAdapter(db_fs=db_fs)
+materialization_cache = MaterializationCache(db_fs)
 
 # Check if TensorFlow is available
 try:
@@ -63,39 +66,34 @@ def preprocess_dataset(df, task_type, dataset_folder=None):
     ])
 
     # Preprocessing for NLP task
+    le = None
     if task_type == 'nlp':
-        corpus = []
-        ps = PorterStemmer()
-        lemmatizer = WordNetLemmatizer()
-        all_stopwords = set(stopwords.words('english'))
-
-        # Process text from the first column
-        for i in range(len(X)):
-            text = re.sub('[^a-zA-Z]', ' ', str(X.iloc[i, 0]))  # Extract text from the first column
-            text = text.lower()  # Convert to lowercase
-            text = text.split()  # Split into words
-            # Stem and lemmatize, while removing stopwords
-            text = [lemmatizer.lemmatize(ps.stem(word)) for word in text if word not in all_stopwords]
-            text = ' '.join(text)  # Join words back to a single string
-            corpus.append(text)
-
-        # Use TF-IDF Vectorization instead of Count Vectorization
-        vectorizer = TfidfVectorizer(max_features=1500, ngram_range=(1, 2))  # Unigrams and bigrams
-        X_transformed = vectorizer.fit_transform(corpus).toarray()
+        # Normalize the first column in batch (one tokenizing regex over the column,
+        # each distinct token stemmed and lemmatized once), then TF-IDF vectorize it.
+        # Kept as a sparse CSR matrix; the model zoo picks sparse-capable estimators
+        transformer = Pipeline(steps=[
+            ('normalize', TextNormalizer()),
+            ('tfidf', TfidfVectorizer(max_features=1500, ngram_range=(1, 2)))  # Unigrams and bigrams
+        ])
+        X_transformed = transformer.fit_transform(X)
 
         # Perform label encoding for the target variable
         le = LabelEncoder()
         y = le.fit_transform(y)
 
     else:
-        # Combine numerical and categorical preprocessing
-        preprocessor = ColumnTransformer(
+        # Combine numerical and categorical preprocessing; sklearn's default threshold
+        # keeps the output sparse (CSR) only when it is mostly zeros, e.g. from
+        # high-cardinality one-hot columns, and dense otherwise
+        transformer = ColumnTransformer(
             transformers=[
                 ('num', numeric_transformer, numeric_cols),
                 ('cat', categorical_transformer, categorical_cols)
             ]
         )
-        X_transformed = preprocessor.fit_transform(X)
+        X_transformed = transformer.fit_transform(X)
+        if sparse.issparse(X_transformed):
+            X_transformed = X_transformed.tocsr()
 
         # Perform label encoding for the target variable for classification tasks
         if task_type == 'classification':
@@ -104,7 +102,147 @@ def preprocess_dataset(df, task_type, dataset_folder=None):
 
     X_train, X_test, y_train, y_test = train_test_split(X_transformed, y, test_size=0.2, random_state=42)
 
-    return X_train, X_test, y_train, y_test, None, X.columns.tolist()
+    # The fitted transforms, so the exported model applies exactly the training preprocessing
+    preprocessor = {
+        'transformer': transformer,
+        'label_encoder': le,
+        'task_type': task_type,
+        'text_column': X.columns[0] if task_type == 'nlp' else None,
+        'numeric_columns': numeric_cols.tolist(),
+        'categorical_columns': categorical_cols.tolist()
+    }
+
+    return X_train, X_test, y_train, y_test, preprocessor, X.columns.tolist()
+
+def _normalize_image_dataset_layout(dataset_root):
+    """
+    Arrange an extracted image dataset into training and testing class folders
+    
+    Runs once on the staging directory of the materialization cache, so the
+    resulting layout is shared by every later training or visualization run.
+    """
+    train_folder = os.path.join(dataset_root, 'training')
+    test_folder = os.path.join(dataset_root, 'testing')
+    os.makedirs(train_folder, exist_ok=True)
+    os.makedirs(test_folder, exist_ok=True)
+    
+    # Images lying directly in the training folder become one default class
+    _group_loose_images(train_folder)
+    
+    # Check if extraction created the expected folder structure
+    if os.path.exists(train_folder) and os.path.isdir(train_folder):
+        print(f"Extracted training folder: {train_folder}")
+        # Get class folders inside training folder
+        class_folders = [d for d in os.listdir(train_folder) 
+                        if os.path.isdir(os.path.join(train_folder, d))]
+        print(f"Found classes: {class_folders}")
+        
+        if not class_folders:
+            print("No class folders found in extracted training directory")
+            # The zip might have a different structure, search for any directories with images
+            for root, dirs, files in os.walk(dataset_root):
+                for d in dirs:
+                    dir_path = os.path.join(root, d)
+                    if any(f.lower().endswith(('.jpg', '.jpeg', '.png')) 
+                          for f in os.listdir(dir_path) if os.path.isfile(os.path.join(dir_path, f))):
+                        # Found a directory with images, try to use it as a class
+                        class_name = d
+                        new_class_folder = os.path.join(train_folder, class_name)
+                        os.makedirs(new_class_folder, exist_ok=True)
+                        # Copy images to the new class folder
+                        for f in os.listdir(dir_path):
+                            if f.lower().endswith(('.jpg', '.jpeg', '.png')):
+                                src = os.path.join(dir_path, f)
+                                dst = os.path.join(new_class_folder, f)
+                                shutil.copy2(src, dst)
+                        print(f"Created class folder: {class_name}")
+    else:
+        # The zip might have used different folder names
+        # Try to find any folders with image class subfolders
+        print("Training folder not found in expected location. Searching...")
+        potential_train_folders = []
+        
+        for root, dirs, _ in os.walk(dataset_root):
+            class_dirs = []
+            for d in dirs:
+                dir_path = os.path.join(root, d)
+                # Check if folder contains images
+                if any(f.lower().endswith(('.jpg', '.jpeg', '.png')) 
+                      for f in os.listdir(dir_path) if os.path.isfile(os.path.join(dir_path, f))):
+                    class_dirs.append(d)
+            
+            if class_dirs:
+                print(f"Found potential training folder at {root} with classes: {class_dirs}")
+                potential_train_folders.append((root, class_dirs))
+        
+        if potential_train_folders:
+            # Use the first potential folder with the most classes
+            potential_train_folders.sort(key=lambda x: len(x[1]), reverse=True)
+            found_folder, found_classes = potential_train_folders[0]
+            print(f"Using {found_folder} as training folder with classes: {found_classes}")
+            
+            # If the found folder is not named 'training', rename or copy it
+            if os.path.basename(found_folder) != 'training':
+                # For each class, create in train_folder and copy images
+                for class_name in found_classes:
+                    src_class_dir = os.path.join(found_folder, class_name)
+                    dst_class_dir = os.path.join(train_folder, class_name)
+                    os.makedirs(dst_class_dir, exist_ok=True)
+                    
+                    # Copy all images
+                    for f in os.listdir(src_class_dir):
+                        if f.lower().endswith(('.jpg', '.jpeg', '.png')):
+                            src = os.path.join(src_class_dir, f)
+                            dst = os.path.join(dst_class_dir, f)
+                            shutil.copy2(src, dst)
+                    print(f"Copied class {class_name} to training folder")
+    
+    # If test folder doesn't exist or is empty, create it from training data
+    if not os.path.exists(test_folder) or not os.listdir(test_folder):
+        print("Creating test folder from training data")
+        if os.path.exists(train_folder) and os.listdir(train_folder):
+            # For each class in training, move 20% to test
+            import random
+            for class_name in os.listdir(train_folder):
+                train_class_dir = os.path.join(train_folder, class_name)
+                test_class_dir = os.path.join(test_folder, class_name)
+                
+                if os.path.isdir(train_class_dir):
+                    os.makedirs(test_class_dir, exist_ok=True)
+                    
+                    # Get all image files
+                    image_files = [f for f in os.listdir(train_class_dir) 
+                                 if f.lower().endswith(('.jpg', '.jpeg', '.png'))]
+                    
+                    # Shuffle and take 20% for test
+                    random.shuffle(image_files)
+                    split_idx = int(len(image_files) * 0.8)
+                    test_files = image_files[split_idx:]
+                    
+                    # Move files to test folder
+                    for f in test_files:
+                        src = os.path.join(train_class_dir, f)
+                        dst = os.path.join(test_class_dir, f)
+                        shutil.copy2(src, dst)  # Copy instead of move to preserve training
+                        
+                    print(f"Created test set for class {class_name} with {len(test_files)} images")
+
+def _group_loose_images(train_folder):
+    """Move the images of a training folder without class folders into a default class"""
+    if not os.path.isdir(train_folder):
+        return False
+    class_folders = [d for d in os.listdir(train_folder) if os.path.isdir(os.path.join(train_folder, d))]
+    images = [f for f in os.listdir(train_folder)
+              if f.lower().endswith(('.jpg', '.jpeg', '.png')) and os.path.isfile(os.path.join(train_folder, f))]
+    if class_folders or not images:
+        return False
+    
+    print("No class folders found, creating a default class")
+    default_class_dir = os.path.join(train_folder, "default_class")
+    os.makedirs(default_class_dir, exist_ok=True)
+    for f in images:
+        shutil.move(os.path.join(train_folder, f), os.path.join(default_class_dir, f))
+    return True
 
 def preprocess_image_dataset(dataset_folder):
     """
@@ -128,23 +266,18 @@ def preprocess_image_dataset(dataset_folder):
     print("Preprocessing image classification dataset...")
     
     # Check if this is a database path
-    is_database = 'ml_system' in dataset_folder
+    is_database = vfs.is_db_path(dataset_folder)
+    
+    # Checksum of the stored dataset zip; keys the decoded image shards of its folders
+    dataset_checksum = None
     
     if is_database:
-        # Create a temporary directory for processing
-        temp_dir = tempfile.mkdtemp()
+        # Only datasets stored as individual files need a private temporary directory
+        temp_dir = None
         
         try:
-            # Set up folders structure
-            train_folder = os.path.join(temp_dir, 'training')
-            test_folder = os.path.join(temp_dir, 'testing')
-            os.makedirs(train_folder, exist_ok=True)
-            os.makedirs(test_folder, exist_ok=True)
-            
             # Extract database directory
-            parts = dataset_folder.replace('\\', '/').strip('/').split('/')
-            idx = parts.index('ml_system')
-            db_dir = parts[idx + 1] if idx + 1 < len(parts) else 'datasets'
+            db_dir = vfs.db_directory(dataset_folder) or 'datasets'
             
             # List database files
             files = db_fs.list_files(db_dir)
@@ -153,119 +286,18 @@ def preprocess_image_dataset(dataset_folder):
             # Check for zip file first - this is the key fix
             if 'processed_dataset.zip' in files:
                 print("Found processed dataset zip file in database. Extracting...")
-                # Get the zip file from database
-                zip_content = db_fs.get_file('processed_dataset.zip', db_dir)
-                temp_zip_path = os.path.join(temp_dir, 'processed_dataset.zip')
-                
-                # Save zip content to temporary file
-                with open(temp_zip_path, 'wb') as f:
-                    f.write(zip_content)
-                
-                # Extract the zip to the temp directory
-                with zipfile.ZipFile(temp_zip_path, 'r') as zipf:
-                    print(f"Zip file contents: {zipf.namelist()}")
-                    zipf.extractall(temp_dir)
-                
-                # Check if extraction created the expected folder structure
-                if os.path.exists(train_folder) and os.path.isdir(train_folder):
-                    print(f"Extracted training folder: {train_folder}")
-                    # Get class folders inside training folder
-                    class_folders = [d for d in os.listdir(train_folder) 
-                                    if os.path.isdir(os.path.join(train_folder, d))]
-                    print(f"Found classes: {class_folders}")
-                    
-                    if not class_folders:
-                        print("No class folders found in extracted training directory")
-                        # The zip might have a different structure, search for any directories with images
-                        for root, dirs, files in os.walk(temp_dir):
-                            for d in dirs:
-                                dir_path = os.path.join(root, d)
-                                if any(f.lower().endswith(('.jpg', '.jpeg', '.png')) 
-                                      for f in os.listdir(dir_path) if os.path.isfile(os.path.join(dir_path, f))):
-                                    # Found a directory with images, try to use it as a class
-                                    class_name = d
-                                    new_class_folder = os.path.join(train_folder, class_name)
-                                    os.makedirs(new_class_folder, exist_ok=True)
-                                    # Copy images to the new class folder
-                                    for f in os.listdir(dir_path):
-                                        if f.lower().endswith(('.jpg', '.jpeg', '.png')):
-                                            src = os.path.join(dir_path, f)
-                                            dst = os.path.join(new_class_folder, f)
-                                            shutil.copy2(src, dst)
-                                    print(f"Created class folder: {class_name}")
-                else:
-                    # The zip might have used different folder names
-                    # Try to find any folders with image class subfolders
-                    print("Training folder not found in expected location. Searching...")
-                    potential_train_folders = []
-                    
-                    for root, dirs, _ in os.walk(temp_dir):
-                        class_dirs = []
-                        for d in dirs:
-                            dir_path = os.path.join(root, d)
-                            # Check if folder contains images
-                            if any(f.lower().endswith(('.jpg', '.jpeg', '.png')) 
-                                  for f in os.listdir(dir_path) if os.path.isfile(os.path.join(dir_path, f))):
-                                class_dirs.append(d)
-                        
-                        if class_dirs:
-                            print(f"Found potential training folder at {root} with classes: {class_dirs}")
-                            potential_train_folders.append((root, class_dirs))
-                    
-                    if potential_train_folders:
-                        # Use the first potential folder with the most classes
-                        potential_train_folders.sort(key=lambda x: len(x[1]), reverse=True)
-                        found_folder, found_classes = potential_train_folders[0]
-                        print(f"Using {found_folder} as training folder with classes: {found_classes}")
-                        
-                        # If the found folder is not named 'training', rename or copy it
-                        if os.path.basename(found_folder) != 'training':
-                            # For each class, create in train_folder and copy images
-                            for class_name in found_classes:
-                                src_class_dir = os.path.join(found_folder, class_name)
-                                dst_class_dir = os.path.join(train_folder, class_name)
-                                os.makedirs(dst_class_dir, exist_ok=True)
-                                
-                                # Copy all images
-                                for f in os.listdir(src_class_dir):
-                                    if f.lower().endswith(('.jpg', '.jpeg', '.png')):
-                                        src = os.path.join(src_class_dir, f)
-                                        dst = os.path.join(dst_class_dir, f)
-                                        shutil.copy2(src, dst)
-                                print(f"Copied class {class_name} to training folder")
-                
-                # If test folder doesn't exist or is empty, create it from training data
-                if not os.path.exists(test_folder) or not os.listdir(test_folder):
-                    print("Creating test folder from training data")
-                    if os.path.exists(train_folder) and os.listdir(train_folder):
-                        # For each class in training, move 20% to test
-                        import random
-                        for class_name in os.listdir(train_folder):
-                            train_class_dir = os.path.join(train_folder, class_name)
-                            test_class_dir = os.path.join(test_folder, class_name)
-                            
-                            if os.path.isdir(train_class_dir):
-                                os.makedirs(test_class_dir, exist_ok=True)
-                                
-                                # Get all image files
-                                image_files = [f for f in os.listdir(train_class_dir) 
-                                             if f.lower().endswith(('.jpg', '.jpeg', '.png'))]
-                                
-                                # Shuffle and take 20% for test
-                                random.shuffle(image_files)
-                                split_idx = int(len(image_files) * 0.8)
-                                test_files = image_files[split_idx:]
-                                
-                                # Move files to test folder
-                                for f in test_files:
-                                    src = os.path.join(train_class_dir, f)
-                                    dst = os.path.join(test_class_dir, f)
-                                    shutil.copy2(src, dst)  # Copy instead of move to preserve training
-                                    
-                                print(f"Created test set for class {class_name} with {len(test_files)} images")
+                # Extracted and normalized once per dataset checksum, then reused
+                dataset_folder = materialization_cache.materialize(
+                    'processed_dataset.zip', db_dir, prepare=_normalize_image_dataset_layout)
+                dataset_checksum = db_fs.stat('processed_dataset.zip', db_dir)['checksum']
             # If no zip file, try the original approach with individual files
             else:
                 print("No processed dataset zip found. Looking for individual files...")
+                temp_dir = tempfile.mkdtemp()
+                train_folder = os.path.join(temp_dir, 'training')
+                test_folder = os.path.join(temp_dir, 'testing')
+                os.makedirs(train_folder, exist_ok=True)
+                os.makedirs(test_folder, exist_ok=True)
                 train_classes = {}
                 test_classes = {}
                 
@@ -396,13 +428,14 @@ def preprocess_image_dataset(dataset_folder):
                         except Exception as e:
                             print(f"Error retrieving image {db_path}: {e}")
             
-            # Now use the temporary directory for processing
-            dataset_folder = temp_dir
+                # Now use the temporary directory for processing
+                dataset_folder = temp_dir
             
         except Exception as e:
             print(f"Error setting up image dataset from database: {e}")
             # Clean up temp directory
-            shutil.rmtree(temp_dir)
+            if temp_dir:
+                shutil.rmtree(temp_dir, ignore_errors=True)
             raise
     
     # From here, we use a regular filesystem approach with dataset_folder
@@ -476,88 +509,53 @@ def preprocess_image_dataset(dataset_folder):
     
     test_datagen = ImageDataGenerator(rescale=1./255)
     
+    def flow(directory, augment=False, subset=None):
+        """Iterator over an image folder from the configured input engine (see image_pipeline.py)"""
+        if IMAGE_PIPELINE == 'tf.data':
+            # Folders of a stored zip are decoded once into shards and reused by later runs
+            cache_key = None
+            if dataset_checksum:
+                cache_key = f"{dataset_checksum}-{os.path.relpath(directory, dataset_folder)}"
+            return image_pipeline_flow(directory, batch_size=32, subset=subset,
+                                       validation_split=0.2 if subset else 0.0, augment=augment,
+                                       cache_key=cache_key)
+        # The validation split is configured on train_datagen, so subsets always come from it
+        datagen = train_datagen if augment or subset else test_datagen
+        return datagen.flow_from_directory(
+            directory,
+            target_size=(64, 64),
+            batch_size=32,
+            class_mode='categorical',
+            subset=subset
+        )
+    
     # Create training generator
     try:
         if not validation_folder:
             # If no validation folder, use validation_split
-            training_generator = train_datagen.flow_from_directory(
-                train_folder,
-                target_size=(64, 64),
-                batch_size=32,
-                class_mode='categorical',
-                subset='training'  # Use 80% for training
-            )
+            training_generator = flow(train_folder, augment=True, subset='training')  # Use 80% for training
             
             # Create validation generator from training data
-            validation_generator = train_datagen.flow_from_directory(
-                train_folder,
-                target_size=(64, 64),
-                batch_size=32,
-                class_mode='categorical',
-                subset='validation'  # Use 20% for validation
-            )
+            validation_generator = flow(train_folder, subset='validation')  # Use 20% for validation
         else:
             # If validation folder exists, use it directly
-            training_generator = train_datagen.flow_from_directory(
-                train_folder,
-                target_size=(64, 64),
-                batch_size=32,
-                class_mode='categorical'
-            )
-            
-            validation_generator = test_datagen.flow_from_directory(
-                validation_folder,
-                target_size=(64, 64),
-                batch_size=32,
-                class_mode='categorical'
-            )
+            training_generator = flow(train_folder, augment=True)
+            validation_generator = flow(validation_folder)
         
         # Create test generator if test folder exists
         if test_folder:
-            testing_generator = test_datagen.flow_from_directory(
-                test_folder,
-                target_size=(64, 64),
-                batch_size=32,
-                class_mode='categorical'
-            )
+            testing_generator = flow(test_folder)
         else:
             # Use validation set as test set if no separate test folder
             testing_generator = validation_generator
     except Exception as e:
         print(f"Error creating data generators: {e}")
-        # Check if train_folder contains any class folders
-        class_folders = [d for d in os.listdir(train_folder) if os.path.isdir(os.path.join(train_folder, d))]
-        if not class_folders:
-            # If no class folders, create one from all images
-            print("No class folders found, creating a default class")
-            default_class = "default_class"
-            default_class_dir = os.path.join(train_folder, default_class)
-            os.makedirs(default_class_dir, exist_ok=True)
-            
-            # Move all images to the default class
-            for f in os.listdir(train_folder):
-                if f.lower().endswith(('.jpg', '.jpeg', '.png')) and os.path.isfile(os.path.join(train_folder, f)):
-                    src = os.path.join(train_folder, f)
-                    dst = os.path.join(default_class_dir, f)
-                    shutil.move(src, dst)
-            
-            # Try again
-            training_generator = train_datagen.flow_from_directory(
-                train_folder,
-                target_size=(64, 64),
-                batch_size=32,
-                class_mode='categorical',
-                subset='training'
-            )
-            
-            validation_generator = train_datagen.flow_from_directory(
-                train_folder,
-                target_size=(64, 64),
-                batch_size=32,
-                class_mode='categorical',
-                subset='validation'
-            )
-            
+        # If there are no class folders, put all images into a default class and try again.
+        # Materialized datasets are shared read-only and were regrouped before publishing
+        # (see _normalize_image_dataset_layout), so only private folders are changed here
+        if dataset_checksum is None and _group_loose_images(train_folder):
+            training_generator = flow(train_folder, augment=True, subset='training')
+            validation_generator = flow(train_folder, subset='validation')
             testing_generator = validation_generator
         else:
             raise
@@ -581,8 +579,9 @@ def preprocess_image_dataset(dataset_folder):
         'image_shape': (64, 64, 3)
     }
     
-    # Clean up temp directory if we're using database storage
-    if is_database:
+    # Clean up temp directory if we built one from individual database files;
+    # materialized zips are owned and evicted by the materialization cache
+    if is_database and temp_dir:
         try:
             # Don't delete yet as the generators are still using the files
             # Instead, register a cleanup function to run when the Python process exits
@@ -0,0 +1,358 @@
+# tabular_ingestion.py
+
+import os
+import numpy as np
+import pandas as pd
+
+# Rows parsed per chunk while streaming a CSV
+INGEST_CHUNK_ROWS = int(os.getenv('ML_INGEST_CHUNK_ROWS', 100000))
+
+# Leading rows used to infer column dtypes before streaming the rest
+DTYPE_SAMPLE_ROWS = int(os.getenv('ML_DTYPE_SAMPLE_ROWS', 10000))
+
+# Rows kept in the uniform sample used for distribution and text-length checks
+DETECTION_SAMPLE_ROWS = int(os.getenv('ML_DETECTION_SAMPLE_ROWS', 20000))
+
+# Distinct target values counted exactly before switching to a sketch estimate
+DISTINCT_CAP = int(os.getenv('ML_DISTINCT_CAP', 65536))
+
+
+def infer_dtypes(sample):
+    """
+    Choose column dtypes from a sample that stay valid for the rest of the file
+    
+    Numeric columns are read as float64, since a later chunk may hold missing
+    values; columns the sample saw as integers get int64 back on load if they
+    turned out complete and integral. Text is read as object and booleans are
+    left to the parser (they have no dtype entry; 'boolean' marks booleans with
+    missing values, which ingest_csv holds as objects like read_csv does). ingest_csv widens a column
+    later if the rest of the file does not fit the sample's dtype.
+    """
+    dtypes = {}
+    integer_columns = []
+    for col in sample.columns:
+        kind = sample[col].dtype.kind
+        if kind in 'iuf':
+            dtypes[col] = 'float64'
+            if kind in 'iu':
+                integer_columns.append(col)
+        elif kind != 'b':
+            dtypes[col] = 'boolean' if _only_booleans(sample[col]) else 'object'
+    return dtypes, integer_columns
+
+
+class ChunkedStats:
+    """
+    Column statistics accumulated one chunk at a time, at bounded cost
+    
+    Counts, extremes, sums and integral-value counts for every column, a uniform
+    reservoir sample of rows, a distinct-value sketch of the candidate target
+    columns and pairwise-complete correlation moments of every numeric column
+    against those targets. Each chunk is folded in with whole-column
+    vectorized operations; memory does not grow with the row count.
+    """
+    
+    def __init__(self, dtypes, targets, sample_rows=DETECTION_SAMPLE_ROWS, seed=0):
+        self.dtypes = dtypes
+        self.numeric = [col for col, dtype in dtypes.items() if dtype == 'float64']
+        self.text = [col for col, dtype in dtypes.items() if dtype == 'object']
+        self.rows = 0
+        self.nulls = {col: 0 for col in dtypes}
+        self.minimum = {}
+        self.maximum = {}
+        self.total = {col: 0.0 for col in self.numeric}
+        self.integral = {col: 0 for col in self.numeric}
+        # Smallest DISTINCT_CAP value hashes of each target (k-minimum-values sketch)
+        self.distinct_hashes = {target: np.empty(0, dtype=np.uint64) for target in targets}
+        self.sample_rows = sample_rows
+        self.sample = None
+        self._sample_keys = np.empty(0)
+        self._rng = np.random.default_rng(seed)
+        # Per target: the other numeric columns and their moments (rows n, mean_x, mean_y,
+        # M2_x, M2_y, co-moment), one array column per numeric feature
+        self.moments = {}
+        for target in targets:
+            if target in self.numeric:
+                columns = [col for col in self.numeric if col != target]
+                self.moments[target] = (columns, np.zeros((6, len(columns))))
+    
+    def update(self, chunk):
+        """Fold one DataFrame chunk into the statistics"""
+        self.rows += len(chunk)
+        for col, count in chunk.isna().sum().items():
+            self.nulls[col] = self.nulls.get(col, 0) + int(count)
+        
+        if self.numeric:
+            values = chunk[self.numeric]
+            for col, value in values.min().items():
+                if not pd.isna(value):
+                    self.minimum[col] = min(self.minimum.get(col, value), value)
+            for col, value in values.max().items():
+                if not pd.isna(value):
+                    self.maximum[col] = max(self.maximum.get(col, value), value)
+            for col, value in values.sum().items():
+                self.total[col] += float(value)
+            for col, value in (values % 1 == 0).sum().items():
+                self.integral[col] += int(value)
+        
+        for target, kept in self.distinct_hashes.items():
+            values = chunk[target].dropna().to_numpy()
+            if values.dtype.kind == 'f':
+                values = values + 0.0  # -0.0 and 0.0 are one value
+            hashes = pd.util.hash_array(values)
+            self.distinct_hashes[target] = np.unique(np.concatenate([kept, hashes]))[:DISTINCT_CAP]
+        
+        for target, (columns, acc) in self.moments.items():
+            if columns:
+                self._merge_moments(acc, chunk[columns].to_numpy(dtype=float),
+                                    chunk[target].to_numpy(dtype=float))
+        
+        self._update_sample(chunk)
+    
+    def _update_sample(self, chunk):
+        """
+        Keep the rows with the smallest random keys seen so far
+        
+        A uniform sample without replacement of every row folded in (bottom-k
+        sampling); only chunk rows that beat the current largest kept key are copied.
+        """
+        keys = self._rng.random(len(chunk))
+        if self.sample is not None and len(self._sample_keys) >= self.sample_rows:
+            candidates = keys < self._sample_keys.max()
+            chunk, keys = chunk[candidates], keys[candidates]
+        if len(chunk) == 0:
+            return
+        
+        sample = chunk if self.sample is None else pd.concat([self.sample, chunk])
+        keys = np.concatenate([self._sample_keys, keys])
+        if len(keys) > self.sample_rows:
+            keep = np.argpartition(keys, self.sample_rows)[:self.sample_rows]
+            sample, keys = sample.iloc[keep], keys[keep]
+        self.sample, self._sample_keys = sample, keys
+    
+    @staticmethod
+    def _merge_moments(acc, X, y):
+        """
+        Combine one chunk's moments into the running ones for all columns at once
+        
+        Pairwise-complete per column (rows where the column or the target is missing
+        are skipped), merged with the Chan et al. parallel update.
+        """
+        mask = ~(np.isnan(X) | np.isnan(y)[:, None])
+        n = mask.sum(axis=0)
+        safe_n = np.maximum(n, 1)
+        x = np.where(mask, X, 0.0)
+        ys = np.where(mask, y[:, None], 0.0)
+        mx = x.sum(axis=0) / safe_n
+        my = ys.sum(axis=0) / safe_n
+        dx = np.where(mask, X - mx, 0.0)
+        dy = np.where(mask, y[:, None] - my, 0.0)
+        m2x, m2y, cxy = (dx * dx).sum(axis=0), (dy * dy).sum(axis=0), (dx * dy).sum(axis=0)
+        
+        na = acc[0]
+        total = na + n
+        weight = np.divide(na * n, total, out=np.zeros_like(total, dtype=float), where=total > 0)
+        share = np.divide(n, total, out=np.zeros_like(total, dtype=float), where=total > 0)
+        delta_x, delta_y = mx - acc[1], my - acc[2]
+        acc[1] += delta_x * share
+        acc[2] += delta_y * share
+        acc[3] += m2x + delta_x * delta_x * weight
+        acc[4] += m2y + delta_y * delta_y * weight
+        acc[5] += cxy + delta_x * delta_y * weight
+        acc[0] = total
+    
+    def count(self, col):
+        """Number of non-missing values"""
+        return self.rows - self.nulls.get(col, 0)
+    
+    def mean(self, col):
+        count = self.count(col)
+        return self.total[col] / count if count else None
+    
+    def fraction_integral(self, col):
+        count = self.count(col)
+        return self.integral[col] / count if count else 0.0
+    
+    def is_complete_integer(self, col):
+        """Whether a numeric column has no missing values and only integral ones"""
+        return self.nulls.get(col, 0) == 0 and self.integral.get(col) == self.rows
+    
+    def n_unique(self, target):
+        """
+        Distinct non-missing values of a target column
+        
+        Exact below DISTINCT_CAP distinct values; beyond it, the k-minimum-values
+        estimate (k - 1) / h_k, with h_k the largest kept hash scaled to [0, 1),
+        whose relative error is about 1 / sqrt(DISTINCT_CAP).
+        """
+        kept = self.distinct_hashes[target]
+        if len(kept) < DISTINCT_CAP:
+            return len(kept)
+        return int((DISTINCT_CAP - 1) / (float(kept[-1]) / 2.0 ** 64))
+    
+    def sample_values(self, col):
+        """Non-missing values of a column in the row sample"""
+        if self.sample is None:
+            return pd.Series(dtype=float if col in self.numeric else object)
+        return self.sample[col].dropna()
+    
+    def mean_text_length(self, col):
+        """Mean length of a text column's values, from the row sample"""
+        values = self.sample_values(col)
+        return float(values.astype(str).str.len().mean()) if len(values) else 0.0
+    
+    def correlation(self, target, col):
+        """Pearson correlation over rows where both columns are present, or NaN"""
+        columns, acc = self.moments[target]
+        n, _, _, m2x, m2y, cxy = acc[:, columns.index(col)]
+        if n < 2 or m2x <= 0 or m2y <= 0:
+            return float('nan')
+        return cxy / np.sqrt(m2x * m2y)
+
+
+class IngestedCSV:
+    """A CSV streamed once into statistics and, if kept, its rows"""
+    
+    def __init__(self, columns, dtypes, integer_columns, stats, head, frame=None):
+        self.columns = columns
+        self.dtypes = dtypes
+        self.integer_columns = integer_columns
+        self.stats = stats
+        self.head = head
+        self._frame = frame
+    
+    def load(self, columns=None):
+        """Return the dataset, or only the given columns, as a DataFrame"""
+        if self._frame is None:
+            raise ValueError("The rows of this CSV were not kept during ingestion")
+        return self._frame if columns is None else self._frame[list(columns)]
+    
+    def column_types(self):
+        """Dtype names a plain read_csv of the whole file would have produced"""
+        types = {}
+        for col in self.columns:
+            dtype = self.dtypes.get(col)
+            if dtype is None:
+                types[col] = str(self.head[col].dtype)
+            elif col in self.integer_columns and self.stats.is_complete_integer(col):
+                types[col] = 'int64'
+            elif dtype == 'boolean':
+                types[col] = 'object'
+            else:
+                types[col] = dtype
+        return types
+
+
+def _pandas_dtypes(dtypes, boolean=object):
+    """Column dtypes as pandas dtypes, with the given one for booleans with blanks"""
+    return {col: boolean if dtype == 'boolean' else dtype for col, dtype in dtypes.items()}
+
+def _only_booleans(values):
+    """Whether a parsed column holds nothing but booleans and missing values"""
+    if values.dtype.kind == 'f':
+        return bool(values.isna().all())
+    return values.dtype.kind == 'b' or pd.api.types.infer_dtype(values, skipna=True) in ('boolean', 'empty')
+
+def _conform_chunk(chunk, dtypes, integer_columns, strict_integers):
+    """
+    Cast a parsed chunk to the chosen dtypes
+    
+    Returns (chunk, widened), where widened maps the columns whose values in this
+    chunk do not fit their dtype to a wider one: object for text in a numeric or
+    boolean column, 'boolean' (booleans with missing values, held as objects) for
+    blanks in a boolean one and, with strict_integers, float64 for fractions in an
+    integer column. The chunk is not cast if any column was widened.
+    """
+    widened = {}
+    for col in chunk.columns:
+        values = chunk[col]
+        dtype = dtypes.get(col)
+        if dtype == 'float64':
+            if values.dtype.kind not in 'iuf':
+                widened[col] = 'object'
+            elif strict_integers and values.dtype.kind == 'f' and col in integer_columns \
+                    and not (values.dropna() % 1 == 0).all():
+                widened[col] = 'float64'
+        elif dtype is None and values.dtype.kind != 'b':
+            widened[col] = 'boolean' if _only_booleans(values) else 'object'
+        elif dtype == 'boolean' and not _only_booleans(values):
+            widened[col] = 'object'
+    if widened:
+        return chunk, widened
+    
+    casts = {}
+    for col in chunk.columns:
+        dtype = dtypes.get(col)
+        if dtype == 'float64' and chunk[col].dtype.kind != 'f':
+            casts[col] = 'float64'
+        elif dtype == 'boolean':
+            casts[col] = object
+    return (chunk.astype(casts) if casts else chunk), widened
+
+def ingest_csv(source, chunk_rows=INGEST_CHUNK_ROWS, keep_rows=True, sink=None):
+    """
+    Stream a CSV in chunks, accumulating statistics and collecting or forwarding rows
+    
+    Dtypes come from the leading rows. When a later chunk holds values they cannot
+    represent (text in a numeric column, blanks in a boolean one), the column is
+    widened to what a plain read_csv would give and the file is streamed again
+    from the start; a column can only be widened twice (integer to float to
+    object, boolean to booleans with blanks to object), so the number of passes
+    is bounded.
+    
+    Parameters:
+    source: Seekable file object (binary or text) positioned at the start of the CSV
+    chunk_rows: Rows parsed at a time
+    keep_rows: Keep the parsed rows, so load() returns them without parsing again
+    sink: Optional writer of the rows as they are parsed. start(template) is called
+          before every pass with an empty DataFrame of the pass's dtypes (int64 for
+          integer columns, bool for booleans with blanks) and must discard anything written in an earlier pass;
+          write(chunk) gets each chunk. Integer columns arrive as float64 holding
+          integral values or NaN.
+    
+    Returns:
+    IngestedCSV
+    """
+    start = source.tell()
+    sample = pd.read_csv(source, nrows=DTYPE_SAMPLE_ROWS)
+    dtypes, integer_columns = infer_dtypes(sample)
+    columns = sample.columns.tolist()
+    targets = columns[-2:]
+    while True:
+        source.seek(start)
+        stats = ChunkedStats(dtypes, targets)
+        frames = []
+        widened = {}
+        if sink is not None:
+            template = sample.head(0).astype(_pandas_dtypes(dtypes, 'bool'))
+            template = template.astype({col: 'int64' for col in integer_columns})
+            sink.start(template)
+        
+        text_columns = {col: object for col, dtype in dtypes.items() if dtype == 'object'}
+        with pd.read_csv(source, dtype=text_columns, chunksize=chunk_rows) as reader:
+            for chunk in reader:
+                chunk, widened = _conform_chunk(chunk, dtypes, integer_columns,
+                                                strict_integers=sink is not None)
+                if widened:
+                    break
+                stats.update(chunk)
+                if keep_rows:
+                    frames.append(chunk)
+                if sink is not None:
+                    sink.write(chunk)
+        
+        if not widened:
+            break
+        print(f"Column dtypes changed after row {DTYPE_SAMPLE_ROWS}, re-reading with {widened}")
+        dtypes.update(widened)
+        integer_columns = [col for col in integer_columns if col not in widened]
+    
+    frame = None
+    if keep_rows:
+        frame = pd.concat(frames, ignore_index=True) if frames else sample.head(0).astype(_pandas_dtypes(dtypes))
+        for col in integer_columns:
+            if stats.is_complete_integer(col):
+                frame[col] = frame[col].astype('int64')
+    
+    print(f"Ingested {stats.rows} rows x {len(columns)} columns in chunks of {chunk_rows}")
+    return IngestedCSV(columns, dtypes, integer_columns, stats, sample.head(10), frame=frame)
@@ -0,0 +1,191 @@
+# task_detection.py
+
+import numpy as np
+import pandas as pd
+from scipy import stats
+
+
+def detect_task_type_from_stats(dataset):
+    """Decide between regression, classification and nlp from an ingested CSV's statistics"""
+    profile = dataset.stats
+    columns = dataset.columns
+    
+    # Get the target column (last column)
+    target_col = columns[-1]
+    
+    # If target is empty, get second-to-last column in case of ordering issues
+    if profile.count(target_col) == 0 and len(columns) > 1:
+        target_col = columns[-2]
+    
+    # Booleans (with or without blanks) are labels, whatever the other columns hold
+    if dataset.dtypes.get(target_col) in (None, 'boolean'):
+        return "classification"
+    
+    # Get unique values in target (exact, or estimated from the sample on huge targets)
+    num_unique = profile.n_unique(target_col)
+    
+    # Check if the target has numerical values
+    is_numeric = target_col in profile.numeric
+    
+    if is_numeric:
+        # If numeric, check various indicators
+        value_range = profile.maximum.get(target_col, 0) - profile.minimum.get(target_col, 0)
+        fraction_unique = num_unique / profile.count(target_col)
+        
+        # Check if values are mostly integers
+        is_mostly_integer = profile.fraction_integral(target_col) > 0.9
+        
+        # Check if distribution is continuous (using KDE over the bounded row sample)
+        try:
+            target_values = profile.sample_values(target_col)
+            kde = stats.gaussian_kde(target_values)
+            x = np.linspace(target_values.min(), target_values.max(), 1000)
+            y = kde(x)
+            continuity_score = np.std(y) / np.mean(y) if np.mean(y) > 0 else 0
+        except:
+            continuity_score = 0
+        
+        # Check correlation with other numerical features (moments of all columns
+        # were accumulated together, chunk by chunk)
+        avg_correlation = 0
+        correlations = [abs(profile.correlation(target_col, col))
+                        for col in profile.numeric if col != target_col]
+        correlations = [corr for corr in correlations if not pd.isna(corr)]
+        if correlations:
+            avg_correlation = sum(correlations) / len(correlations)
+        
+        # Determine if regression or classification based on multiple factors
+        regression_score = 0
+        regression_score += 1 if fraction_unique > 0.4 else 0
+        regression_score += 1 if not is_mostly_integer else 0
+        regression_score += 1 if value_range > 10 else 0
+        regression_score += 1 if continuity_score < 2 else 0
+        regression_score += 1 if avg_correlation > 0.3 else 0
+        
+        if regression_score >= 3:
+            return "regression"
+        else:
+            return "classification"
+    else:
+        # If target is not numeric, it's likely classification
+        # Check for NLP task - if there are text columns with more than a few words
+        # (average > 15 chars)
+        text_features = any(profile.mean_text_length(col) > 15 for col in profile.text)
+        
+        if text_features:
+            return "nlp"
+        else:
+            return "classification"
+
+def detect_task_type_from_frame(df):
+    """Decide between regression, classification and nlp from a fully loaded DataFrame"""
+    # Get the target column (last column)
+    target_col = df.columns[-1]
+    target_values = df[target_col].dropna()
+    
+    # If target is empty, get second-to-last column in case of ordering issues
+    if len(target_values) == 0 and len(df.columns) > 1:
+        target_col = df.columns[-2]
+        target_values = df[target_col].dropna()
+    
+    # Booleans (with or without blanks) are labels, whatever the other columns hold
+    if pd.api.types.infer_dtype(target_values, skipna=True) == 'boolean':
+        return "classification"
+    
+    # Get unique values in target
+    unique_values = target_values.unique()
+    num_unique = len(unique_values)
+    
+    # Check if the target has numerical values
+    is_numeric = pd.api.types.is_numeric_dtype(target_values)
+    
+    if is_numeric:
+        # If numeric, check various indicators
+        value_range = target_values.max() - target_values.min()
+        fraction_unique = num_unique / len(target_values)
+        
+        # Check if values are mostly integers
+        is_mostly_integer = np.mean([float(x).is_integer() for x in target_values if not pd.isna(x)]) > 0.9
+        
+        # Check if distribution is continuous (using KDE)
+        try:
+            kde = stats.gaussian_kde(target_values)
+            x = np.linspace(target_values.min(), target_values.max(), 1000)
+            y = kde(x)
+            continuity_score = np.std(y) / np.mean(y) if np.mean(y) > 0 else 0
+        except:
+            continuity_score = 0
+        
+        # Check correlation with other numerical features
+        numerical_cols = df.select_dtypes(include=['float64', 'int64']).columns
+        avg_correlation = 0
+        if len(numerical_cols) > 1:
+            correlations = []
+            for col in numerical_cols:
+                if col != target_col:
+                    corr = abs(df[col].corr(df[target_col]))
+                    if not pd.isna(corr):
+                        correlations.append(corr)
+            if correlations:
+                avg_correlation = sum(correlations) / len(correlations)
+        
+        # Determine if regression or classification based on multiple factors
+        regression_score = 0
+        regression_score += 1 if fraction_unique > 0.4 else 0
+        regression_score += 1 if not is_mostly_integer else 0
+        regression_score += 1 if value_range > 10 else 0
+        regression_score += 1 if continuity_score < 2 else 0
+        regression_score += 1 if avg_correlation > 0.3 else 0
+        
+        if regression_score >= 3:
+            return "regression"
+        else:
+            return "classification"
+    else:
+        # If target is not numeric, it's likely classification
+        # Check for NLP task - if there are text columns with more than a few words
+        text_features = False
+        for col in df.columns:
+            if df[col].dtype == 'object' or pd.api.types.is_string_dtype(df[col].dtype):
+                # Check if column contains longer text (average > 15 chars)
+                sample = df[col].dropna().astype(str).sample(min(100, len(df)))
+                if sample.str.len().mean() > 15:
+                    text_features = True
+                    break
+        
+        if text_features:
+            return "nlp"
+        else:
+            return "classification"
+
+
+if __name__ == '__main__':
+    # Check that both detectors agree on bool, string, integer and float targets,
+    # next to a long text column: python task_detection.py
+    import io
+    from tabular_ingestion import ingest_csv
+    
+    rng = np.random.default_rng(0)
+    rows = 500
+    feature = rng.normal(size=rows)
+    targets = {
+        'bool': rng.random(rows) > 0.5,
+        'bool with blanks': np.where(rng.random(rows) > 0.1, rng.random(rows) > 0.5, None),
+        'string': rng.choice(['cat', 'dog', 'bird'], rows),
+        'integer': rng.integers(0, 3, rows),
+        'float': feature * 50 + rng.normal(size=rows),
+    }
+    failed = False
+    for name, target in targets.items():
+        df = pd.DataFrame({
+            'feature': feature,
+            'review': ['a fairly long piece of free text number %d' % i for i in range(rows)],
+            'target': target,
+        })
+        text = df.to_csv(index=False)
+        from_stats = detect_task_type_from_stats(ingest_csv(io.StringIO(text), chunk_rows=100))
+        from_frame = detect_task_type_from_frame(pd.read_csv(io.StringIO(text)))
+        print(f"{name:>16}: stats={from_stats} frame={from_frame}")
+        failed |= from_stats != from_frame
+    if failed:
+        raise SystemExit("The chunked and full-read detectors disagree")
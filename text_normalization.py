@@ -0,0 +1,106 @@
+# text_normalization.py
+
+import os
+import re
+from multiprocessing import Pool
+from sklearn.base import BaseEstimator, TransformerMixin
+from nltk.corpus import stopwords
+from nltk.stem import PorterStemmer, WordNetLemmatizer
+from job_queue import MAX_TRAINING_WORKERS
+
+# Everything that is not an ASCII letter separates tokens
+NON_ALPHA = re.compile('[^a-zA-Z]+')
+
+# Corpora smaller than this are normalized in-process; forking would cost more than it saves
+MIN_PARALLEL_ROWS = 50000
+
+# Rows per chunk handed to a worker process
+CHUNK_ROWS = 20000
+
+# Worker processes used for large corpora; the per-process training budget, so concurrent
+# job workers split the cores instead of each forking one process per CPU
+MAX_NORMALIZER_WORKERS = int(os.getenv('ML_NORMALIZER_WORKERS', MAX_TRAINING_WORKERS))
+
+
+class TokenNormalizer:
+    """
+    Stopword removal, Porter stemming and WordNet lemmatization with a per-token cache
+    
+    Natural text repeats a small vocabulary, so each distinct token is stemmed and
+    lemmatized once and every later occurrence is a dictionary lookup.
+    """
+    
+    def __init__(self):
+        self.stopwords = set(stopwords.words('english'))
+        self.stemmer = PorterStemmer()
+        self.lemmatizer = WordNetLemmatizer()
+        self.cache = {}
+    
+    def normalize_batch(self, texts):
+        """Normalize an iterable of texts into a list of space-joined token strings"""
+        tokenized = [NON_ALPHA.sub(' ', str(text)).lower().split() for text in texts]
+        
+        # Stem and lemmatize each new distinct token once; stopwords map to None
+        cache = self.cache
+        for token in {token for tokens in tokenized for token in tokens}:
+            if token not in cache:
+                cache[token] = (None if token in self.stopwords
+                                else self.lemmatizer.lemmatize(self.stemmer.stem(token)))
+        
+        return [' '.join([cache[token] for token in tokens if cache[token] is not None])
+                for tokens in tokenized]
+
+
+# One normalizer (and cache) per process, created on first use
+_normalizer = None
+
+def _get_normalizer():
+    global _normalizer
+    if _normalizer is None:
+        _normalizer = TokenNormalizer()
+    return _normalizer
+
+def _normalize_chunk(texts):
+    return _get_normalizer().normalize_batch(texts)
+
+def normalize_texts(texts, n_jobs=None):
+    """
+    Normalize a sequence of texts (list, Series or array) for TF-IDF vectorization
+    
+    Large corpora are split into chunks normalized by a pool of n_jobs worker
+    processes (default: MAX_NORMALIZER_WORKERS).
+    """
+    texts = list(texts)
+    if n_jobs is None or n_jobs < 0:
+        n_jobs = MAX_NORMALIZER_WORKERS
+    
+    if len(texts) < MIN_PARALLEL_ROWS or n_jobs <= 1:
+        return _get_normalizer().normalize_batch(texts)
+    
+    chunks = [texts[i:i + CHUNK_ROWS] for i in range(0, len(texts), CHUNK_ROWS)]
+    with Pool(processes=min(n_jobs, len(chunks))) as pool:
+        normalized = pool.map(_normalize_chunk, chunks)
+    return [text for chunk in normalized for text in chunk]
+
+
+class TextNormalizer(BaseEstimator, TransformerMixin):
+    """
+    Scikit-learn transformer applying normalize_texts to the first column of its input
+    
+    Stateless, so it pickles cheaply and can lead a Pipeline in front of a vectorizer.
+    """
+    
+    def __init__(self, n_jobs=None):
+        self.n_jobs = n_jobs
+    
+    def fit(self, X, y=None):
+        return self
+    
+    def transform(self, X):
+        if hasattr(X, 'iloc'):
+            column = X.iloc[:, 0] if X.ndim == 2 else X
+        elif hasattr(X, 'ndim') and X.ndim == 2:
+            column = X[:, 0]
+        else:
+            column = X
+        return normalize_texts(column, n_jobs=self.n_jobs)
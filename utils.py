@@ -1,14 +1,17 @@
 import os
 import zipfile
+import shutil
 import uuid
 import pickle
 import tempfile
 from db_file_system import DBFileSystem
+from file_system_adapter import FileSystemAdapter
 
 # Initialize database file system
 db_fs = DBFileSystem()
+vfs = FileSystemAdapter(db_fs=db_fs)
 
-def generate_loading_code(filename, feature_names, downloads_dir, is_image_model=False, dataset_folder=None, is_object_detection=False):
+def generate_loading_code(filename, feature_names, downloads_dir, is_image_model=False, dataset_folder=None, is_object_detection=False, preprocessor=None):
     """Generate Python code for loading a model and creating predictions"""
     code_template = ""
     
@@ -149,16 +152,46 @@ if uploaded_file is not None:
 """
     else:
         # Code for regular ML models (regression/classification)
+        # best_model.pkl is a pipeline of the fitted preprocessing and the estimator,
+        # so the app passes raw column values and never re-derives features itself
+        preprocessor = preprocessor or {}
+        text_column = preprocessor.get('text_column')
+        categorical_columns = set(preprocessor.get('categorical_columns') or [])
+        label_encoder = preprocessor.get('label_encoder')
+        class_labels = label_encoder.classes_.tolist() if label_encoder is not None else None
+        
         feature_list = ""
-        if feature_names:
+        if text_column is not None:
+            feature_names = [text_column]
+            feature_list += f"    {text_column!r}: st.text_area('Enter {text_column}'),\n"
+        elif feature_names:
             for feature in feature_names:
-                feature_list += f"    '{feature}': st.number_input('Enter {feature}', value=0.0),\n"
+                if feature in categorical_columns:
+                    feature_list += f"    {feature!r}: st.text_input('Enter {feature}'),\n"
+                else:
+                    feature_list += f"    {feature!r}: st.number_input('Enter {feature}', value=0.0),\n"
+        
+        nltk_setup = ""
+        if text_column is not None:
+            nltk_setup = """
+import nltk
+
+# Resources used by the text normalization step of the pipeline
+nltk.download('stopwords', quiet=True)
+nltk.download('wordnet', quiet=True)
+"""
         
         code_template = f"""
 import pickle
 import streamlit as st
 import pandas as pd
 import numpy as np
+{nltk_setup}
+# Raw input columns expected by the pipeline, in training order
+FEATURES = {list(feature_names or [])!r}
+
+# Original target labels, indexed by the encoded class the model predicts
+CLASS_LABELS = {class_labels!r}
 
 # Load the model from file
 def load_model():
@@ -170,6 +203,12 @@ def load_model():
       st.error(f"Error loading model: {{e}}")
       return None
 
+def decode(predictions):
+  # Map encoded classes back to the original labels
+  if CLASS_LABELS is None:
+      return list(predictions)
+  return [CLASS_LABELS[int(p)] for p in predictions]
+
 # Streamlit UI for predictions
 def main():
   st.title("Model Prediction App")
@@ -181,6 +220,8 @@ def main():
   # Display information about the model
   st.write("## Model Information")
   model_type = type(model).__name__
+  if hasattr(model, 'steps'):
+      model_type = f"{{type(model.steps[-1][1]).__name__}} (with fitted preprocessing)"
   st.write(f"Model type: {{model_type}}")
   
   # Create input fields for each feature
@@ -195,7 +236,7 @@ def main():
   if st.button("Predict"):
       try:
           # Create a DataFrame with the input values
-          input_df = pd.DataFrame([user_inputs])
+          input_df = pd.DataFrame([user_inputs], columns=FEATURES)
           
           # Make prediction
           prediction = model.predict(input_df)
@@ -206,14 +247,14 @@ def main():
           # Check if it's a classification or regression model
           if hasattr(model, 'classes_'):
               # Classification model
-              st.write(f"Predicted class: {{prediction[0]}}")
+              st.write(f"Predicted class: {{decode(prediction)[0]}}")
               
               # If model has predict_proba method, show probabilities
               if hasattr(model, 'predict_proba'):
                   try:
                       proba = model.predict_proba(input_df)
                       st.write("### Class Probabilities")
-                      for i, class_name in enumerate(model.classes_):
+                      for i, class_name in enumerate(decode(model.classes_)):
                           st.write(f"{{class_name}}: {{proba[0][i]:.4f}}")
                   except:
                       pass
@@ -223,13 +264,25 @@ def main():
               
       except Exception as e:
           st.error(f"Error making prediction: {{e}}")
+  
+  # Batch predictions: the whole file goes through the pipeline in one vectorized call
+  st.write("## Batch Prediction")
+  batch_file = st.file_uploader("Upload a CSV with the feature columns", type=["csv"])
+  if batch_file is not None:
+      try:
+          batch_df = pd.read_csv(batch_file)
+          batch_df['prediction'] = decode(model.predict(batch_df[FEATURES]))
+          st.dataframe(batch_df)
+          st.download_button("Download predictions", batch_df.to_csv(index=False), "predictions.csv")
+      except Exception as e:
+          st.error(f"Error making batch predictions: {{e}}")
 
 if __name__ == "__main__":
   main()
 """
     
     # For database storage, save to a temporary file first
-    temp_dir = tempfile.gettempdir()
+    temp_dir = tempfile.mkdtemp()
     temp_path = os.path.join(temp_dir, "load_model.py")
     
     # Write the code to the temporary file
@@ -237,14 +290,9 @@ if __name__ == "__main__":
         f.write(code_template.strip())
     
     # Determine if we need to save to database
-    if 'ml_system' in downloads_dir:
+    if vfs.is_db_path(downloads_dir):
         # Extract directory name for database storage
-        parts = downloads_dir.replace('\\', '/').strip('/').split('/')
-        idx = parts.index('ml_system')
-        if idx + 1 < len(parts):
-            dir_name = parts[idx + 1]
-        else:
-            dir_name = 'downloads'  # Default to downloads directory
+        dir_name = vfs.db_directory(downloads_dir) or 'downloads'  # Default to downloads directory
         
         # Save to database
         db_fs.save_file(temp_path, dir_name)
@@ -261,11 +309,11 @@ if __name__ == "__main__":
         shutil.copy2(temp_path, load_model_path)
     
     # Clean up temporary file
-    os.remove(temp_path)
+    shutil.rmtree(temp_dir, ignore_errors=True)
     
     return load_model_path
 
-def write_requirements_file(downloads_dir, is_tensorflow=False, is_yolo=False):
+def write_requirements_file(downloads_dir, is_tensorflow=False, is_yolo=False, is_text=False):
     """Write the requirements.txt file with the necessary dependencies"""
     base_requirements = """
 streamlit
@@ -293,11 +341,14 @@ opencv-python>=4.5.0
 pillow
 """
         requirements = base_requirements + yolo_requirements
+    elif is_text:
+        # The exported pipeline normalizes text with NLTK
+        requirements = base_requirements + "nltk\n"
     else:
         requirements = base_requirements
     
     # Create a temporary file
-    temp_dir = tempfile.gettempdir()
+    temp_dir = tempfile.mkdtemp()
     temp_path = os.path.join(temp_dir, "requirements.txt")
     
     # Write to the temporary file
@@ -305,14 +356,9 @@ pillow
         f.write(requirements.strip())
     
     # Determine if we need to save to database
-    if 'ml_system' in downloads_dir:
+    if vfs.is_db_path(downloads_dir):
         # Extract directory name for database storage
-        parts = downloads_dir.replace('\\', '/').strip('/').split('/')
-        idx = parts.index('ml_system')
-        if idx + 1 < len(parts):
-            dir_name = parts[idx + 1]
-        else:
-            dir_name = 'downloads'  # Default to downloads directory
+        dir_name = vfs.db_directory(downloads_dir) or 'downloads'  # Default to downloads directory
         
         # Save to database
         db_fs.save_file(temp_path, dir_name)
@@ -329,29 +375,24 @@ pillow
         shutil.copy2(temp_path, requirements_path)
     
     # Clean up temporary file
-    os.remove(temp_path)
+    shutil.rmtree(temp_dir, ignore_errors=True)
     
     return requirements_path
 
-def create_project_zip(model_file, models_dir, downloads_dir, is_image_model=False, is_object_detection=False):
+def create_project_zip(model_file, models_dir, downloads_dir, is_image_model=False, is_object_detection=False, is_text_model=False):
     """Create a ZIP file with the model and necessary files, replacing any existing ones"""
     # Create a temporary directory for building the zip
     temp_dir = tempfile.mkdtemp()
     
     # Determine if we're using database storage
-    is_database_models = 'ml_system' in models_dir
-    is_database_downloads = 'ml_system' in downloads_dir
+    is_database_models = vfs.is_db_path(models_dir)
+    is_database_downloads = vfs.is_db_path(downloads_dir)
     
     try:
         # Clear old zip files from the downloads directory
         if is_database_downloads:
             # Extract directory name
-            parts = downloads_dir.replace('\\', '/').strip('/').split('/')
-            idx = parts.index('ml_system')
-            if idx + 1 < len(parts):
-                downloads_dir_name = parts[idx + 1]
-            else:
-                downloads_dir_name = 'downloads'
+            downloads_dir_name = vfs.db_directory(downloads_dir) or 'downloads'
             
             # Get list of existing zip files
             existing_files = db_fs.list_files(downloads_dir_name)
@@ -378,12 +419,7 @@ def create_project_zip(model_file, models_dir, downloads_dir, is_image_model=Fal
             # Add the model file
             if is_database_models:
                 # Extract directory name
-                parts = models_dir.replace('\\', '/').strip('/').split('/')
-                idx = parts.index('ml_system')
-                if idx + 1 < len(parts):
-                    models_dir_name = parts[idx + 1]
-                else:
-                    models_dir_name = 'models'
+                models_dir_name = vfs.db_directory(models_dir) or 'models'
                 
                 # Get the model from database
                 try:
@@ -405,12 +441,7 @@ def create_project_zip(model_file, models_dir, downloads_dir, is_image_model=Fal
             # Add the load_model.py file
             if is_database_downloads:
                 # Extract directory name
-                parts = downloads_dir.replace('\\', '/').strip('/').split('/')
-                idx = parts.index('ml_system')
-                if idx + 1 < len(parts):
-                    downloads_dir_name = parts[idx + 1]
-                else:
-                    downloads_dir_name = 'downloads'
+                downloads_dir_name = vfs.db_directory(downloads_dir) or 'downloads'
                 
                 # Get the file from database
                 try:
@@ -448,13 +479,21 @@ def create_project_zip(model_file, models_dir, downloads_dir, is_image_model=Fal
                 if os.path.exists(requirements_path):
                     zipf.write(requirements_path, arcname="requirements.txt")
             
+            # Text pipelines unpickle their normalization step from this module
+            if is_text_model:
+                zipf.write(os.path.join(os.path.dirname(os.path.abspath(__file__)), "text_normalization.py"),
+                           arcname="text_normalization.py")
+            
             # Add a README file
             readme_content = "# Machine Learning Project\n\n"
             readme_content += "This project contains a trained machine learning model and code to use it.\n\n"
             readme_content += "## Files\n\n"
             readme_content += f"- {model_file}: The trained model\n"
             readme_content += "- load_model.py: Code to load and use the model\n"
-            readme_content += "- requirements.txt: Required Python packages\n\n"
+            readme_content += "- requirements.txt: Required Python packages\n"
+            if is_text_model:
+                readme_content += "- text_normalization.py: Text preprocessing used by the model pipeline\n"
+            readme_content += "\n"
             readme_content += "## Usage\n\n"
             readme_content += "1. Install the required packages: `pip install -r requirements.txt`\n"
             readme_content += "2. Run the app: `streamlit run load_model.py`\n"
@@ -10,10 +10,13 @@ from sklearn.metrics import (confusion_matrix, precision_recall_curve, roc_curve
                              mean_squared_error, r2_score)
 from sklearn.inspection import permutation_importance
 from sklearn.preprocessing import label_binarize
-from scipy import stats
+from scipy import stats, sparse
 import matplotlib.patheffects as path_effects
 from matplotlib.colors import LinearSegmentedColormap
 import itertools  # Added missing import
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor, Future, TimeoutError as FutureTimeoutError
 
 try:
     import google.generativeai as genai
@@ -78,18 +81,70 @@ def apply_modern_style():
         'grid.linestyle': '--',
     })
 
+# Explanation requests in flight at once; each is a blocking network round trip
+GEMINI_MAX_CONCURRENCY = int(os.getenv('GEMINI_MAX_CONCURRENCY', 6))
+
+# Seconds allowed for one explanation, and for all explanations of one set of plots
+GEMINI_TIMEOUT = float(os.getenv('GEMINI_TIMEOUT_SECONDS', 30))
+
+# Shared by every request, so concurrent jobs cannot open unbounded connections
+_explanation_pool = ThreadPoolExecutor(max_workers=GEMINI_MAX_CONCURRENCY, thread_name_prefix='gemini')
+
+# Rows of a sparse test set that are densified for permutation importance
+PERMUTATION_SAMPLE_ROWS = 500
+
+def permutation_importance_data(X_test, y_test):
+    """
+    Test data for permutation_importance, which cannot permute CSR columns
+    
+    Sparse sets (TF-IDF, high-cardinality one-hot) are reduced to a random sample
+    of PERMUTATION_SAMPLE_ROWS rows and densified; dense sets are used as they are.
+    Returns X, y and the number of repeats to use.
+    """
+    if not sparse.issparse(X_test):
+        return X_test, y_test, 30
+    
+    rows = np.random.RandomState(0).permutation(X_test.shape[0])[:PERMUTATION_SAMPLE_ROWS]
+    # Wide text features get fewer repeats, so the plot stays affordable
+    n_repeats = 30 if X_test.shape[1] <= 100 else 5
+    return X_test[rows].toarray(), np.asarray(y_test)[rows], n_repeats
+
 def get_gemini_explanation(data, prompt):
     """Get AI-generated explanation for visualizations using Gemini model"""
     if GEMINI_AVAILABLE:
         try:
             model = genai.GenerativeModel('gemini-2.0-flash')
-            response = model.generate_content(prompt)
+            response = model.generate_content(prompt, request_options={'timeout': GEMINI_TIMEOUT})
             return response.text
         except Exception as e:
             return f"Unable to generate explanation: {str(e)}"
     else:
         return "AI explanations not available (Gemini API not installed)"
 
+def request_gemini_explanation(data, prompt):
+    """Start get_gemini_explanation in the background and return its Future"""
+    return _explanation_pool.submit(get_gemini_explanation, data, prompt)
+
+def resolve_explanations(visualizations, timeout=GEMINI_TIMEOUT):
+    """
+    Replace pending explanation Futures in visualizations with their text
+    
+    All explanations share one deadline, so the wait is about as long as the
+    slowest call rather than the sum of all of them. Plots whose explanation
+    is not ready by then are returned with a placeholder.
+    """
+    deadline = time.monotonic() + timeout
+    for visualization in visualizations:
+        explanation = visualization.get('explanation')
+        if not isinstance(explanation, Future):
+            continue
+        try:
+            visualization['explanation'] = explanation.result(timeout=max(0.0, deadline - time.monotonic()))
+        except FutureTimeoutError:
+            explanation.cancel()
+            visualization['explanation'] = "Unable to generate explanation: the request timed out"
+    return visualizations
+
 def add_style_to_plot(fig, ax, title, xlabel=None, ylabel=None):
     """Add consistent modern styling to a plot"""
     # Add title with glowing effect
@@ -179,7 +234,7 @@ def create_visualization(task_type, y_test, y_pred, best_model, X_test, feature_
             What insights can we draw about the model's classification ability?
             Provide a detailed explanation in 10-12 lines.
             """
-            explanation = get_gemini_explanation(str(cm.tolist()), explanation_prompt)
+            explanation = request_gemini_explanation(str(cm.tolist()), explanation_prompt)
             
             visualizations.append({
                 'title': 'Confusion Matrix',
@@ -255,7 +310,7 @@ def create_visualization(task_type, y_test, y_pred, best_model, X_test, feature_
                 How well can the model distinguish between different classes?
                 Provide insights in 10-12 lines.
                 """
-                explanation = get_gemini_explanation(str(roc_auc), explanation_prompt)
+                explanation = request_gemini_explanation(str(roc_auc), explanation_prompt)
                 
                 visualizations.append({
                     'title': 'Multiclass ROC Curve',
@@ -310,7 +365,7 @@ def create_visualization(task_type, y_test, y_pred, best_model, X_test, feature_
                 How precisely can the model predict each class?
                 Provide detailed insights in 10-12 lines.
                 """
-                explanation = get_gemini_explanation(str(ap_details), explanation_prompt)
+                explanation = request_gemini_explanation(str(ap_details), explanation_prompt)
                 
                 visualizations.append({
                     'title': 'Multiclass Precision-Recall Curve',
@@ -362,7 +417,7 @@ def create_visualization(task_type, y_test, y_pred, best_model, X_test, feature_
             Explain what these numbers mean in the context of {user_prompt} and their implications.
             All in 10 lines paragraph.
             """
-            explanation = get_gemini_explanation(str(cm.tolist()), explanation_prompt)
+            explanation = request_gemini_explanation(str(cm.tolist()), explanation_prompt)
             
             visualizations.append({
                 'title': 'Confusion Matrix',
@@ -430,7 +485,7 @@ def create_visualization(task_type, y_test, y_pred, best_model, X_test, feature_
                 How good is the model at distinguishing between classes?
                 All in 10 lines paragraph.
                 """
-                explanation = get_gemini_explanation(f"AUC: {roc_auc}", explanation_prompt)
+                explanation = request_gemini_explanation(f"AUC: {roc_auc}", explanation_prompt)
                 
                 visualizations.append({
                     'title': 'ROC Curve',
@@ -490,7 +545,7 @@ def create_visualization(task_type, y_test, y_pred, best_model, X_test, feature_
                 What does this tell us about the model's performance?
                 All in 10 lines paragraph.
                 """
-                explanation = get_gemini_explanation(f"AP: {ap_score}", explanation_prompt)
+                explanation = request_gemini_explanation(f"AP: {ap_score}", explanation_prompt)
                 
                 visualizations.append({
                     'title': 'Precision-Recall Curve',
@@ -559,7 +614,7 @@ def create_visualization(task_type, y_test, y_pred, best_model, X_test, feature_
             Explain why these features might be important for {user_prompt} and how they influence the predictions.
             Provide a comprehensive explanation in 10-12 lines.
             """
-            explanation = get_gemini_explanation(str(dict(zip(feature_names, importances))), explanation_prompt)
+            explanation = request_gemini_explanation(str(dict(zip(feature_names, importances))), explanation_prompt)
             
             visualizations.append({
                 'title': 'Feature Importance',
@@ -569,7 +624,8 @@ def create_visualization(task_type, y_test, y_pred, best_model, X_test, feature_
         else:
             # Try permutation importance with enhanced styling if feature_importances_ is not available
             try:
-                result = permutation_importance(best_model, X_test, y_test, n_repeats=30, random_state=0)
+                X_permuted, y_permuted, n_repeats = permutation_importance_data(X_test, y_test)
+                result = permutation_importance(best_model, X_permuted, y_permuted, n_repeats=n_repeats, random_state=0)
                 sorted_idx = result.importances_mean.argsort()[::-1]
                 
                 fig, ax = plt.subplots(figsize=(12, 8))
@@ -633,7 +689,7 @@ def create_visualization(task_type, y_test, y_pred, best_model, X_test, feature_
                 Explain why these features might be important for {user_prompt} and how they influence the predictions.
                 Provide a comprehensive explanation in 10-12 lines.
                 """
-                explanation = get_gemini_explanation(str(dict(zip(feature_names, result.importances_mean))), explanation_prompt)
+                explanation = request_gemini_explanation(str(dict(zip(feature_names, result.importances_mean))), explanation_prompt)
                 
                 visualizations.append({
                     'title': 'Feature Importance (Permutation)',
@@ -706,7 +762,7 @@ def create_visualization(task_type, y_test, y_pred, best_model, X_test, feature_
         How well is the model performing?
         All in 10-12 lines.
         """
-        explanation = get_gemini_explanation(f"R2: {r2}, MSE: {mse}", explanation_prompt)
+        explanation = request_gemini_explanation(f"R2: {r2}, MSE: {mse}", explanation_prompt)
         
         visualizations.append({
             'title': 'Actual vs Predicted Values',
@@ -781,7 +837,7 @@ def create_visualization(task_type, y_test, y_pred, best_model, X_test, feature_
         Are there any patterns or concerns?
         All in 10-12 lines.
         """
-        explanation = get_gemini_explanation(f"Residuals stats: {{'mean': {np.mean(residuals)}, 'std': {np.std(residuals)}}}", explanation_prompt)
+        explanation = request_gemini_explanation(f"Residuals stats: {{'mean': {np.mean(residuals)}, 'std': {np.std(residuals)}}}", explanation_prompt)
         
         visualizations.append({
             'title': 'Residual Plot',
@@ -836,7 +892,7 @@ def create_visualization(task_type, y_test, y_pred, best_model, X_test, feature_
         Explain what this plot tells us about the normality of residuals and its implications for {user_prompt}.
         All in 10-12 lines.
         """
-        explanation = get_gemini_explanation("Q-Q Plot Analysis", explanation_prompt)
+        explanation = request_gemini_explanation("Q-Q Plot Analysis", explanation_prompt)
         
         visualizations.append({
             'title': 'Q-Q Plot',
@@ -912,7 +968,7 @@ def create_visualization(task_type, y_test, y_pred, best_model, X_test, feature_
         Explain what these stats imply about the predictions in the context of {user_prompt}.
         All in 10-12 lines.
         """
-        explanation = get_gemini_explanation(f"Error Distribution stats: {{'mean': {np.mean(residuals)}, 'std': {np.std(residuals)}}}", explanation_prompt)
+        explanation = request_gemini_explanation(f"Error Distribution stats: {{'mean': {np.mean(residuals)}, 'std': {np.std(residuals)}}}", explanation_prompt)
         
         visualizations.append({
             'title': 'Error Distribution',
@@ -982,7 +1038,7 @@ def create_visualization(task_type, y_test, y_pred, best_model, X_test, feature_
             Explain why these features might be important for {user_prompt} and how they influence the predictions.
             Provide a comprehensive explanation in 10-12 lines.
             """
-            explanation = get_gemini_explanation(str(dict(zip(feature_names, importances))), explanation_prompt)
+            explanation = request_gemini_explanation(str(dict(zip(feature_names, importances))), explanation_prompt)
             
             visualizations.append({
                 'title': 'Feature Importance',
@@ -992,7 +1048,8 @@ def create_visualization(task_type, y_test, y_pred, best_model, X_test, feature_
         else:
             # Try permutation importance with enhanced styling if feature_importances_ is not available
             try:
-                result = permutation_importance(best_model, X_test, y_test, n_repeats=30, random_state=0)
+                X_permuted, y_permuted, n_repeats = permutation_importance_data(X_test, y_test)
+                result = permutation_importance(best_model, X_permuted, y_permuted, n_repeats=n_repeats, random_state=0)
                 sorted_idx = result.importances_mean.argsort()[::-1]
                 
                 fig, ax = plt.subplots(figsize=(12, 8))
@@ -1056,7 +1113,7 @@ def create_visualization(task_type, y_test, y_pred, best_model, X_test, feature_
                 Explain why these features might be important for {user_prompt} and how they influence the predictions.
                 Provide a comprehensive explanation in 10-12 lines.
                 """
-                explanation = get_gemini_explanation(str(dict(zip(feature_names, result.importances_mean))), explanation_prompt)
+                explanation = request_gemini_explanation(str(dict(zip(feature_names, result.importances_mean))), explanation_prompt)
                 
                 visualizations.append({
                     'title': 'Feature Importance (Permutation)',
@@ -1067,7 +1124,8 @@ def create_visualization(task_type, y_test, y_pred, best_model, X_test, feature_
                 # Skip if permutation importance fails
                 print(f"Error calculating permutation importance: {e}")
     
-    return visualizations
+    # Explanations were requested as each plot was drawn; collect them together
+    return resolve_explanations(visualizations)
 
 def fig_to_base64(fig):
     """Convert matplotlib figure to base64 encoded string"""
@@ -10,6 +10,7 @@ import os
 import tensorflow as tf
 import matplotlib.patheffects as path_effects
 from matplotlib.colors import LinearSegmentedColormap
+from image_pipeline import predict_image_set
 
 try:
     import google.generativeai as genai
@@ -139,7 +140,8 @@ def create_cnn_visualization(model, training_set, test_set, history=None, user_p
     model: Trained CNN model
     training_set: Training data generator
     test_set: Test data generator
-    history: Training history (if available)
+    history: Training history (if available); its predictions attribute, set by
+             train_image_classification_model, is reused instead of predicting again
     user_prompt: Original user query for context in explanations
     
     Returns:
@@ -152,6 +154,12 @@ def create_cnn_visualization(model, training_set, test_set, history=None, user_p
     if user_prompt is None:
         user_prompt = "image classification task"
     
+    # Every plot below describes the same predictions over the whole test set
+    predictions = getattr(history, 'predictions', None)
+    if predictions is None:
+        print("Predicting the test set for visualizations...")
+        predictions = predict_image_set(test_set, model.predict_on_batch)
+    
     # 1. Confusion Matrix visualization
     try:
         print("Generating confusion matrix for CNN...")
@@ -160,36 +168,12 @@ def create_cnn_visualization(model, training_set, test_set, history=None, user_p
         class_names = list(training_set.class_indices.keys())
         num_classes = len(class_names)
         
-        # Extract a batch of test images and predict
-        test_set.reset()
-        test_images, test_labels = next(test_set)
-        
-        # Get as many samples as available from the test set
-        all_images = []
-        all_labels = []
-        
-        test_set.reset()
-        batch_limit = min(10, test_set.n // test_set.batch_size)  # Limit batches for performance
-        
-        for i in range(batch_limit):
-            try:
-                img_batch, label_batch = next(test_set)
-                all_images.append(img_batch)
-                all_labels.append(label_batch)
-            except StopIteration:
-                break
-        
-        if all_images:
-            X_test = np.vstack(all_images)
-            y_test = np.vstack(all_labels)
-            
-            # Get predictions
-            y_pred_prob = model.predict(X_test)
-            y_pred = np.argmax(y_pred_prob, axis=1)
-            y_true = np.argmax(y_test, axis=1)
+        if len(predictions.y_true):
+            y_pred = predictions.y_pred
+            y_true = predictions.y_true
             
             # Create confusion matrix
-            cm = confusion_matrix(y_true, y_pred)
+            cm = confusion_matrix(y_true, y_pred, labels=range(num_classes))
             
             # Plot confusion matrix with enhanced styling
             fig, ax = plt.subplots(figsize=(10, 8))
@@ -580,23 +564,18 @@ def create_cnn_visualization(model, training_set, test_set, history=None, user_p
     
     # 5. Sample Predictions Visualization
     try:
-        # Get a small batch of test images
-        test_set.reset()
-        test_batch = next(test_set)
-        test_images, test_labels = test_batch
+        # The first test images, with their predictions from the shared pass
+        test_images = predictions.sample_images
         
         # Limit to 9 images for the grid
         num_images = min(9, len(test_images))
         test_images = test_images[:num_images]
-        test_labels = test_labels[:num_images]
-        
-        # Get predictions
-        predictions = model.predict(test_images)
-        predicted_classes = np.argmax(predictions, axis=1)
-        true_classes = np.argmax(test_labels, axis=1)
+        probabilities = predictions.probabilities[:num_images]
+        predicted_classes = predictions.y_pred[:num_images]
+        true_classes = predictions.y_true[:num_images]
         
         # Get class names
-        class_names = list(test_set.class_indices.keys())
+        class_names = predictions.class_names
         
         # Plot the images with predictions
         fig = plt.figure(figsize=(12, 12))
@@ -634,7 +613,7 @@ def create_cnn_visualization(model, training_set, test_set, history=None, user_p
             ])
             
             # Add confidence score
-            confidence = predictions[i][predicted_classes[i]] * 100
+            confidence = probabilities[i][predicted_classes[i]] * 100
             ax.text(0.5, -0.15, f"Confidence: {confidence:.1f}%", 
                    color=PURPLE_LIGHT, ha='center', transform=ax.transAxes,
                    fontsize=10, bbox=dict(facecolor=PURPLE_DARK, alpha=0.7, 
@@ -661,7 +640,7 @@ def create_cnn_visualization(model, training_set, test_set, history=None, user_p
         
         # Add a summary box
         summary_text = (f"Accuracy: {accuracy:.2f} ({correct_count}/{num_images})"
-                       f"\nAvg Confidence: {np.mean(np.max(predictions, axis=1)*100):.1f}%")
+                       f"\nAvg Confidence: {np.mean(np.max(probabilities, axis=1)*100):.1f}%")
         
         fig.text(0.5, 0.02, summary_text, ha='center', va='bottom',
                 color=PURPLE_LIGHT, fontsize=14,
@@ -675,7 +654,7 @@ def create_cnn_visualization(model, training_set, test_set, history=None, user_p
         explanation_prompt = f"""
         Analyze these sample predictions for {user_prompt}:
         - {correct_count} out of {num_images} predictions are correct.
-        - Average confidence: {np.mean(np.max(predictions, axis=1)*100):.1f}%
+        - Average confidence: {np.mean(np.max(probabilities, axis=1)*100):.1f}%
         Explain what these sample predictions tell us about the model's performance.
         What types of images does the model struggle with?
         Provide a detailed analysis in 10-12 lines.
@@ -787,35 +766,13 @@ def create_cnn_visualization(model, training_set, test_set, history=None, user_p
     
     # Optional: Add a prediction confidence distribution visualization
     try:
-        # Get a larger batch of test samples for confidence distribution
-        test_set.reset()
-        all_images = []
-        all_labels = []
-        
-        # Collect more samples for better distribution analysis
-        sample_limit = min(100, test_set.n)  # Limit to 100 samples
-        collected = 0
-        
-        while collected < sample_limit:
-            try:
-                img_batch, label_batch = next(test_set)
-                all_images.append(img_batch)
-                all_labels.append(label_batch)
-                collected += len(img_batch)
-            except StopIteration:
-                break
-        
-        if all_images:
-            X_test_large = np.vstack(all_images)[:sample_limit]
-            y_test_large = np.vstack(all_labels)[:sample_limit]
-            
-            # Get predictions
-            y_pred_prob_large = model.predict(X_test_large)
-            y_pred_large = np.argmax(y_pred_prob_large, axis=1)
-            y_true_large = np.argmax(y_test_large, axis=1)
+        # Confidence of every test prediction from the shared pass
+        if len(predictions.y_true):
+            y_pred_large = predictions.y_pred
+            y_true_large = predictions.y_true
             
             # Get confidence scores
-            confidence_scores = np.max(y_pred_prob_large, axis=1) * 100  # Convert to percentage
+            confidence_scores = predictions.confidence * 100  # Convert to percentage
             
             # Split confidence scores by correct and incorrect predictions
             correct_mask = y_pred_large == y_true_large
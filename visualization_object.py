@@ -13,12 +13,13 @@ import matplotlib.patheffects as path_effects
 from PIL import Image
 import glob
 import pandas as pd
-import tempfile
-import zipfile
 from db_file_system import DBFileSystem
-import shutil
+from materialization_cache import MaterializationCache
+from file_system_adapter import FileSystemAdapter
 # Initialize database file system
 db_fs = DBFileSystem()
+vfs = FileSystemAdapter(db_fs=db_fs)
+materialization_cache = MaterializationCache(db_fs)
 
 try:
     import google.generativeai as genai
@@ -201,21 +202,16 @@ def read_yolo_metrics_from_runs():
 
 def extract_dataset_to_temp(dataset_dir):
     """
-    Extract dataset to a temporary directory for processing visualizations
-    Returns temp_dir path if successful, None otherwise
+    Extract dataset to a local directory for processing visualizations
+    Returns the shared, read-only materialized directory for database datasets,
+    the original dataset_dir otherwise, or None on error
     """
     try:
-        # Create temporary directory
-        temp_dir = tempfile.mkdtemp()
-        print(f"Created temporary directory for visualization: {temp_dir}")
-        
         # If dataset_dir is a database path
-        if 'ml_system' in dataset_dir:
+        if vfs.is_db_path(dataset_dir):
             # Extract directory name
-            parts = dataset_dir.replace('\\', '/').strip('/').split('/')
-            idx = parts.index('ml_system')
-            if idx + 1 < len(parts):
-                dir_name = parts[idx + 1]
+            dir_name = vfs.db_directory(dataset_dir)
+            if dir_name:
                 
                 # Check for yolo_dataset.zip
                 files_in_db = db_fs.list_files(dir_name)
@@ -223,19 +219,10 @@ def extract_dataset_to_temp(dataset_dir):
                 
                 if 'yolo_dataset.zip' in files_in_db:
                     print("Found yolo_dataset.zip in database, extracting...")
-                    zip_content = db_fs.get_file('yolo_dataset.zip', dir_name)
-                    temp_zip_path = os.path.join(temp_dir, 'yolo_dataset.zip')
-                    
-                    with open(temp_zip_path, 'wb') as f:
-                        f.write(zip_content)
-                    
-                    # Extract zip
-                    with zipfile.ZipFile(temp_zip_path, 'r') as zip_ref:
-                        zip_ref.extractall(temp_dir)
-                    
-                    print(f"Extracted dataset to {temp_dir}")
-                    print(f"Contents after extraction: {os.listdir(temp_dir)}")
-                    return temp_dir
+                    # Same cache entry as training, so this is usually already on disk
+                    extracted_dir = materialization_cache.materialize('yolo_dataset.zip', dir_name)
+                    print(f"Contents after extraction: {os.listdir(extracted_dir)}")
+                    return extracted_dir
         
         # If we're here, either not a database path or no zip found
         # Just return the original dataset_dir
@@ -243,9 +230,6 @@ def extract_dataset_to_temp(dataset_dir):
     
     except Exception as e:
         print(f"Error extracting dataset: {e}")
-        # Clean up
-        if 'temp_dir' in locals() and os.path.exists(temp_dir):
-            shutil.rmtree(temp_dir)
         return None
 
 def create_object_detection_visualization(model_dir, dataset_dir, model_info, user_prompt=None):
@@ -268,14 +252,14 @@ def create_object_detection_visualization(model_dir, dataset_dir, model_info, us
     if user_prompt is None:
         user_prompt = "object detection task"
     
-    # Extract dataset to a temporary directory for processing (from database if needed)
+    # Get a local copy of the dataset for processing (from database if needed)
     extracted_dir = extract_dataset_to_temp(dataset_dir)
     if extracted_dir:
         dataset_dir = extracted_dir
         print(f"Using directory for visualizations: {dataset_dir}")
     
     # Get data.yaml path
-    yaml_files = [f for f in os.listdir(dataset_dir) if f.endswith('.yaml')]
+    yaml_files = [f for f in vfs.listdir(dataset_dir) if f.endswith('.yaml')]
     if not yaml_files:
         return [{
             'title': 'Error',
@@ -287,7 +271,7 @@ def create_object_detection_visualization(model_dir, dataset_dir, model_info, us
     
     # Load class names from yaml
     try:
-        with open(yaml_path, 'r') as f:
+        with vfs.open(yaml_path, 'r') as f:
             yaml_data = yaml.safe_load(f)
             
         class_names = yaml_data.get('names', {})
@@ -340,14 +324,7 @@ def create_object_detection_visualization(model_dir, dataset_dir, model_info, us
     except Exception as e:
         print(f"Error creating confusion matrix visualization: {e}")
     
-    # Clean up temporary directory if we created one
-    if extracted_dir and extracted_dir != dataset_dir:
-        try:
-            import shutil
-            shutil.rmtree(extracted_dir)
-            print(f"Cleaned up temporary directory: {extracted_dir}")
-        except Exception as cleanup_error:
-            print(f"Error cleaning up temporary directory: {cleanup_error}")
+    # The extracted directory belongs to the materialization cache, which evicts it
     
     return visualizations
 